@@ -0,0 +1,83 @@
+"""Compare the byte at a time reader which linkins used to read script
+output with util.unbuffered_stream. Run with linkins installed, e.g.,
+with setup.py develop::
+
+    python bench/stream.py [MEGABYTES]
+
+"""
+import sys
+import time
+import subprocess
+
+from linkins import util
+
+
+def _old_unbuffered_stream(proc, stream='stdout'):
+    # The reader before unbuffered_stream read chunks
+    stream = getattr(proc, stream)
+    with stream:
+        while True:
+            out = []
+            last = stream.read(1)
+            if last == '' and proc.poll() is not None:
+                break
+            while last not in util.newlines:
+                if last == '' and proc.poll() is not None:
+                    break
+                out.append(last)
+                last = stream.read(1)
+            out = ''.join(out)
+            yield out
+
+
+def _popen(megabytes, universal_newlines):
+    # About 80 bytes per line, like a chatty build
+    line = 'x' * 79
+    lines = megabytes * 1024 * 1024 / 80
+    cmd = [
+        sys.executable,
+        '-c',
+        'import sys\n'
+        'for i in xrange({lines}):\n'
+        '    sys.stdout.write("{line}\\n")\n'.format(
+            lines=lines,
+            line=line,
+        ),
+    ]
+    return subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        universal_newlines=universal_newlines,
+    )
+
+
+def _time(reader, megabytes, universal_newlines):
+    proc = _popen(megabytes, universal_newlines)
+    start = time.time()
+    lines = 0
+    for line in reader(proc):
+        lines += 1
+    proc.wait()
+    return (time.time() - start, lines)
+
+
+def main():
+    megabytes = 16
+    if len(sys.argv) > 1:
+        megabytes = int(sys.argv[1])
+    readers = [
+        ('read(1)', _old_unbuffered_stream, True),
+        ('chunked', util.unbuffered_stream, False),
+    ]
+    for (name, reader, universal_newlines) in readers:
+        (elapsed, lines) = _time(reader, megabytes, universal_newlines)
+        print '{name:>8}: {lines} lines in {elapsed:.3f}s'.format(
+            name=name,
+            lines=lines,
+            elapsed=elapsed,
+        )
+
+
+if __name__ == '__main__':
+    main()
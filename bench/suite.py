@@ -0,0 +1,274 @@
+"""Time link.make on synthetic target directories. Each tree is
+generated in a tmpfs, /dev/shm if it exists, so the results reflect
+linkins rather than the disk. Run with linkins installed, e.g., with
+setup.py develop::
+
+    python bench/suite.py [--repeat N] [--tree NAME ...]
+
+The results are printed and saved, keyed by tree and mode, to
+bench/results/COMMIT.json where COMMIT is the current git commit. Pass
+the results of another commit with --compare to see how they
+differ::
+
+    python bench/suite.py --compare bench/results/1234abc.json
+
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+
+from linkins import link
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+SCRIPT_NAME = 'linkins-script'
+
+# Lines printed by each script in the scripts tree
+SCRIPT = '''#!/bin/sh
+i=0
+while [ $i -lt {lines} ]; do
+    echo "line $i of a script which prints a lot of output"
+    i=$((i + 1))
+done
+'''
+
+
+def _files(path, count):
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for i in range(count):
+        name = 'file{i}'.format(i=i)
+        with open(os.path.join(path, name), 'w') as fp:
+            fp.write(name)
+
+
+def _wide(srcdir):
+    # A single directory with many files
+    _files(srcdir, 20000)
+
+
+def _deep(srcdir):
+    # A long chain of directories with a few files each
+    path = srcdir
+    for i in range(200):
+        path = os.path.join(path, 'dir{i}'.format(i=i))
+        _files(path, 10)
+
+
+def _small_dirs(srcdir):
+    # Many directories, 20 x 20 x 10, with two files each
+    for i in range(20):
+        for j in range(20):
+            for k in range(10):
+                path = os.path.join(
+                    srcdir,
+                    'dir{i}'.format(i=i),
+                    'dir{j}'.format(j=j),
+                    'dir{k}'.format(k=k),
+                )
+                _files(path, 2)
+
+
+def _scripts(srcdir):
+    # Many directories with a script each which prints a lot
+    for i in range(50):
+        path = os.path.join(srcdir, 'dir{i}'.format(i=i))
+        _files(path, 5)
+        script = os.path.join(path, SCRIPT_NAME)
+        with open(script, 'w') as fp:
+            fp.write(SCRIPT.format(lines=2000))
+        os.chmod(script, 0755)
+
+
+# Many patterns, none of which prune whole directories
+PATTERNS = [
+    'dir{i}/dir{j}/dir9/file1$'.format(i=i, j=j)
+    for i in range(20)
+    for j in range(20)
+]
+
+# Name: (generate, keyword arguments for link.make)
+TREES = [
+    ('wide', (_wide, dict())),
+    ('deep', (_deep, dict())),
+    ('small_dirs', (_small_dirs, dict())),
+    ('patterns', (_small_dirs, dict([('exclude', PATTERNS)]))),
+    ('scripts', (_scripts, dict())),
+]
+
+
+def _modes(srcdir, linkdir, kwargs):
+    """Yield a (mode, function) tuple for each mode to time, in the
+    order they must be run since each mode starts from the link
+    directory left by the previous one.
+
+    """
+    def make(**extra):
+        options = dict(kwargs)
+        options.update(extra)
+        return lambda: link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            scriptname=SCRIPT_NAME,
+            **options
+        )
+    yield ('link', make())
+    yield ('relink', make())
+    yield ('force', make(force=True))
+    yield ('clean', make(clean=True))
+    yield ('run', make(runscript=True))
+    yield ('run-multiprocess', make(runscript=True, multiprocess=True))
+
+
+def _tmpdir(path):
+    if path is None and os.path.isdir('/dev/shm'):
+        path = '/dev/shm'
+    return tempfile.mkdtemp(prefix='linkins-bench-', dir=path)
+
+
+def _time_tree(generate, kwargs, repeat, tmpdir):
+    """Return a dict of the best time, in seconds, of each mode out of
+    repeat runs on a new tree.
+
+    """
+    basedir = _tmpdir(tmpdir)
+    try:
+        srcdir = os.path.join(basedir, 'src')
+        os.makedirs(srcdir)
+        generate(srcdir)
+        times = {}
+        for i in range(repeat):
+            linkdir = os.path.join(basedir, 'link')
+            os.makedirs(linkdir)
+            for (mode, function) in _modes(srcdir, linkdir, kwargs):
+                start = time.time()
+                function()
+                elapsed = time.time() - start
+                times[mode] = min(times.get(mode, elapsed), elapsed)
+            shutil.rmtree(linkdir)
+        return times
+    finally:
+        shutil.rmtree(basedir)
+
+
+def _commit():
+    # The current commit, marked if there are uncommitted changes
+    commit = subprocess.check_output(
+        ['git', 'rev-parse', '--short', 'HEAD'],
+        cwd=BENCH_DIR,
+    ).strip()
+    status = subprocess.check_output(
+        ['git', 'status', '--porcelain', '--untracked-files=no'],
+        cwd=BENCH_DIR,
+    )
+    if status.strip():
+        commit += '-dirty'
+    return commit
+
+
+def _print(results, previous):
+    fmt = '{tree:<12} {mode:<18} {seconds:>10} {change:>9}'
+    print fmt.format(
+        tree='tree',
+        mode='mode',
+        seconds='time (s)',
+        change='change',
+    )
+    for tree in sorted(results):
+        for mode in sorted(results[tree]):
+            seconds = results[tree][mode]
+            change = ''
+            before = previous.get(tree, {}).get(mode)
+            if before:
+                change = '{change:+.1f}%'.format(
+                    change=(seconds - before) / before * 100,
+                )
+            print fmt.format(
+                tree=tree,
+                mode=mode,
+                seconds='{seconds:.3f}'.format(seconds=seconds),
+                change=change,
+            )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Time linkins on synthetic target directories',
+    )
+    parser.add_argument(
+        '--tree',
+        choices=[name for (name, tree) in TREES],
+        nargs='+',
+        help='only time these trees (default: all of them)',
+    )
+    parser.add_argument(
+        '--repeat',
+        metavar='N',
+        default=3,
+        type=int,
+        help='keep the best of N runs (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--tmpdir',
+        metavar='DIR',
+        type=str,
+        help='generate the trees in DIR (default: /dev/shm)',
+    )
+    parser.add_argument(
+        '--compare',
+        metavar='FILE',
+        type=str,
+        help='show the change from the results saved in FILE',
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Script output and warnings would drown the results
+    logging.basicConfig(level=logging.CRITICAL)
+    previous = {}
+    if args.compare is not None:
+        with open(args.compare) as fp:
+            previous = json.load(fp)['results']
+    results = {}
+    for (name, (generate, kwargs)) in TREES:
+        if args.tree and name not in args.tree:
+            continue
+        sys.stderr.write('Timing {name}...\n'.format(name=name))
+        results[name] = _time_tree(
+            generate,
+            kwargs,
+            args.repeat,
+            args.tmpdir,
+        )
+    _print(results, previous)
+    commit = _commit()
+    if not os.path.exists(RESULTS_DIR):
+        os.makedirs(RESULTS_DIR)
+    path = os.path.join(
+        RESULTS_DIR,
+        '{commit}.json'.format(commit=commit),
+    )
+    with open(path, 'w') as fp:
+        json.dump(
+            dict([
+                ('commit', commit),
+                ('repeat', args.repeat),
+                ('results', results),
+            ]),
+            fp,
+            indent=2,
+            sort_keys=True,
+        )
+    sys.stderr.write('Saved {path}\n'.format(path=path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+import hashlib
+
+from linkins.util import scandir, load_state, save_state, CHUNK_SIZE
+
+VERSION = 1
+
+
+def _path(statedir):
+    return os.path.join(statedir, 'scripts.json')
+
+
+def digest(scriptsrc, args):
+    """Return a digest of the arguments a script is run with and of the
+    directory it is in: the names of its entries, the contents of its
+    files, including the script itself, and the targets of its links.
+    Subdirectories only contribute their names.
+
+    """
+    sha = hashlib.sha1()
+    for arg in args:
+        sha.update(arg)
+        sha.update('\0')
+    path = os.path.dirname(scriptsrc)
+    entries = sorted(scandir(path), key=lambda entry: entry.name)
+    for entry in entries:
+        sha.update(entry.name)
+        sha.update('\0')
+        if entry.is_symlink():
+            sha.update('l')
+            sha.update(os.readlink(entry.path))
+        elif entry.is_dir():
+            sha.update('d')
+        else:
+            sha.update('f')
+            with open(entry.path, 'rb') as fp:
+                for chunk in iter(lambda: fp.read(CHUNK_SIZE), ''):
+                    sha.update(chunk)
+        sha.update('\0')
+    return sha.hexdigest()
+
+
+class ScriptCache(object):
+    """The digest (see digest) of the last successful run of each
+    script, keyed by script path. A script whose digest hasn't changed
+    since then need not run again. If rerun, scripts are never fresh
+    but successful runs are still recorded.
+
+    """
+    def __init__(self, digests=None, rerun=False):
+        if digests is None:
+            digests = {}
+        self.digests = digests
+        self.rerun = rerun
+
+    @classmethod
+    def load(cls, statedir, rerun=False):
+        state = load_state(_path(statedir), VERSION, 'script cache')
+        if state is None:
+            return cls(rerun=rerun)
+        return cls(
+            digests=state['digests'],
+            rerun=rerun,
+        )
+
+    def save(self, statedir):
+        state = dict([
+            ('version', VERSION),
+            ('digests', self.digests),
+        ])
+        save_state(_path(statedir), state)
+
+    def fresh(self, scriptsrc, digest):
+        if self.rerun:
+            return False
+        return self.digests.get(scriptsrc) == digest
+
+    def record(self, scriptsrc, digest, returncode):
+        # Only successful runs are kept
+        if returncode == 0:
+            self.digests[scriptsrc] = digest
+        else:
+            self.digests.pop(scriptsrc, None)
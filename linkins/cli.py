@@ -1,7 +1,8 @@
+import time
 import argparse
 import logging
 
-from linkins import link, util
+from linkins import link, stats, util
 
 log = logging.getLogger(__name__)
 
@@ -55,6 +56,18 @@ def parse_args():
         default=False,
         help='replace existing links (default: %(default)s)',
     )
+    parser.add_argument(
+        '--fold',
+        action='store_true',
+        default=False,
+        help=(
+            'link whole directories which do not exist in LINK_DIR '
+            'instead of each of their files, as long as they have no '
+            'script and nothing excluded. They are unfolded when '
+            'another TARGET_DIR has files in them (default: '
+            '%(default)s)'
+        ),
+    )
     parser.add_argument(
         '-c',
         '--clean',
@@ -71,7 +84,19 @@ def parse_args():
         '--multiprocess',
         action='store_true',
         default=False,
-        help='run scripts as subprocesses (default: %(default)s)',
+        help=(
+            'run scripts in the background while linking continues '
+            '(default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--script-jobs',
+        metavar='N',
+        type=int,
+        help=(
+            'with --multiprocess, run up to N scripts concurrently '
+            '(default: the number of CPUs)'
+        ),
     )
     parser.add_argument(
         '-e',
@@ -89,6 +114,124 @@ def parse_args():
         nargs='+',
         help='do not exclude files matching PATTERN from all operations'
     )
+    parser.add_argument(
+        '-n',
+        '--dry-run',
+        action='store_true',
+        default=False,
+        help=(
+            'log the links, directories and scripts that would be '
+            'created, removed or run without doing so (default: '
+            '%(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '-j',
+        '--jobs',
+        metavar='N',
+        default=1,
+        type=int,
+        help=(
+            'walk up to N TARGET_DIRs concurrently. Links are still '
+            'made in the order the TARGET_DIRs are given (default: '
+            '%(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--merge',
+        action='store_true',
+        default=False,
+        help=(
+            'walk all the TARGET_DIRs before linking any and only look '
+            'up each file in LINK_DIR once, for the TARGET_DIR it is '
+            'linked from (default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--state-dir',
+        metavar='STATE_DIR',
+        type=str,
+        help=(
+            'keep a manifest of the links made from each TARGET_DIR '
+            'in STATE_DIR'
+        ),
+    )
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        default=False,
+        help=(
+            'use the manifests in STATE_DIR to only walk the '
+            'directories and make or remove the links of the files '
+            'which changed since the last run. Requires --state-dir '
+            '(default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--cache-scripts',
+        action='store_true',
+        default=False,
+        help=(
+            'skip the scripts which, along with the files in their '
+            'directory, did not change since they last ran '
+            'successfully. Requires --state-dir (default: '
+            '%(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--rerun-scripts',
+        action='store_true',
+        default=False,
+        help=(
+            'run all the scripts even if they did not change. Requires '
+            '--cache-scripts (default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--summary',
+        action='store_true',
+        default=False,
+        help=(
+            'log how many files were linked, replaced, removed, '
+            'excluded or not linked because they already exist '
+            'instead of a line for each file (default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--stats',
+        action='store_true',
+        default=False,
+        help=(
+            'print how many times each operation was carried out and '
+            'how long it took (default: %(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--stats-json',
+        metavar='FILE',
+        type=str,
+        help='write the stats printed by --stats to FILE as JSON',
+    )
+    parser.add_argument(
+        '--conflicts',
+        action='store_true',
+        default=False,
+        help=(
+            'print the files which are in more than one TARGET_DIR and '
+            'the TARGET_DIR each would be linked from instead of '
+            'linking. Exits with status 1 if there are any (default: '
+            '%(default)s)'
+        ),
+    )
+    parser.add_argument(
+        '--conflicts-json',
+        metavar='FILE',
+        type=str,
+        help=(
+            'write the conflicts printed by --conflicts to FILE as JSON '
+            'instead of linking'
+        ),
+    )
     loggroup = parser.add_mutually_exclusive_group()
     loggroup.add_argument(
         '-v',
@@ -108,9 +251,47 @@ def parse_args():
         )
     )
     args = parser.parse_args()
+    if args.incremental and args.state_dir is None:
+        parser.error('--incremental requires --state-dir')
+    if args.incremental and args.fold:
+        parser.error('--incremental can not be used with --fold')
+    if args.cache_scripts and args.state_dir is None:
+        parser.error('--cache-scripts requires --state-dir')
+    if args.rerun_scripts and not args.cache_scripts:
+        parser.error('--rerun-scripts requires --cache-scripts')
+    if args.script_jobs is not None:
+        if not args.multiprocess:
+            parser.error('--script-jobs requires --multiprocess')
+        if args.script_jobs < 1:
+            parser.error('--script-jobs must be at least 1')
     return args
 
 
+def report_conflicts(args, srcdirs):
+    # Return the exit status, so it can be used as a check
+    conflicts = link.conflicts(
+        srcdirs=srcdirs,
+        jobs=args.jobs,
+        scriptname=args.script,
+        exclude=args.exclude,
+        include=args.include,
+        force=args.force,
+    )
+    if args.conflicts:
+        print conflicts.table()
+    if args.conflicts_json is not None:
+        conflicts.save(util.abs_path(args.conflicts_json))
+    if conflicts:
+        log.warn(
+            '{count} files are in more than one target '
+            'directory'.format(
+                count=len(conflicts),
+            )
+        )
+        return 1
+    return 0
+
+
 def main():
     args = parse_args()
     level = logging.INFO
@@ -124,24 +305,43 @@ def main():
         format='%(name)s: %(levelname)s: %(message)s',
     )
 
-    srcdirs = args.srcdir
+    srcdirs = [util.abs_path(srcdir) for srcdir in args.srcdir]
     linkdir = util.abs_path(args.linkdir)
-    for srcdir in srcdirs:
-        srcdir = util.abs_path(srcdir)
-        log.debug(
-            'Processing links from "{srcdir}" to "{linkdir}"...'.format(
-                srcdir=srcdir,
-                linkdir=linkdir,
-            )
-        )
-        link.make(
-            srcdir=srcdir,
-            linkdir=linkdir,
-            scriptname=args.script,
-            runscript=args.run,
-            force=args.force,
-            clean=args.clean,
-            multiprocess=args.multiprocess,
-            exclude=args.exclude,
-            include=args.include,
-        )
+    if args.conflicts or args.conflicts_json is not None:
+        return report_conflicts(args, srcdirs)
+    statedir = None
+    if args.state_dir is not None:
+        statedir = util.abs_path(args.state_dir)
+    recorder = None
+    if args.stats or args.stats_json is not None:
+        recorder = stats.start()
+    start = time.time()
+    link.make_many(
+        srcdirs=srcdirs,
+        linkdir=linkdir,
+        jobs=args.jobs,
+        scriptname=args.script,
+        runscript=args.run,
+        force=args.force,
+        clean=args.clean,
+        multiprocess=args.multiprocess,
+        exclude=args.exclude,
+        include=args.include,
+        dry_run=args.dry_run,
+        statedir=statedir,
+        incremental=args.incremental,
+        scriptjobs=args.script_jobs,
+        cachescripts=args.cache_scripts,
+        rerunscripts=args.rerun_scripts,
+        summary=args.summary,
+        fold=args.fold,
+        merge=args.merge,
+    )
+    if recorder is None:
+        return
+    # The whole run, to compare the operations with
+    recorder.add('total', time.time() - start)
+    if args.stats:
+        print recorder.table()
+    if args.stats_json is not None:
+        recorder.save(util.abs_path(args.stats_json))
@@ -0,0 +1,68 @@
+import json
+
+
+class Conflicts(object):
+    """The files which more than one target directory has, keyed by
+    their path relative to the target directories. Each maps to the
+    target directory the file would be linked from followed by the
+    ones it is shadowed in.
+
+    """
+    def __init__(self, srcdirs=None):
+        if srcdirs is None:
+            srcdirs = {}
+        self.srcdirs = srcdirs
+
+    def __len__(self):
+        return len(self.srcdirs)
+
+    def as_list(self):
+        return [
+            dict([
+                ('path', path),
+                ('linked', self.srcdirs[path][0]),
+                ('shadowed', self.srcdirs[path][1:]),
+            ])
+            for path in sorted(self.srcdirs)
+        ]
+
+    def table(self):
+        """Return the conflicts as a table of lines, one per file sorted
+        by path, e.g.::
+
+            path      linked from    shadowed in
+            .bashrc   /home/dots     /home/work, /home/laptop
+
+        """
+        paths = sorted(self.srcdirs)
+        pathwidth = max([len('path')] + [len(path) for path in paths])
+        linkedwidth = max(
+            [len('linked from')] +
+            [len(self.srcdirs[path][0]) for path in paths]
+        )
+        fmt = '{path:<{pathwidth}}   {linked:<{linkedwidth}}   {shadowed}'
+        lines = [
+            fmt.format(
+                path='path',
+                linked='linked from',
+                shadowed='shadowed in',
+                pathwidth=pathwidth,
+                linkedwidth=linkedwidth,
+            )
+        ]
+        for path in paths:
+            srcdirs = self.srcdirs[path]
+            lines.append(
+                fmt.format(
+                    path=path,
+                    linked=srcdirs[0],
+                    shadowed=', '.join(srcdirs[1:]),
+                    pathwidth=pathwidth,
+                    linkedwidth=linkedwidth,
+                ).rstrip()
+            )
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.as_list(), fp, indent=2, sort_keys=True)
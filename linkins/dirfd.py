@@ -0,0 +1,81 @@
+"""Make and remove links relative to an open directory, with
+symlinkat(2) and unlinkat(2), so the kernel doesn't resolve the whole
+path of the directory again for each one and the directory can't be
+swapped for another between operations. Python 2 has no dir_fd
+arguments so the C library is called through ctypes. supported is
+False where that isn't possible, in which case callers use full paths
+instead.
+
+"""
+import os
+import sys
+import ctypes
+
+try:
+    # The C library is already loaded by the interpreter
+    _libc = ctypes.CDLL(None, use_errno=True)
+    _symlinkat = _libc.symlinkat
+    _unlinkat = _libc.unlinkat
+except (OSError, TypeError, AttributeError):
+    _symlinkat = None
+    _unlinkat = None
+else:
+    _symlinkat.argtypes = [ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p]
+    _symlinkat.restype = ctypes.c_int
+    _unlinkat.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+    _unlinkat.restype = ctypes.c_int
+
+supported = _symlinkat is not None
+
+_flags = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0)
+
+
+def _bytes(path):
+    if isinstance(path, unicode):
+        return path.encode(sys.getfilesystemencoding() or 'utf-8')
+    return path
+
+
+def _check(result, path):
+    # Raise the same error os would have
+    if result != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+
+def symlink(srcpath, fd, name, path=None):
+    # path is only used in errors
+    _check(_symlinkat(_bytes(srcpath), fd, _bytes(name)), path or name)
+
+
+def unlink(fd, name, path=None):
+    _check(_unlinkat(fd, _bytes(name), 0), path or name)
+
+
+class OpenDir(object):
+    """Keep the last directory a path was split in open so the
+    operations on the files of a directory, which are planned
+    together, all use the same file descriptor.
+
+    """
+    def __init__(self):
+        self.path = None
+        self.fd = None
+
+    def split(self, path):
+        """Return the file descriptor of path's directory, opening it
+        if it isn't the open one, and path's name in it.
+
+        """
+        (dirpath, name) = os.path.split(path)
+        if dirpath != self.path:
+            self.close()
+            self.fd = os.open(dirpath, _flags)
+            self.path = dirpath
+        return (self.fd, name)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.path = None
+        self.fd = None
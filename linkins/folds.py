@@ -0,0 +1,69 @@
+import os
+import errno
+
+from linkins.util import load_state, save_state
+
+VERSION = 1
+
+# Kept in the link directory
+NAME = '.linkins-folds'
+
+
+def _path(linkdir):
+    return os.path.join(linkdir, NAME)
+
+
+def _readlink(path):
+    try:
+        return os.readlink(path)
+    except OSError:
+        # Not a link or gone
+        return None
+
+
+class FoldList(object):
+    """The links to whole directories which linkins made in a link
+    directory, by folding them or by unfolding their parents, keyed by
+    link path and mapping to the directory they link to. It is kept in
+    the link directory itself so that every run finds all the folds,
+    whichever target directories they were made from. Any other link
+    to a directory is the user's.
+
+    """
+    def __init__(self, links=None):
+        if links is None:
+            links = {}
+        self.links = links
+        # As saved, so an unchanged list isn't saved again
+        self._saved = dict(links)
+
+    @classmethod
+    def load(cls, linkdir):
+        state = load_state(_path(linkdir), VERSION, 'fold list')
+        if state is None:
+            return cls()
+        return cls(links=state['links'])
+
+    def save(self, linkdir):
+        # Only the links which are still there
+        links = dict([
+            (linkpath, target)
+            for (linkpath, target) in self.links.iteritems()
+            if _readlink(linkpath) == target
+        ])
+        if links == self._saved:
+            return
+        self._saved = links
+        path = _path(linkdir)
+        if not links:
+            try:
+                os.unlink(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise
+            return
+        state = dict([
+            ('version', VERSION),
+            ('links', links),
+        ])
+        save_state(path, state)
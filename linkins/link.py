@@ -1,232 +1,1370 @@
-import re
 import os
-import errno
+import re
 import logging
+import threading
+import itertools
+
+from multiprocessing.pool import ThreadPool
 
-from linkins import script
+from linkins import match, script, stats
+from linkins.util import scandir
+from linkins.cache import ScriptCache
+from linkins.conflicts import Conflicts
+from linkins.folds import FoldList
+from linkins.manifest import Manifest
+from linkins.plan import DirCache, LinkPlan, Executor, DryRunExecutor
 
 log = logging.getLogger(__name__)
 
+# Files of patterns which exclude paths beneath their directory
+IGNORE_NAME = '.linkinsignore'
 
-def _unlink(linkpath):
-    try:
-        os.unlink(linkpath)
-    except OSError, e:
-        # It's OK if the link disappeared
-        if e.errno != errno.ENOENT:
-            raise
+
+class Summary(object):
+    """Count what happens to the files of a run, by kind, instead of
+    logging a line for each file, and log the counts once at the end
+    of the run. Kinds are counted from many threads.
+
+    """
+    # The kinds logged, in order, with their level and message
+    kinds = [
+        ('linked', logging.INFO, 'Linked %d files'),
+        ('exists', logging.WARN, '%d files already exist. Not linking.'),
+        ('replaced', logging.INFO, 'Replaced %d existing files'),
+        ('unchanged', logging.INFO, 'Left %d correct links unchanged'),
+        ('folded', logging.INFO, 'Folded %d directories'),
+        ('unfolded', logging.INFO, 'Unfolded %d directories'),
+        (
+            'overridden',
+            logging.INFO,
+            '%d files are linked from another target directory. '
+            'Not linking.',
+        ),
+        ('removed', logging.INFO, 'Removed %d links'),
+        ('stale', logging.INFO, 'Removed %d stale links'),
+        ('excluded_dirs', logging.INFO, 'Excluded %d directories'),
+        ('excluded_files', logging.INFO, 'Excluded %d files'),
+    ]
+
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, count=1):
+        with self._lock:
+            self.counts[kind] = self.counts.get(kind, 0) + count
+
+    def log(self):
+        for (kind, level, msg) in self.kinds:
+            count = self.counts.get(kind)
+            if count:
+                log.log(level, msg, count)
 
 
-def _clean_empty_dirs(path, linkdir):
-    if os.listdir(path) != [] or path == linkdir:
+def _log_file(summary, kind, method, msg, path):
+    """Log msg, a %-style format string, with path using the log
+    method or, if there is a summary, only count path as kind in it.
+    Messages are only formatted if they are logged at a level which
+    is enabled since this is called for every file.
+
+    """
+    if summary is not None:
+        summary.add(kind)
         return
-    os.rmdir(path)
-    parent = os.path.dirname(path)
-    _clean_empty_dirs(parent, linkdir)
+    method(msg, path)
 
 
-def _clean(
+def _join_tail(pathtail, name):
+    # Avoid paths like ./foo
+    if pathtail == '.':
+        return name
+    return os.path.join(pathtail, name)
+
+
+def _listdir(path, pathtail):
+    """Return the (dirs, files, links) of path, where links are the
+    names in dirs which are symlinks. The type information in each
+    directory entry is reused so no extra stat is needed per file.
+
+    """
+    dirs = []
+    files = []
+    links = set()
+    with stats.timer('walk'):
+        for entry in scandir(path):
+            # is_dir follows symlinks, like os.path.isdir in os.walk
+            if entry.is_dir():
+                dirs.append(entry.name)
+                if entry.is_symlink():
+                    links.add(entry.name)
+            else:
+                files.append(entry.name)
+    # Same order, for unittests
+    files.sort()
+    dirs.sort()
+    return (dirs, files, links)
+
+
+def _walk(srcdir, listdir=_listdir):
+    """Like os.walk but built on scandir. Yields a (path, pathtail,
+    dirs, files) tuple for each directory in srcdir, top-down and in
+    sorted order, where pathtail is the path relative to srcdir and is
+    carried down instead of being recomputed. Like os.walk, symlinks
+    to directories are listed in dirs but are not followed and dirs
+    can be pruned in place by the caller. listdir is called with each
+    path and pathtail to list directories (see _listdir).
+
+    """
+    stack = [(srcdir, '.')]
+    while stack:
+        (path, pathtail) = stack.pop()
+        try:
+            (dirs, files, links) = listdir(path, pathtail)
+        except OSError:
+            # Like os.walk, ignore directories which can't be listed
+            continue
+        yield (path, pathtail, dirs, files)
+        # Reversed so the first directory is popped first
+        for dir_ in reversed(dirs):
+            if dir_ in links:
+                continue
+            stack.append((
+                os.path.join(path, dir_),
+                _join_tail(pathtail, dir_),
+            ))
+
+
+def _manifest_listdir(manifest, previous, changed):
+    """Return a listdir for _walk which records the modification
+    time, inode and listing of each directory in manifest. The listing
+    recorded in the previous manifest, if any, is reused for the
+    directories whose modification time and inode are the same, since
+    no entries have been added, removed or renamed in them. The
+    pathtail of all other directories is added to changed. Editing an
+    ignore file doesn't change its directory's modification time so
+    its own is recorded too and, if it changed, the pathtails of the
+    directory and all of the directories beneath it are added to
+    changed.
+
+    """
+    # The directories whose ignore file changed
+    rescoped = set()
+
+    def listdir(path, pathtail):
+        # Stat before listing so that changes made while listing are
+        # seen in the next run
+        with stats.timer('stat'):
+            stat = os.stat(path)
+        state = None
+        if previous is not None:
+            state = previous.dirs.get(pathtail)
+        if (
+                state is not None and
+                state['mtime'] == stat.st_mtime and
+                state['inode'] == stat.st_ino
+        ):
+            dirs = list(state['dirs'])
+            files = list(state['files'])
+            links = set(state['symlinks'])
+        else:
+            (dirs, files, links) = _listdir(path, pathtail)
+            changed.add(pathtail)
+        ignore = None
+        if IGNORE_NAME in files:
+            with stats.timer('stat'):
+                ignore = os.stat(os.path.join(path, IGNORE_NAME)).st_mtime
+        previous_ignore = None
+        if state is not None:
+            previous_ignore = state.get('ignore')
+        if ignore != previous_ignore:
+            rescoped.add(pathtail)
+        for tail in ['.'] + _tails(pathtail):
+            if tail in rescoped:
+                changed.add(pathtail)
+                break
+        manifest.dirs[pathtail] = dict([
+            ('mtime', stat.st_mtime),
+            ('inode', stat.st_ino),
+            ('dirs', list(dirs)),
+            ('files', list(files)),
+            ('symlinks', sorted(links)),
+            ('ignore', ignore),
+        ])
+        return (dirs, files, links)
+    return listdir
+
+
+def _link_path(linkdir, pathtail):
+    # Avoid a possible . at the end of path, e.g., "/foo/."
+    if pathtail == '.':
+        return linkdir
+    return os.path.join(linkdir, pathtail)
+
+
+def _readlink(path):
+    try:
+        with stats.timer('readlink'):
+            return os.readlink(path)
+    except OSError:
+        # Not a link or gone
+        return None
+
+
+def _keep(
+        plan,
+        previous,
         files,
         path,
-        srcdir,
+        pathtail,
         linkdir,
+        unchanged,
+        freed,
 ):
-    pathtail = os.path.relpath(path, srcdir)
-    linkpath = os.path.join(linkdir, pathtail)
-    # Avoid a possible . at the end of path, e.g., "/foo/."
-    linkpath = os.path.normpath(linkpath)
+    """Keep the links made in the previous run which still point to
+    files and return the files which still need to be linked. Nothing
+    needs linking in directories which haven't changed, but for the
+    link paths in freed.
+
+    """
+    linkpath = _link_path(linkdir, pathtail)
+    result = []
     for file_ in files:
+        srcpath = os.path.join(path, file_)
         linkfile = os.path.join(linkpath, file_)
-        if os.path.lexists(linkfile):
-            log.debug(
-                '{linkfile} exists. Removing.'.format(
-                    linkfile=linkfile,
-                )
+        if linkfile in freed:
+            # Whatever the manifest says, the link was just removed
+            result.append(file_)
+            continue
+        if previous.links.get(linkfile) == srcpath:
+            plan.keep(srcpath, linkfile)
+            continue
+        if not unchanged:
+            result.append(file_)
+    return result
+
+
+def _unlink_stale(
+        plan,
+        scan,
+        previous,
+        freed,
+):
+    """Remove the links made in the previous run whose source files
+    are gone. Their link paths are added to freed.
+
+    """
+    srcpaths = set()
+    for (path, pathtail, files, scriptsrc) in scan:
+        for file_ in files:
+            srcpaths.add(os.path.join(path, file_))
+    for (linkpath, srcpath) in sorted(previous.links.iteritems()):
+        if srcpath in srcpaths:
+            continue
+        # Leave links which were changed by someone else alone
+        if _readlink(linkpath) != srcpath:
+            continue
+        _log_file(
+            plan.summary,
+            'stale',
+            log.debug,
+            '%s is stale. Removing.',
+            linkpath,
+        )
+        plan.unlink(linkpath)
+        plan.prune(os.path.dirname(linkpath))
+        freed.add(linkpath)
+
+
+def _clean(
+        plan,
+        files,
+        pathtail,
+        linkdir,
+):
+    linkpath = _link_path(linkdir, pathtail)
+    if not plan.dirs.exists(linkpath):
+        return
+    for file_ in files:
+        linkfile = os.path.join(linkpath, file_)
+        with stats.timer('stat'):
+            exists = os.path.lexists(linkfile)
+        if exists:
+            _log_file(
+                plan.summary,
+                'removed',
+                log.debug,
+                '%s exists. Removing.',
+                linkfile,
             )
-            _unlink(linkfile)
-    if os.path.exists(linkpath):
-        _clean_empty_dirs(linkpath, linkdir)
+            plan.unlink(linkfile)
+    plan.prune(linkpath)
+
+
+def _excluded_file(matcher, filetail):
+    # Like in a walk, a file is excluded if it or the directory it is
+    # in are
+    pathtail = os.path.dirname(filetail) or '.'
+    return matcher.excluded(pathtail) or matcher.excluded(filetail)
+
+
+def _clean_links(
+        plan,
+        previous,
+        srcdir,
+        linkdir,
+        matcher,
+):
+    """Remove the links recorded in the previous manifest without
+    walking srcdir, which might even be gone. Only links which still
+    point into srcdir are removed. Excluded links are kept.
+
+    """
+    srcprefix = os.path.join(srcdir, '')
+    for (linkpath, srcpath) in sorted(previous.links.iteritems()):
+        filetail = os.path.relpath(srcpath, srcdir)
+        if _excluded_file(matcher, filetail):
+            plan.keep(srcpath, linkpath)
+            continue
+        target = _readlink(linkpath)
+        if target is None or not target.startswith(srcprefix):
+            continue
+        _log_file(
+            plan.summary,
+            'removed',
+            log.debug,
+            '%s exists. Removing.',
+            linkpath,
+        )
+        plan.unlink(linkpath)
+        plan.prune(os.path.dirname(linkpath))
+    plan.prune_dirs(linkdir)
 
 
 def _link(
+        plan,
         files,
         path,
-        srcdir,
+        pathtail,
         linkdir,
         force,
+        record=False,
 ):
+    # If record, the links already in place are kept in plan
+    if not files:
+        return
+    pathexist = _link_path(linkdir, pathtail)
+    if not plan.dirs.exists(pathexist):
+        plan.mkdir(pathexist)
+        # Nothing can exist in a directory which doesn't
+        for file_ in files:
+            plan.symlink(
+                os.path.join(path, file_),
+                os.path.join(pathexist, file_),
+            )
+        return
     for file_ in files:
         srcpath = os.path.join(path, file_)
-        pathtail = os.path.relpath(srcpath, srcdir)
-        linkpath = os.path.join(linkdir, pathtail)
-        pathexist = os.path.dirname(linkpath)
-        if not os.path.exists(pathexist):
-            os.makedirs(pathexist)
-        if os.path.lexists(linkpath):
-            if not force:
-                log.warn(
-                    '{linkpath} already exists. Not linking.'.format(
-                        linkpath=linkpath,
-                    )
+        linkpath = os.path.join(pathexist, file_)
+        target = None
+        if force:
+            # Links are only replaced if they point somewhere else
+            target = _readlink(linkpath)
+            if target == srcpath:
+                _log_file(
+                    plan.summary,
+                    'unchanged',
+                    log.debug,
+                    '%s already links to its file. Not replacing.',
+                    linkpath,
                 )
+                plan.keep(srcpath, linkpath)
                 continue
-            log.debug(
-                '{linkpath} already exists. Replacing.'.format(
-                    linkpath=linkpath,
+        # Only a link has a target
+        exists = target is not None
+        if not exists:
+            with stats.timer('stat'):
+                exists = os.path.lexists(linkpath)
+        if exists:
+            if not force:
+                _log_file(
+                    plan.summary,
+                    'exists',
+                    log.warn,
+                    '%s already exists. Not linking.',
+                    linkpath,
                 )
+                if record and _readlink(linkpath) == srcpath:
+                    plan.keep(srcpath, linkpath)
+                continue
+            _log_file(
+                plan.summary,
+                'replaced',
+                log.debug,
+                '%s already exists. Replacing.',
+                linkpath,
             )
-            _unlink(linkpath)
-        os.symlink(srcpath, linkpath)
+            plan.unlink(linkpath)
+        plan.symlink(srcpath, linkpath)
 
 
 def _script(
+        plan,
         scriptsrc,
+        pathtail,
         srcdir,
         linkdir,
         multiprocess,
 ):
-    scriptdir = os.path.dirname(scriptsrc)
-    scripttail = os.path.relpath(scriptdir, srcdir)
-    scriptdst = os.path.join(linkdir, scripttail)
+    scriptdst = _link_path(linkdir, pathtail)
     name = os.path.basename(scriptsrc)
-    name = os.path.join(scripttail, name)
-    if not os.path.exists(scriptdst):
-        os.makedirs(scriptdst)
-    log.debug(
-        'Running script {name}'.format(
-            name=name,
-        )
-    )
-    script.runscript(
+    name = os.path.join(pathtail, name)
+    plan.mkdir(scriptdst)
+    plan.script(
         scriptsrc,
         srcdir,
         linkdir,
-        scripttail,
+        pathtail,
         name=name,
         multiprocess=multiprocess,
     )
 
 
-def _exclude_regex(
-        path,
-        exclude,
-        include,
+def _tails(pathtail):
+    # pathtail and the pathtails of its parents, top-down, without "."
+    if pathtail == '.':
+        return []
+    parts = pathtail.split(os.sep)
+    return [
+        os.sep.join(parts[:i])
+        for i in range(1, len(parts) + 1)
+    ]
+
+
+def _fold_dir(
+        plan,
+        folded,
+        pathtail,
+        srcdir,
+        linkdir,
+        clean,
+        folds,
+        foldlist,
 ):
-    for exclude_regex in exclude:
-        if not exclude_regex.match(path):
-            continue
-        for include_regex in include:
-            if include_regex.match(path):
-                return False
+    """Fold, unfold or remove the directory pathtail in linkdir, as
+    needed, and return whether the whole directory was taken care of
+    so that nothing beneath it needs to be. folded maps the links to
+    directories planned so far, which aren't there yet, to their
+    targets. If folds is given, the directories in it are folded.
+    Only the links in folded or in the FoldList foldlist are taken
+    for folds, any other links to directories are left as they are.
+    foldlist is kept up to date with what is planned.
+
+    """
+    linkpath = os.path.join(linkdir, pathtail)
+    srcpath = os.path.join(srcdir, pathtail)
+    if linkpath in folded:
+        target = folded[linkpath]
+    elif (
+            linkpath in foldlist.links or
+            folds is not None and pathtail in folds
+    ):
+        target = _readlink(linkpath)
+    else:
+        return False
+    if target is None:
+        if clean or folds is None or pathtail not in folds:
+            return False
+        if plan.dirs.exists(linkpath):
+            return False
+        _log_file(
+            plan.summary,
+            'folded',
+            log.debug,
+            'Folding %s',
+            linkpath,
+        )
+        plan.mkdir(os.path.dirname(linkpath))
+        plan.fold(srcpath, linkpath)
+        foldlist.links[linkpath] = srcpath
+        return True
+    if target == srcpath:
+        if clean:
+            _log_file(
+                plan.summary,
+                'removed',
+                log.debug,
+                '%s exists. Removing.',
+                linkpath,
+            )
+            plan.unlink(linkpath)
+            plan.prune(os.path.dirname(linkpath))
+            foldlist.links.pop(linkpath, None)
+            return True
+        if folds is not None and pathtail in folds:
+            plan.keep(srcpath, linkpath)
+            foldlist.links[linkpath] = srcpath
+            return True
+        # Its files are linked one by one in a new directory instead
+        _log_file(
+            plan.summary,
+            'unfolded',
+            log.debug,
+            'Unfolding %s',
+            linkpath,
+        )
+        plan.unlink(linkpath)
+        plan.dirs.discard(linkpath)
+        foldlist.links.pop(linkpath, None)
+        return False
+    if target != folded.get(linkpath, foldlist.links.get(linkpath)):
+        # Not linkins'
+        return False
+    if not os.path.isdir(target):
+        return False
+    if clean:
+        # Another target directory's
         return True
+    # Make room for the files of this target directory
+    _log_file(
+        plan.summary,
+        'unfolded',
+        log.debug,
+        'Unfolding %s',
+        linkpath,
+    )
+    with stats.timer('walk'):
+        entries = sorted(scandir(target), key=lambda entry: entry.name)
+    plan.unfold(linkpath, target, [entry.name for entry in entries])
+    foldlist.links.pop(linkpath, None)
+    for entry in entries:
+        entrylink = os.path.join(linkpath, entry.name)
+        folded[entrylink] = entry.path
+        # Its links to directories are folds too
+        if entry.is_dir():
+            foldlist.links[entrylink] = entry.path
     return False
 
 
-def _exclude(
+def _folded(
+        plan,
+        folded,
+        seen,
+        pathtail,
         srcdir,
-        path,
+        linkdir,
+        clean,
+        folds,
+        foldlist,
+):
+    """Return whether the directory pathtail, or one of its parents,
+    was taken care of as a whole by _fold_dir, which is called once
+    per directory. seen maps the pathtails already checked to
+    _fold_dir's result.
+
+    """
+    for tail in _tails(pathtail):
+        if tail not in seen:
+            seen[tail] = _fold_dir(
+                plan,
+                folded,
+                tail,
+                srcdir,
+                linkdir,
+                clean,
+                folds,
+                foldlist,
+            )
+        if seen[tail]:
+            return True
+    return False
+
+
+def _exclude(
+        pathtail,
         files,
-        exclude,
-        include,
+        matcher,
+        summary=None,
+        filematcher=None,
 ):
-    pathtail = os.path.relpath(path, srcdir)
-    if _exclude_regex(
+    # The files are matched by filematcher, if given
+    if filematcher is None:
+        filematcher = matcher
+    if matcher.excluded(pathtail):
+        _log_file(
+            summary,
+            'excluded_dirs',
+            log.debug,
+            'Excluding directory %s',
             pathtail,
-            exclude,
-            include,
-    ):
-        log.debug(
-            'Excluding directory {pathtail}'.format(
-                pathtail=pathtail,
-            )
         )
         return
     result = []
     for file_ in files:
-        filetail = os.path.join(pathtail, file_)
-        # Avoid paths like ./foo
-        filetail = os.path.normpath(filetail)
-        if _exclude_regex(
+        filetail = _join_tail(pathtail, file_)
+        if filematcher.excluded(filetail):
+            _log_file(
+                summary,
+                'excluded_files',
+                log.debug,
+                'Excluding file %s',
                 filetail,
-                exclude,
-                include,
-        ):
-            log.debug(
-                'Excluding file {filetail}'.format(
-                    filetail=filetail,
-                )
             )
             continue
         result.append(file_)
     return result
 
 
-def make(
+def _ignore(path):
+    """Return the Matcher of the ignore file path, or None if it can't
+    be read. Each line is an exclude pattern, or an include pattern
+    if it starts with !, except for empty lines and lines starting
+    with #.
+
+    """
+    exclude = []
+    include = []
+    try:
+        with stats.timer('walk'):
+            with open(path) as fp:
+                lines = fp.read().splitlines()
+    except IOError, e:
+        log.warn(
+            'Ignoring {path}: {error}'.format(
+                path=path,
+                error=e.strerror,
+            )
+        )
+        return None
+    for line in lines:
+        if not line.strip() or line.startswith('#'):
+            continue
+        if line.startswith('!'):
+            include.append(line[1:])
+        else:
+            exclude.append(line)
+    try:
+        return match.Matcher(exclude, include)
+    except re.error, e:
+        raise ValueError(
+            'Bad pattern in "{path}": {error}'.format(
+                path=path,
+                error=e,
+            )
+        )
+
+
+def _folds(walked):
+    """Return the pathtails of the directories in walked, a list of
+    (pathtail, children, whole) tuples in the order they were walked,
+    which can be linked as a whole: those which are whole themselves,
+    i.e., have no script and nothing excluded, and whose children were
+    all walked and can be linked as a whole too. The top-level
+    directory never can.
+
+    """
+    result = set()
+    # Children are walked after their parents
+    for (pathtail, children, whole) in reversed(walked):
+        if whole and all(child in result for child in children):
+            result.add(pathtail)
+    result.discard('.')
+    return result
+
+
+def _scan(
         srcdir,
         linkdir,
-        scriptname=None,
-        runscript=False,
-        force=False,
-        clean=False,
-        multiprocess=False,
-        exclude=None,
-        include=None,
+        scriptname,
+        matcher,
+        listdir=_listdir,
+        summary=None,
+        folds=None,
 ):
-    if exclude is None:
-        exclude = []
-    if include is None:
-        include = []
+    """Walk srcdir and return a list of (path, pathtail, files,
+    scriptsrc) tuples, one for each directory with files to
+    process. Only srcdir is read so scans of different target
+    directories can run concurrently. Exclusions are counted in
+    summary, if given, instead of being logged. If folds is given, the
+    pathtails of the directories which can be linked as a whole are
+    added to it (see _folds). linkdir is None if it won't be linked.
+    The ignore files found, which are never linked, are compiled
+    (see _ignore) and only matched against the paths beneath their
+    directory, along with matcher.
+
+    """
     if not os.path.exists(srcdir):
         raise ValueError(
             'Target directory "{srcdir}" does not exist'.format(
                 srcdir=srcdir,
             )
         )
-    if not os.path.exists(linkdir):
+    if linkdir is not None and not os.path.exists(linkdir):
         raise ValueError(
             'Link directory "{linkdir}" does not exist'.format(
                 linkdir=linkdir,
             )
         )
-    exclude_regex = [re.compile(file_) for file_ in exclude]
-    include_regex = [re.compile(file_) for file_ in include]
-    for (path, dirs, files) in os.walk(srcdir):
-        # Same order, for unittests
-        files.sort()
-        dirs.sort()
-        files = _exclude(
-            srcdir,
-            path,
-            files,
-            exclude_regex,
-            include_regex,
-        )
+    result = []
+    walked = []
+    # The Matcher or match.Scope of the files in each directory
+    scopes = {}
+    for (path, pathtail, dirs, files) in _walk(srcdir, listdir):
+        count = len(files)
+        # A directory is matched by its parents' ignore files only
+        dirscope = matcher
+        if pathtail != '.':
+            dirscope = scopes[os.path.dirname(pathtail) or '.']
+        filescope = dirscope
+        if IGNORE_NAME in files:
+            files.remove(IGNORE_NAME)
+            ignore = _ignore(os.path.join(path, IGNORE_NAME))
+            if ignore is not None:
+                filescope = dirscope.child(pathtail, ignore)
+        scopes[pathtail] = filescope
+        # The directory and each of its files
+        with stats.timer('exclude', count + 1):
+            files = _exclude(
+                pathtail,
+                files,
+                dirscope,
+                summary,
+                filescope,
+            )
+        if folds is not None:
+            # Symlinks to directories aren't walked, so a directory
+            # with any can't be linked as a whole
+            whole = (
+                files is not None and
+                len(files) == count and
+                (scriptname is None or scriptname not in files)
+            )
+            walked.append((
+                pathtail,
+                [_join_tail(pathtail, dir_) for dir_ in dirs],
+                whole,
+            ))
+        # The top-level directory can't be pruned since the paths
+        # beneath it don't start with its path, "."
+        if files is None and pathtail != '.':
+            if dirscope.prunable(pathtail):
+                # Don't walk directories which can't have anything
+                # included
+                del dirs[:]
         if not files:
             continue
         scriptsrc = None
         if scriptname is not None and scriptname in files:
             scriptsrc = os.path.join(path, scriptname)
             files.remove(scriptname)
+        result.append((path, pathtail, files, scriptsrc))
+    if folds is not None:
+        folds.update(_folds(walked))
+    return result
+
+
+def _plan(
+        scan,
+        srcdir,
+        linkdir,
+        runscript,
+        force,
+        clean,
+        multiprocess,
+        dircache,
+        previous=None,
+        changed=None,
+        executor=None,
+        summary=None,
+        folds=None,
+        foldlist=None,
+        record=False,
+        freed=None,
+):
+    """Return the LinkPlan for the directories in scan. If previous,
+    the manifest of the last run, is given only the links whose source
+    files were added or removed in the directories in changed are
+    planned. If executor is given, the operations planned so far are
+    carried out as soon as a script is planned, so that a script run
+    in the background runs while the rest of scan is planned and
+    whatever any other script makes in linkdir is seen by the rest of
+    the plan. What happens to each file is
+    counted in summary, if given, instead of being logged. If folds
+    is given, the directories in it are linked as a whole when
+    nothing is in their place in linkdir. If the FoldList foldlist is
+    given, the links to whole directories in it are unfolded, or
+    removed when cleaning, as needed whether or not folds is given.
+    Otherwise directories aren't checked for them.
+    If record, the links which are already in place are kept in the
+    plan's links for the manifest even without force. freed is the set
+    of the link paths whose stale links were removed, by this plan and
+    those of the target directories before, which are linked again
+    even in unchanged directories if their files are there.
+
+    """
+    plan = LinkPlan(dircache, summary)
+    if freed is None:
+        freed = set()
+    if previous is not None and not clean:
+        _unlink_stale(
+            plan,
+            scan,
+            previous,
+            freed,
+        )
+    folded = {}
+    seen = {}
+    for (path, pathtail, files, scriptsrc) in scan:
+        if foldlist is not None and _folded(
+                plan,
+                folded,
+                seen,
+                pathtail,
+                srcdir,
+                linkdir,
+                clean,
+                folds,
+                foldlist,
+        ):
+            continue
         if clean:
             _clean(
+                plan,
                 files,
-                path,
-                srcdir,
+                pathtail,
                 linkdir,
             )
             continue
+        if previous is not None:
+            files = _keep(
+                plan,
+                previous,
+                files,
+                path,
+                pathtail,
+                linkdir,
+                pathtail not in changed,
+                freed,
+            )
         _link(
+            plan,
             files,
             path,
-            srcdir,
+            pathtail,
             linkdir,
             force,
+            record=record,
         )
         # Don't run scriptsrc if it's None or empty
         if scriptsrc and runscript:
             _script(
+                plan,
                 scriptsrc,
+                pathtail,
                 srcdir,
                 linkdir,
                 multiprocess,
             )
+            if executor is not None:
+                executor.execute(plan)
+    # After any links have been made
+    plan.prune_dirs(linkdir)
+    return plan
+
+
+def _executor(dry_run, dircache, scripts=None, scriptcache=None):
+    if dry_run:
+        return DryRunExecutor(dircache)
+    return Executor(dircache, scripts, scriptcache)
+
+
+def _scripts(
+        runscript,
+        clean,
+        multiprocess,
+        dry_run,
+        scriptjobs,
+):
+    # The pool of the scripts run in the background, if any
+    if not runscript or clean or not multiprocess or dry_run:
+        return None
+    return script.ScriptPool(scriptjobs)
+
+
+def _scriptcache(
+        runscript,
+        clean,
+        dry_run,
+        statedir,
+        cachescripts,
+        rerunscripts,
+):
+    # The cache of the scripts' last successful runs, if any
+    if not runscript or clean or dry_run or not cachescripts:
+        return None
+    return ScriptCache.load(statedir, rerunscripts)
+
+
+def _options(
+        scriptname,
+        force,
+        exclude,
+        include,
+        fold,
+):
+    # The options which change what gets linked. The previous manifest
+    # can't be used if any of them changed.
+    return dict([
+        ('scriptname', scriptname),
+        ('force', force),
+        ('exclude', list(exclude or [])),
+        ('include', list(include or [])),
+        ('fold', fold),
+    ])
+
+
+def _scan_srcdir(
+        srcdir,
+        linkdir,
+        scriptname,
+        matcher,
+        statedir,
+        incremental,
+        clean,
+        options,
+        summary,
+        fold,
+):
+    """Scan srcdir, recording a new manifest if there is a statedir
+    and reusing the previous one if incremental, unless fold. Return
+    a (scan, manifest, previous, changed, folds) tuple where folds is
+    None unless fold. When cleaning with a previous manifest srcdir
+    isn't walked and scan is None.
+
+    """
+    if clean and statedir is not None:
+        previous = Manifest.load(statedir, srcdir, linkdir)
+        if previous is not None:
+            if not os.path.exists(linkdir):
+                raise ValueError(
+                    'Link directory "{linkdir}" does not exist'.format(
+                        linkdir=linkdir,
+                    )
+                )
+            return (None, None, previous, None, None)
+    folds = None
+    if fold and not clean:
+        folds = set()
+    if statedir is None:
+        scan = _scan(
+            srcdir,
+            linkdir,
+            scriptname,
+            matcher,
+            summary=summary,
+            folds=folds,
+        )
+        return (scan, None, None, None, folds)
+    manifest = Manifest(srcdir, linkdir, options)
+    previous = None
+    # Only the directories walked can be folded
+    if incremental and not fold:
+        previous = Manifest.load(statedir, srcdir, linkdir)
+    if previous is not None and previous.options != options:
+        log.debug(
+            'Options changed since the last run of "{srcdir}"'.format(
+                srcdir=srcdir,
+            )
+        )
+        previous = None
+    changed = set()
+    scan = _scan(
+        srcdir,
+        linkdir,
+        scriptname,
+        matcher,
+        _manifest_listdir(manifest, previous, changed),
+        summary,
+        folds,
+    )
+    return (scan, manifest, previous, changed, folds)
+
+
+def _merge(scanned, linkdir, force, summary):
+    """Merge the scans of all the target directories, a list of
+    _scan_srcdir results in order, so that each file is planned from
+    a single target directory: the first one which has it or, if
+    force, the last one, which is the one whose link would be left
+    by linking them one after the other. Files linked in the previous
+    run are still planned, so their links aren't taken for stale.
+    Directories which more than one target directory has files in are
+    not folded. Return the merged list.
+
+    """
+    # The index of the winning target directory of each file
+    owners = {}
+    # The number of target directories with files in each directory
+    shared = {}
+    indexes = range(len(scanned))
+    if force:
+        indexes.reverse()
+    for index in indexes:
+        scan = scanned[index][0]
+        if scan is None:
+            continue
+        tails = set()
+        for (path, pathtail, files, scriptsrc) in scan:
+            tails.update(_tails(pathtail))
+            for file_ in files:
+                owners.setdefault((pathtail, file_), index)
+        for tail in tails:
+            shared[tail] = shared.get(tail, 0) + 1
+    result = []
+    for (index, scanned_) in enumerate(scanned):
+        (scan, manifest, previous, changed, folds) = scanned_
+        if scan is None:
+            result.append(scanned_)
+            continue
+        merged = []
+        for (path, pathtail, files, scriptsrc) in scan:
+            linkpath = _link_path(linkdir, pathtail)
+            won = []
+            for file_ in files:
+                srcpath = os.path.join(path, file_)
+                if (
+                        owners[(pathtail, file_)] == index or
+                        previous is not None and
+                        previous.links.get(
+                            os.path.join(linkpath, file_),
+                        ) == srcpath
+                ):
+                    won.append(file_)
+                    continue
+                _log_file(
+                    summary,
+                    'overridden',
+                    log.debug,
+                    '%s is linked from another target directory. '
+                    'Not linking.',
+                    srcpath,
+                )
+            if won or scriptsrc is not None:
+                merged.append((path, pathtail, won, scriptsrc))
+        if folds is not None:
+            folds.difference_update([
+                tail
+                for tail in folds
+                if shared.get(tail, 0) > 1
+            ])
+        result.append((merged, manifest, previous, changed, folds))
+    return result
+
+
+def _apply(
+        scanned,
+        srcdir,
+        linkdir,
+        runscript,
+        force,
+        clean,
+        multiprocess,
+        dircache,
+        matcher,
+        executor,
+        statedir,
+        dry_run,
+        summary,
+        foldlist,
+        freed,
+):
+    (scan, manifest, previous, changed, folds) = scanned
+    if scan is None:
+        plan = LinkPlan(dircache, summary)
+        _clean_links(
+            plan,
+            previous,
+            srcdir,
+            linkdir,
+            matcher,
+        )
+    else:
+        plan = _plan(
+            scan,
+            srcdir,
+            linkdir,
+            runscript,
+            force,
+            clean,
+            multiprocess,
+            dircache,
+            previous,
+            changed,
+            executor,
+            summary,
+            folds,
+            foldlist,
+            # Only a manifest needs the links already in place
+            statedir is not None and not dry_run,
+            freed,
+        )
+    executor.execute(plan)
+    if statedir is None or dry_run:
+        return
+    if scan is None and plan.links:
+        # Keep the excluded links in the manifest, but not the
+        # directories since their links are gone
+        previous.links = plan.links
+        previous.dirs = {}
+        previous.save(statedir)
+        return
+    if clean:
+        # None of the links are left
+        Manifest.remove(statedir, srcdir)
+        return
+    manifest.links = plan.links
+    manifest.save(statedir)
+
+
+def make(
+        srcdir,
+        linkdir,
+        scriptname=None,
+        runscript=False,
+        force=False,
+        clean=False,
+        multiprocess=False,
+        exclude=None,
+        include=None,
+        dry_run=False,
+        statedir=None,
+        incremental=False,
+        scriptjobs=None,
+        cachescripts=False,
+        rerunscripts=False,
+        summary=False,
+        fold=False,
+):
+    """Link the files in srcdir from linkdir. If statedir is given a
+    manifest of the run is kept there and, if incremental, the
+    manifest of the last run is used to only walk the directories and
+    make or remove the links of the files which changed since then.
+    If cachescripts, scripts are skipped when neither they, their
+    directory nor their arguments changed since their last successful
+    run, which is recorded in statedir, unless rerunscripts. If
+    summary, what happens to the files is counted and logged at the
+    end instead of logging a line for each file. If fold, directories
+    with nothing in their place in linkdir, no script and nothing
+    excluded are linked as a whole, and unfolded later if another
+    target directory has files in them. incremental is ignored with
+    fold. This is make_many with srcdir as the only target directory.
+
+    """
+    make_many(
+        [srcdir],
+        linkdir,
+        scriptname=scriptname,
+        runscript=runscript,
+        force=force,
+        clean=clean,
+        multiprocess=multiprocess,
+        exclude=exclude,
+        include=include,
+        dry_run=dry_run,
+        statedir=statedir,
+        incremental=incremental,
+        scriptjobs=scriptjobs,
+        cachescripts=cachescripts,
+        rerunscripts=rerunscripts,
+        summary=summary,
+        fold=fold,
+    )
+
+
+def make_many(
+        srcdirs,
+        linkdir,
+        jobs=1,
+        scriptname=None,
+        runscript=False,
+        force=False,
+        clean=False,
+        multiprocess=False,
+        exclude=None,
+        include=None,
+        dry_run=False,
+        statedir=None,
+        incremental=False,
+        scriptjobs=None,
+        cachescripts=False,
+        rerunscripts=False,
+        summary=False,
+        fold=False,
+        merge=False,
+):
+    """Like make but for a list of target directories. With more than
+    one job the target directories are walked concurrently by a pool
+    of jobs threads. Links are always made in the order of srcdirs,
+    each as soon as its walk is done, so the first target directory
+    still wins when two of them have the same file. With multiprocess,
+    scripts run in the background, at most scriptjobs at a time, and
+    are all waited for before returning. If merge, all the target
+    directories are walked before any is linked and each file is only
+    planned from the target directory which wins it (see _merge), so
+    the files of the others aren't looked up in linkdir. merge is
+    ignored when cleaning.
+
+    """
+    matcher = match.Matcher(exclude, include)
+    options = _options(
+        scriptname,
+        force,
+        exclude,
+        include,
+        fold,
+    )
+    # Shared by all target directories, for planning and execution
+    dircache = DirCache()
+    counts = None
+    if summary:
+        counts = Summary()
+    scripts = _scripts(
+        runscript,
+        clean,
+        multiprocess,
+        dry_run,
+        scriptjobs,
+    )
+    scriptcache = _scriptcache(
+        runscript,
+        clean,
+        dry_run,
+        statedir,
+        cachescripts,
+        rerunscripts,
+    )
+    executor = _executor(dry_run, dircache, scripts, scriptcache)
+    foldlist = FoldList.load(linkdir)
+    # Stale links removed from any target directory, which the later
+    # ones may have files for
+    freed = set()
+
+    def scan_srcdir(srcdir):
+        return _scan_srcdir(
+            srcdir,
+            linkdir,
+            scriptname,
+            matcher,
+            statedir,
+            incremental,
+            clean,
+            options,
+            counts,
+            fold,
+        )
+    pool = None
+    if jobs > 1:
+        pool = ThreadPool(jobs)
+        scans = pool.imap(scan_srcdir, srcdirs)
+    else:
+        scans = itertools.imap(scan_srcdir, srcdirs)
+    try:
+        if merge and not clean:
+            scans = _merge(list(scans), linkdir, force, counts)
+        for (srcdir, scanned) in itertools.izip(srcdirs, scans):
+            # Tell apart the target directories, if there's more than
+            # one
+            if len(srcdirs) > 1:
+                log.debug(
+                    'Processing links from "{srcdir}" to '
+                    '"{linkdir}"...'.format(
+                        srcdir=srcdir,
+                        linkdir=linkdir,
+                    )
+                )
+            # Plan only once the previous target directory has been
+            # applied since planning reads the link directory
+            _apply(
+                scanned,
+                srcdir,
+                linkdir,
+                runscript,
+                force,
+                clean,
+                multiprocess,
+                dircache,
+                matcher,
+                executor,
+                statedir,
+                dry_run,
+                counts,
+                foldlist,
+                freed,
+            )
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if scripts is not None:
+            # Never leave scripts running behind
+            scripts.wait()
+        if scriptcache is not None:
+            scriptcache.save(statedir)
+        if not dry_run:
+            # Even if the run failed, with the folds made so far
+            foldlist.save(linkdir)
+    if counts is not None:
+        counts.log()
+
+
+def conflicts(
+        srcdirs,
+        jobs=1,
+        scriptname=None,
+        exclude=None,
+        include=None,
+        force=False,
+):
+    """Return the Conflicts between srcdirs: the files which more than
+    one of them has, each with the target directory it would be linked
+    from, the first one or, if force, the last one. Like make_many,
+    srcdirs are walked concurrently if there is more than one job.
+    Only srcdirs are read, the link directory isn't.
+
+    """
+    matcher = match.Matcher(exclude, include)
+
+    def scan_srcdir(srcdir):
+        return _scan(
+            srcdir,
+            None,
+            scriptname,
+            matcher,
+        )
+    pool = None
+    if jobs > 1:
+        pool = ThreadPool(jobs)
+        scans = pool.imap(scan_srcdir, srcdirs)
+    else:
+        scans = itertools.imap(scan_srcdir, srcdirs)
+    # The first target directory of each file and all of them for the
+    # files in more than one
+    first = {}
+    shared = {}
+    try:
+        for (srcdir, scan) in itertools.izip(srcdirs, scans):
+            for (path, pathtail, files, scriptsrc) in scan:
+                for file_ in files:
+                    key = (pathtail, file_)
+                    if key not in first:
+                        first[key] = srcdir
+                        continue
+                    if key not in shared:
+                        shared[key] = [first[key]]
+                    shared[key].append(srcdir)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    result = {}
+    for ((pathtail, file_), dirs) in shared.iteritems():
+        if force:
+            dirs.reverse()
+        result[_join_tail(pathtail, file_)] = dirs
+    return Conflicts(result)
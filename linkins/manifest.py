@@ -0,0 +1,85 @@
+import os
+import errno
+import hashlib
+
+from linkins.util import load_state, save_state
+
+VERSION = 1
+
+
+def _path(statedir, srcdir):
+    # One manifest per target directory
+    digest = hashlib.sha1(srcdir).hexdigest()
+    name = 'manifest-{digest}.json'.format(
+        digest=digest,
+    )
+    return os.path.join(statedir, name)
+
+
+class Manifest(object):
+    """The state of a target directory after a run: the modification
+    time, inode and listing of each directory walked, keyed by its path
+    relative to the target directory, and the links in the link
+    directory which point to the target directory, keyed by link path.
+    options are the options of the run which affect what gets linked.
+
+    """
+    def __init__(
+            self,
+            srcdir,
+            linkdir,
+            options,
+            dirs=None,
+            links=None,
+    ):
+        if dirs is None:
+            dirs = {}
+        if links is None:
+            links = {}
+        self.srcdir = srcdir
+        self.linkdir = linkdir
+        self.options = options
+        self.dirs = dirs
+        self.links = links
+
+    @classmethod
+    def load(cls, statedir, srcdir, linkdir):
+        """Return the manifest of the last run from srcdir to linkdir
+        or None if there isn't a usable one.
+
+        """
+        state = load_state(_path(statedir, srcdir), VERSION, 'manifest')
+        if state is None:
+            return None
+        if (
+                state.get('srcdir') != srcdir or
+                state.get('linkdir') != linkdir
+        ):
+            return None
+        return cls(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            options=state['options'],
+            dirs=state['dirs'],
+            links=state['links'],
+        )
+
+    @staticmethod
+    def remove(statedir, srcdir):
+        path = _path(statedir, srcdir)
+        try:
+            os.unlink(path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def save(self, statedir):
+        state = dict([
+            ('version', VERSION),
+            ('srcdir', self.srcdir),
+            ('linkdir', self.linkdir),
+            ('options', self.options),
+            ('dirs', self.dirs),
+            ('links', self.links),
+        ])
+        save_state(_path(statedir, self.srcdir), state)
@@ -0,0 +1,326 @@
+import os
+import re
+import sre_parse
+import sre_constants
+
+# Flags set on a pattern without any inline flags, e.g., re.UNICODE
+# in Python 3
+_default_flags = re.compile('').flags
+
+# Assertions which look at the characters following a match
+_lookahead_at = set([
+    sre_constants.AT_END,
+    sre_constants.AT_END_LINE,
+    sre_constants.AT_END_STRING,
+    sre_constants.AT_BOUNDARY,
+    sre_constants.AT_NON_BOUNDARY,
+    sre_constants.AT_LOC_BOUNDARY,
+    sre_constants.AT_LOC_NON_BOUNDARY,
+    sre_constants.AT_UNI_BOUNDARY,
+    sre_constants.AT_UNI_NON_BOUNDARY,
+])
+_beginning_at = set([
+    sre_constants.AT_BEGINNING,
+    sre_constants.AT_BEGINNING_STRING,
+])
+_end_at = set([
+    sre_constants.AT_END,
+    sre_constants.AT_END_STRING,
+])
+
+
+def _ops(parsed):
+    # Recursively yield all (op, av) pairs of a parsed pattern
+    for (op, av) in parsed:
+        yield (op, av)
+        stack = [av]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, sre_parse.SubPattern):
+                for op_av in _ops(item):
+                    yield op_av
+            elif isinstance(item, (list, tuple)):
+                stack.extend(item)
+
+
+def _prefix_stable(pattern):
+    """Return True if, whenever pattern matches a path, it also
+    matches every path which starts with it. re.match only needs a
+    prefix of the path to match, so this holds unless the pattern
+    looks past the end of what it matches, i.e., it has end of string
+    anchors, word boundaries or lookahead assertions.
+
+    """
+    for (op, av) in _ops(sre_parse.parse(pattern)):
+        if op == sre_constants.AT and av in _lookahead_at:
+            return False
+        if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            return False
+    return True
+
+
+def _literal_prefix(pattern):
+    """Return the literal string any path matching pattern must start
+    with, possibly empty.
+
+    """
+    if re.compile(pattern).flags & re.IGNORECASE:
+        return ''
+    prefix = []
+    for (op, av) in sre_parse.parse(pattern):
+        if op == sre_constants.AT and av in _beginning_at:
+            continue
+        if op != sre_constants.LITERAL:
+            break
+        prefix.append(chr(av))
+    return ''.join(prefix)
+
+
+def _any_repeat(item):
+    # Whether a parsed item is .* or .*?
+    (op, av) = item
+    if op not in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        return False
+    (low, high, repeated) = av
+    return (
+        low == 0 and
+        high == sre_constants.MAXREPEAT and
+        list(repeated) == [(sre_constants.ANY, None)]
+    )
+
+
+def _classify(pattern):
+    """Return a (kind, literal) tuple if matching pattern with re.match
+    against a path with no newlines is the same as comparing the path
+    with a literal string, where kind is one of:
+
+    - 'prefix' if the path starts with literal, e.g., .git
+    - 'exact' if the path is literal, e.g., README.md$
+    - 'basename' if the path's last component, after a /, is literal,
+      e.g., .*/\.DS_Store$
+
+    Otherwise, return (None, None). Leading beginning of string anchors
+    are ignored since re.match always starts at the beginning.
+
+    """
+    if re.compile(pattern).flags != _default_flags:
+        return (None, None)
+    parsed = list(sre_parse.parse(pattern))
+    while (
+            parsed and
+            parsed[0][0] == sre_constants.AT and
+            parsed[0][1] in _beginning_at
+    ):
+        parsed.pop(0)
+    end = False
+    if (
+            parsed and
+            parsed[-1][0] == sre_constants.AT and
+            parsed[-1][1] in _end_at
+    ):
+        parsed.pop()
+        end = True
+    basename = False
+    if (
+            len(parsed) >= 2 and
+            _any_repeat(parsed[0]) and
+            parsed[1] == (sre_constants.LITERAL, ord('/'))
+    ):
+        parsed = parsed[2:]
+        basename = True
+    for (op, av) in parsed:
+        if op != sre_constants.LITERAL or av > 255:
+            return (None, None)
+    literal = ''.join([chr(av) for (op, av) in parsed])
+    if basename:
+        if not end or '/' in literal:
+            return (None, None)
+        return ('basename', literal)
+    if end:
+        return ('exact', literal)
+    return ('prefix', literal)
+
+
+def _combine(patterns):
+    """Compile patterns into as few regular expressions as possible
+    while keeping the semantics of matching each one separately with
+    re.match. Patterns are merged into a single alternation except for
+    those which would behave differently inside it: patterns with
+    inline flags, e.g., (?i), apply them to the whole expression and
+    patterns with groups could clash on group names, renumber
+    backreferences or hit the limit on the number of groups. These are
+    returned on their own.
+
+    """
+    merged = []
+    separate = []
+    for pattern in patterns:
+        regex = re.compile(pattern)
+        if regex.groups or regex.flags != _default_flags:
+            separate.append(regex)
+            continue
+        merged.append('(?:{pattern})'.format(pattern=pattern))
+    if merged:
+        separate.insert(0, re.compile('|'.join(merged)))
+    return separate
+
+
+class _Patterns(object):
+    """Match paths against patterns as re.match would, but compare
+    them as strings for the patterns which allow it (see _classify):
+    a tuple of prefixes for str.startswith and sets of exact paths and
+    basenames. Only the rest are matched as regular expressions,
+    combined (see _combine). $ also matches before a newline at the
+    end and . doesn't match newlines, so paths with newlines are
+    matched against the regular expressions of every pattern but the
+    prefixes.
+
+    """
+    def __init__(self, patterns):
+        prefixes = []
+        self._exact = set()
+        self._basenames = set()
+        regexes = []
+        literals = []
+        for pattern in patterns:
+            (kind, literal) = _classify(pattern)
+            if kind == 'prefix':
+                prefixes.append(literal)
+                continue
+            if kind == 'exact':
+                self._exact.add(literal)
+                literals.append(pattern)
+            elif kind == 'basename':
+                self._basenames.add(literal)
+                literals.append(pattern)
+            else:
+                regexes.append(pattern)
+        self._prefixes = tuple(prefixes)
+        self._regexes = _combine(regexes)
+        self._newline = _combine(literals + regexes)
+
+    def match(self, path):
+        # A literal prefix matches the same with or without newlines
+        if path.startswith(self._prefixes):
+            return True
+        if '\n' in path:
+            regexes = self._newline
+        else:
+            if path in self._exact:
+                return True
+            if self._basenames:
+                (head, slash, name) = path.rpartition('/')
+                if slash and name in self._basenames:
+                    return True
+            regexes = self._regexes
+        for regex in regexes:
+            if regex.match(path):
+                return True
+        return False
+
+
+class Matcher(object):
+    """Decide which paths are excluded from all operations. A path is
+    excluded if it matches any of the exclude patterns and none of the
+    include patterns. Patterns are regular expressions matched, with
+    re.match, against paths relative to the target directory.
+    Patterns which are literal paths, basenames or prefixes are
+    compared as strings and the rest of the exclude patterns are
+    combined into one regular expression and of the include patterns
+    into another (see _Patterns) so that, usually, at most two regular
+    expression scans are needed per path.
+
+    """
+    def __init__(self, exclude=None, include=None):
+        if exclude is None:
+            exclude = []
+        if include is None:
+            include = []
+        self._exclude = _Patterns(exclude)
+        self._include = _Patterns(include)
+        stable = [
+            pattern
+            for pattern in exclude
+            if _prefix_stable(pattern)
+        ]
+        self._stable_prefixes = tuple([
+            literal
+            for (kind, literal) in map(_classify, stable)
+            if kind == 'prefix'
+        ])
+        self._stable = [
+            re.compile(pattern)
+            for pattern in stable
+            if _classify(pattern)[0] != 'prefix'
+        ]
+        self._include_prefixes = [
+            _literal_prefix(pattern)
+            for pattern in include
+        ]
+
+    def excluded(self, path):
+        if not self._exclude.match(path):
+            return False
+        return not self._include.match(path)
+
+    def prunable(self, path):
+        """Return True if everything beneath the directory path is
+        excluded, so it need not be walked. This is the case when path
+        is matched by an exclude pattern which also matches anything
+        starting with path (see _prefix_stable) and none of the
+        include patterns start with a literal compatible with
+        "path/". For example, the exclude pattern .git prunes the .git
+        directory but .git$ does not and neither does .git together
+        with the include patterns .git/config or .*.
+
+        """
+        prefix = os.path.join(path, '')
+        for literal in self._include_prefixes:
+            if literal.startswith(prefix) or prefix.startswith(literal):
+                return False
+        if path.startswith(self._stable_prefixes):
+            return True
+        for regex in self._stable:
+            if regex.match(path):
+                return True
+        return False
+
+    def child(self, pathtail, matcher):
+        """Return the Scope of the directory pathtail, whose paths are
+        also matched by matcher relative to pathtail.
+
+        """
+        return Scope([('', self)]).child(pathtail, matcher)
+
+
+class Scope(object):
+    """Decide which paths beneath a directory are excluded by the
+    Matchers of the directory and its parents, e.g., those read from
+    files in them. A path is excluded if any of the matchers excludes
+    it, each matching the path relative to the directory it belongs
+    to, so the include patterns of a matcher only apply to its own
+    exclude patterns. Paths must be beneath all the directories.
+
+    """
+    def __init__(self, matchers):
+        # (prefix, matcher) tuples where prefix is the path of the
+        # matcher's directory with a trailing /
+        self._matchers = matchers
+
+    def excluded(self, path):
+        for (prefix, matcher) in self._matchers:
+            if matcher.excluded(path[len(prefix):]):
+                return True
+        return False
+
+    def prunable(self, path):
+        for (prefix, matcher) in self._matchers:
+            if matcher.prunable(path[len(prefix):]):
+                return True
+        return False
+
+    def child(self, pathtail, matcher):
+        prefix = ''
+        if pathtail != '.':
+            prefix = os.path.join(pathtail, '')
+        return Scope(self._matchers + [(prefix, matcher)])
@@ -0,0 +1,410 @@
+import os
+import heapq
+import errno
+import logging
+
+from linkins import cache, dirfd, script, stats
+from linkins.util import scandir
+
+log = logging.getLogger(__name__)
+
+
+def _unlink(linkpath, opendir=None):
+    try:
+        with stats.timer('unlink'):
+            if opendir is None:
+                os.unlink(linkpath)
+            else:
+                (fd, name) = opendir.split(linkpath)
+                dirfd.unlink(fd, name, linkpath)
+    except OSError, e:
+        # It's OK if the link disappeared
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _empty(path):
+    # Stop at the first entry instead of listing them all
+    with stats.timer('stat'):
+        for entry in scandir(path):
+            return False
+    return True
+
+
+class DirCache(object):
+    """Remember which directories in the link directory exist, or will
+    exist once the planned operations are carried out, so that each
+    one is only stat'ed once per run.
+
+    """
+    def __init__(self):
+        self._dirs = {}
+        # Created empty, so only what is added is beneath them
+        self._empty = set()
+
+    def exists(self, path):
+        try:
+            return self._dirs[path]
+        except KeyError:
+            pass
+        # Nothing exists in a directory which doesn't or which will
+        # be created empty
+        if self._missing_parent(path):
+            exists = False
+        else:
+            with stats.timer('stat'):
+                exists = os.path.exists(path)
+        self._dirs[path] = exists
+        return exists
+
+    def _missing_parent(self, path):
+        parent = os.path.dirname(path)
+        while parent != path:
+            if self._dirs.get(parent) is False or parent in self._empty:
+                return True
+            path = parent
+            parent = os.path.dirname(path)
+        return False
+
+    def add(self, path, empty=False):
+        # Parent directories are created too
+        if empty:
+            self._empty.add(path)
+        while not self._dirs.get(path):
+            self._dirs[path] = True
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+
+    def discard(self, path):
+        # Along with everything beneath it
+        self._dirs[path] = False
+
+    def clear(self):
+        # Forget everything, e.g., after a script changed the link
+        # directory
+        self._dirs = {}
+        self._empty = set()
+
+
+class LinkPlan(object):
+    """An ordered list of the operations needed to link a target
+    directory. Each operation is a tuple with the name of an Executor
+    method followed by its arguments. Planning only reads the file
+    system, the operations are carried out later by an executor. links
+    maps each link path to its source path for all the links which
+    will point to the target directory once the plan is carried out,
+    whether they are created or were already there. The links created
+    are counted in summary, if given (see link.Summary).
+
+    """
+    def __init__(self, dirs=None, summary=None):
+        if dirs is None:
+            dirs = DirCache()
+        self.operations = []
+        self.dirs = dirs
+        self.summary = summary
+        self.links = {}
+        self._prune = set()
+        self._next = 0
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def pending(self):
+        """Yield the operations which haven't been yielded yet, so a
+        plan can be carried out a part at a time while it is still
+        being made.
+
+        """
+        while self._next < len(self.operations):
+            operation = self.operations[self._next]
+            self._next += 1
+            yield operation
+
+    def mkdir(self, path):
+        # Directories are only created once
+        if self.dirs.exists(path):
+            return
+        self.dirs.add(path, empty=True)
+        self.operations.append(('mkdir', path))
+
+    def unlink(self, path):
+        self.operations.append(('unlink', path))
+
+    def symlink(self, srcpath, linkpath):
+        self.operations.append(('symlink', srcpath, linkpath))
+        self.links[linkpath] = srcpath
+        if self.summary is not None:
+            self.summary.add('linked')
+
+    def keep(self, srcpath, linkpath):
+        # Record a link which is already there
+        self.links[linkpath] = srcpath
+
+    def fold(self, srcpath, linkpath):
+        # Link the whole directory srcpath
+        self.operations.append(('symlink', srcpath, linkpath))
+        self.links[linkpath] = srcpath
+        self.dirs.add(linkpath)
+
+    def unfold(self, linkpath, target, names):
+        """Replace linkpath, a link to the directory target made by
+        another target directory, with a directory of links to each
+        of target's entries, names. Those links aren't this plan's.
+
+        """
+        self.operations.append(('unlink', linkpath))
+        self.operations.append(('mkdir', linkpath))
+        self.dirs.add(linkpath, empty=True)
+        for name in names:
+            self.operations.append((
+                'symlink',
+                os.path.join(target, name),
+                os.path.join(linkpath, name),
+            ))
+
+    def script(
+            self,
+            scriptsrc,
+            srcdir,
+            linkdir,
+            pathtail,
+            name,
+            multiprocess,
+    ):
+        self.operations.append((
+            'script',
+            scriptsrc,
+            srcdir,
+            linkdir,
+            pathtail,
+            name,
+            multiprocess,
+        ))
+
+    def prune(self, path):
+        # Remove path, and then its parents, if it ends up empty. See
+        # prune_dirs.
+        self._prune.add(path)
+
+    def prune_dirs(self, linkdir):
+        # Prune all the directories collected so far at once
+        if not self._prune:
+            return
+        self.operations.append((
+            'prune_dirs',
+            sorted(self._prune),
+            linkdir,
+        ))
+        self._prune = set()
+
+
+class Executor(object):
+    """Carry out the operations of a LinkPlan, in order. dirs is the
+    DirCache used to plan, which is kept up to date with the
+    directories removed. Scripts to be run as subprocesses are
+    submitted to the ScriptPool scripts, if given, and are run
+    right away otherwise. If a ScriptCache is given as cache, scripts
+    which are fresh in it are skipped and the runs of the others are
+    recorded in it. Where dirfd is supported, links are made and
+    removed relative to their open directory (see dirfd).
+
+    """
+    def __init__(self, dirs=None, scripts=None, cache=None):
+        if dirs is None:
+            dirs = DirCache()
+        self.dirs = dirs
+        self.scripts = scripts
+        self.cache = cache
+        self._opendir = None
+
+    def execute(self, plan):
+        if dirfd.supported:
+            self._opendir = dirfd.OpenDir()
+        try:
+            # Only the operations not carried out before
+            for operation in plan.pending():
+                method = getattr(self, operation[0])
+                method(*operation[1:])
+        finally:
+            if self._opendir is not None:
+                self._opendir.close()
+                self._opendir = None
+
+    def mkdir(self, path):
+        try:
+            with stats.timer('makedirs'):
+                os.makedirs(path)
+        except OSError, e:
+            # It's OK if the directory was created in the meantime
+            if e.errno != errno.EEXIST or not os.path.isdir(path):
+                raise
+
+    def unlink(self, path):
+        _unlink(path, self._opendir)
+
+    def symlink(self, srcpath, linkpath):
+        with stats.timer('symlink'):
+            if self._opendir is None:
+                os.symlink(srcpath, linkpath)
+                return
+            (fd, name) = self._opendir.split(linkpath)
+            dirfd.symlink(srcpath, fd, name, linkpath)
+
+    def script(
+            self,
+            scriptsrc,
+            srcdir,
+            linkdir,
+            pathtail,
+            name,
+            multiprocess,
+    ):
+        # Scripts are known by their directory
+        key = os.path.normpath(os.path.join(srcdir, pathtail))
+        pool = None
+        if multiprocess:
+            pool = self.scripts
+        done = None
+        if self.cache is not None:
+            digest = cache.digest(scriptsrc, [srcdir, linkdir, pathtail])
+            if self.cache.fresh(scriptsrc, digest):
+                log.info(
+                    'Skipping script {name}. Unchanged since its last '
+                    'successful run.'.format(
+                        name=name,
+                    )
+                )
+                if pool is not None:
+                    pool.skip(key)
+                return
+
+            def done(returncode):
+                self.cache.record(scriptsrc, digest, returncode)
+        log.debug(
+            'Running script {name}'.format(
+                name=name,
+            )
+        )
+        if pool is None:
+            returncode = script.runscript(
+                scriptsrc,
+                srcdir,
+                linkdir,
+                pathtail,
+                name=name,
+                pool=None,
+            )
+            if done is not None:
+                done(returncode)
+            # The script could have made directories planned as
+            # missing or empty
+            self.dirs.clear()
+            return
+        (after, locks) = script.header(scriptsrc)
+        after = [
+            os.path.normpath(os.path.join(srcdir, dep))
+            for dep in after
+        ]
+        script.runscript(
+            scriptsrc,
+            srcdir,
+            linkdir,
+            pathtail,
+            name=name,
+            pool=pool,
+            key=key,
+            after=after,
+            locks=locks,
+            done=done,
+        )
+
+    def prune_dirs(self, paths, linkdir):
+        """Remove the empty directories in paths, and then their parents
+        if they are left empty, but never linkdir. Directories are
+        pruned deepest first so each one is checked at most once,
+        after all of its children.
+
+        """
+        linkprefix = os.path.join(linkdir, '')
+        heap = [(-path.count(os.sep), path) for path in paths]
+        heapq.heapify(heap)
+        seen = set(paths)
+        while heap:
+            (depth, path) = heapq.heappop(heap)
+            if not path.startswith(linkprefix):
+                continue
+            if not self.dirs.exists(path) or not _empty(path):
+                continue
+            if self._opendir is not None:
+                # Never keep a removed directory open
+                self._opendir.close()
+            try:
+                with stats.timer('rmdir'):
+                    os.rmdir(path)
+            except OSError, e:
+                # A link to a directory is left alone, with its parents
+                if e.errno != errno.ENOTDIR:
+                    raise
+                continue
+            self.dirs.discard(path)
+            parent = os.path.dirname(path)
+            if parent not in seen:
+                seen.add(parent)
+                heapq.heappush(heap, (depth + 1, parent))
+
+
+class DryRunExecutor(Executor):
+    """Log the operations of a LinkPlan instead of carrying them
+    out.
+
+    """
+    def mkdir(self, path):
+        log.info(
+            'Would create directory {path}'.format(
+                path=path,
+            )
+        )
+
+    def unlink(self, path):
+        log.info(
+            'Would remove {path}'.format(
+                path=path,
+            )
+        )
+
+    def symlink(self, srcpath, linkpath):
+        log.info(
+            'Would link {linkpath} to {srcpath}'.format(
+                linkpath=linkpath,
+                srcpath=srcpath,
+            )
+        )
+
+    def script(
+            self,
+            scriptsrc,
+            srcdir,
+            linkdir,
+            pathtail,
+            name,
+            multiprocess,
+    ):
+        log.info(
+            'Would run script {name}'.format(
+                name=name,
+            )
+        )
+
+    def prune_dirs(self, paths, linkdir):
+        for path in paths:
+            log.info(
+                'Would remove {path} and its parents if empty'.format(
+                    path=path,
+                )
+            )
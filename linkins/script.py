@@ -1,9 +1,15 @@
 import os
+import re
+import sys
+import time
+import select
 import logging
+import threading
 import subprocess
 import multiprocessing
 
-from linkins.util import unbuffered_stream
+from linkins import stats
+from linkins.util import unbuffered_stream, LineSplitter, CHUNK_SIZE
 
 log = logging.getLogger(__name__)
 log.propagate = False
@@ -14,36 +20,384 @@ fmt = logging.Formatter(
 handler.setFormatter(fmt)
 log.addHandler(handler)
 
+# Seconds between checks on scripts which closed their output but
+# haven't exited
+POLL_INTERVAL = 0.02
+
+# e.g., "# linkins-after: .emacs.d"
+_header_regex = re.compile(r'#\s*linkins-(after|lock):(.*)$')
+
+
+def _log_line(name, line):
+    extra = dict([
+        ('script', name),
+        ('source', 'SCRIPT'),
+    ])
+    log.info(
+        line,
+        extra=extra,
+    )
+
+
+def _log_exit(name, returncode):
+    extra = dict([
+        ('script', name),
+        ('source', 'LINKINS'),
+    ])
+    msg = 'Exited with status {returncode}'.format(
+        returncode=returncode,
+    )
+    if returncode:
+        log.error(
+            msg,
+            extra=extra,
+        )
+    else:
+        log.debug(
+            msg,
+            extra=extra,
+        )
+
 
 def _run(cmd, name):
+    start = time.time()
+    # End-of-lines are handled by unbuffered_stream
     proc = subprocess.Popen(
         cmd,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        # Make all end-of-lines '\n'
-        universal_newlines=True,
     )
+    for line in unbuffered_stream(proc):
+        _log_line(name, line)
+    returncode = proc.wait()
+    stats.add('script', time.time() - start)
+    _log_exit(name, returncode)
+    return returncode
+
+
+def header(path):
+    """Return the (after, locks) lists a script declares in the
+    comments at its top, before the first line which isn't a comment,
+    e.g.::
+
+        #!/bin/sh
+        # linkins-after: .emacs.d .xmonad
+        # linkins-lock: dpkg
+
+    after are the directories, relative to the target directory, whose
+    scripts must finish before this one starts. locks are the names of
+    resources no two scripts can use at the same time.
+
+    """
+    after = []
+    locks = []
+    with open(path) as fp:
+        for line in fp:
+            if not line.startswith('#'):
+                break
+            found = _header_regex.match(line)
+            if not found:
+                continue
+            (field, values) = found.groups()
+            if field == 'after':
+                after += values.split()
+            else:
+                locks += values.split()
+    return (after, locks)
+
+
+class _Job(object):
+    # A script submitted to a ScriptPool
+    def __init__(
+            self,
+            index,
+            cmd,
+            name,
+            key,
+            after,
+            locks,
+            done,
+    ):
+        self.index = index
+        self.cmd = cmd
+        self.name = name
+        self.key = key
+        self.after = after
+        self.locks = locks
+        self.done = done
+        # When the script was started
+        self.start = None
+
+
+def _log_not_run(job, reason):
     extra = dict([
-        ('script', name),
-        ('source', 'SCRIPT'),
+        ('script', job.name),
+        ('source', 'LINKINS'),
     ])
-    for line in unbuffered_stream(proc):
-        log.info(
-            line,
-            extra=extra,
-        )
+    log.error(
+        'Not run because {reason}'.format(
+            reason=reason,
+        ),
+        extra=extra,
+    )
+
+
+class ScriptPool(object):
+    """Run scripts in the background, at most jobs at a time. Each
+    script is a plain subprocess. The output of all of them is read
+    and logged by a single thread which waits on all their pipes at
+    once. jobs defaults to the number of CPUs.
+
+    Scripts are started in the order they are submitted unless they
+    have to wait. A script with a key can be waited on by the scripts
+    which have that key in their after list. A script does not start
+    until every script it waits on has finished, and it is not run at
+    all if any of them failed. Waiting on a key that was never
+    submitted only delays the script until wait is called. Scripts
+    which share any of their locks never run at the same time. done,
+    if given, is called with the script's exit status, or None if it
+    wasn't run, once it finishes.
+
+    """
+    def __init__(self, jobs=None):
+        if jobs is None:
+            jobs = multiprocessing.cpu_count()
+        self._jobs = jobs
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._pending = []
+        # The running scripts by the file descriptor of their output
+        self._running = {}
+        # (job, proc) tuples of the scripts whose output ended but
+        # which haven't exited
+        self._exiting = []
+        self._held = set()
+        self._keys = set()
+        self._succeeded = {}
+        self._closed = False
+        self._stopped = False
+        self._results = []
+        self._errors = []
+        # Written to wake up the output thread when scripts start
+        (self._wakeup, self._notify) = os.pipe()
+        self._thread = threading.Thread(target=self._read)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(
+            self,
+            cmd,
+            name,
+            key=None,
+            after=None,
+            locks=None,
+            done=None,
+    ):
+        with self._lock:
+            job = _Job(
+                index=len(self._results),
+                cmd=cmd,
+                name=name,
+                key=key,
+                after=[dep for dep in after or [] if dep != key],
+                locks=set(locks or []),
+                done=done,
+            )
+            self._results.append((name, None))
+            self._pending.append(job)
+            if key is not None:
+                self._keys.add(key)
+            self._dispatch()
+
+    def skip(self, key):
+        """Let the scripts waiting on key go ahead as if a script with
+        key had succeeded.
+
+        """
+        with self._lock:
+            self._succeeded[key] = True
+            self._dispatch()
+
+    def _blocked(self, job):
+        """Return True if job has to keep waiting, the key of a
+        dependency which failed or None if job can start now. Called
+        with the lock held.
+
+        """
+        for dep in job.after:
+            if dep in self._succeeded:
+                if not self._succeeded[dep]:
+                    return dep
+                continue
+            # Submitted but not finished or possibly submitted later
+            if dep in self._keys or not self._closed:
+                return True
+        if job.locks & self._held:
+            return True
+        return None
+
+    def _dispatch(self):
+        # Start every script which can start. Called with the lock
+        # held.
+        changed = True
+        while changed:
+            changed = False
+            for job in list(self._pending):
+                if len(self._running) + len(self._exiting) >= self._jobs:
+                    return
+                blocked = self._blocked(job)
+                if blocked is True:
+                    continue
+                self._pending.remove(job)
+                changed = True
+                if blocked is not None:
+                    _log_not_run(
+                        job,
+                        '{dep} failed'.format(
+                            dep=blocked,
+                        ),
+                    )
+                    self._finish(job, None)
+                    continue
+                self._start(job)
+
+    def _start(self, job):
+        # Called with the lock held
+        try:
+            # Don't leak the pipes of the other scripts or the end of
+            # a script's output won't be seen until they exit too
+            proc = subprocess.Popen(
+                job.cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                close_fds=True,
+            )
+        except OSError:
+            # Raised by wait
+            self._errors.append(sys.exc_info())
+            self._finish(job, None)
+            return
+        self._held |= job.locks
+        job.start = time.time()
+        fd = proc.stdout.fileno()
+        self._running[fd] = (job, proc, LineSplitter())
+        os.write(self._notify, 'x')
+
+    def _finish(self, job, returncode):
+        # Called with the lock held
+        if job.key is not None:
+            self._keys.discard(job.key)
+            self._succeeded[job.key] = returncode == 0
+        self._results[job.index] = (job.name, returncode)
+        if job.done is not None:
+            job.done(returncode)
+        self._changed.notify_all()
+
+    def _read(self):
+        """Log the output of all the running scripts as it comes. A
+        script is waited on once its output ends, but without blocking
+        since it could go on running after closing its output.
+
+        """
+        while True:
+            with self._lock:
+                if self._stopped and not self._running:
+                    return
+                fds = list(self._running)
+                timeout = None
+                if self._exiting:
+                    timeout = POLL_INTERVAL
+            (ready, _, _) = select.select(
+                fds + [self._wakeup],
+                [],
+                [],
+                timeout,
+            )
+            for fd in ready:
+                if fd == self._wakeup:
+                    os.read(fd, CHUNK_SIZE)
+                    continue
+                (job, proc, splitter) = self._running[fd]
+                chunk = os.read(fd, CHUNK_SIZE)
+                for line in splitter.feed(chunk):
+                    _log_line(job.name, line)
+                if chunk:
+                    continue
+                line = splitter.close()
+                if line is not None:
+                    _log_line(job.name, line)
+                with self._lock:
+                    # Before fd is closed, since a script started
+                    # afterwards can get the same one
+                    del self._running[fd]
+                    self._exiting.append((job, proc))
+                    proc.stdout.close()
+            self._reap()
+
+    def _reap(self):
+        # Finish the scripts whose output ended and which exited
+        with self._lock:
+            exiting = list(self._exiting)
+        for (job, proc) in exiting:
+            returncode = proc.poll()
+            if returncode is None:
+                continue
+            stats.add('script', time.time() - job.start)
+            _log_exit(job.name, returncode)
+            with self._lock:
+                self._exiting.remove((job, proc))
+                self._held -= job.locks
+                self._finish(job, returncode)
+                self._dispatch()
+
+    def wait(self):
+        """Wait for all the scripts submitted and return a list of
+        (name, returncode) tuples in the order they were submitted.
+        returncode is None for the scripts which were not run. Scripts
+        left waiting on each other, in a cycle, are not run.
+
+        """
+        with self._lock:
+            self._closed = True
+            self._dispatch()
+            while self._pending or self._running or self._exiting:
+                if not self._running and not self._exiting:
+                    for job in self._pending:
+                        _log_not_run(job, 'its dependencies form a cycle')
+                        self._finish(job, None)
+                    self._pending = []
+                    break
+                self._changed.wait()
+            self._stopped = True
+            os.write(self._notify, 'x')
+        self._thread.join()
+        os.close(self._wakeup)
+        os.close(self._notify)
+        if self._errors:
+            (error_type, error, traceback) = self._errors[0]
+            raise error_type, error, traceback
+        return list(self._results)
 
 
 def runscript(path, *args, **kwargs):
-    multi = kwargs.get('multiprocess', False)
+    """Run the script at path with args and return its exit status.
+    If a ScriptPool is given as pool the script is submitted to it
+    instead, along with the key, after, locks and done arguments, and
+    None is returned.
+
+    """
+    pool = kwargs.get('pool')
     name = os.path.basename(path)
     name = kwargs.get('name', name)
     cmd = [path] + list(args)
-    if multi:
-        proc = multiprocessing.Process(
-            target=_run,
-            args=(cmd, name),
+    if pool is not None:
+        pool.submit(
+            cmd,
+            name,
+            key=kwargs.get('key'),
+            after=kwargs.get('after'),
+            locks=kwargs.get('locks'),
+            done=kwargs.get('done'),
         )
-        proc.start()
-        return
-    _run(cmd, name)
+        return None
+    return _run(cmd, name)
@@ -0,0 +1,145 @@
+import json
+import time
+import threading
+import contextlib
+
+# The Stats being recorded, if any. See start.
+_current = None
+
+
+class Stats(object):
+    """The number of times each operation was carried out and the
+    total time spent on it, in seconds, keyed by operation name.
+    Operations carried out by different threads, e.g., walks and
+    scripts, overlap so their times can add up to more than the time
+    of the whole run.
+
+    """
+    def __init__(self):
+        self.counts = {}
+        self.times = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, elapsed, count=1):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + count
+            self.times[name] = self.times.get(name, 0.0) + elapsed
+
+    def as_dict(self):
+        return dict([
+            (name, dict([
+                ('count', self.counts[name]),
+                ('seconds', self.times[name]),
+            ]))
+            for name in self.counts
+        ])
+
+    def table(self):
+        """Return the stats as a table of lines, one per operation
+        sorted by name, e.g.::
+
+            operation      count    total (s)    mean (ms)
+            symlink          120        0.004        0.033
+
+        """
+        fmt = '{name:<10} {count:>9} {total:>12} {mean:>12}'
+        lines = [
+            fmt.format(
+                name='operation',
+                count='count',
+                total='total (s)',
+                mean='mean (ms)',
+            )
+        ]
+        for name in sorted(self.counts):
+            count = self.counts[name]
+            total = self.times[name]
+            mean = 0.0
+            if count:
+                mean = total / count * 1000
+            lines.append(
+                fmt.format(
+                    name=name,
+                    count=count,
+                    total='{total:.3f}'.format(total=total),
+                    mean='{mean:.3f}'.format(mean=mean),
+                )
+            )
+        return '\n'.join(lines)
+
+    def save(self, path):
+        with open(path, 'w') as fp:
+            json.dump(self.as_dict(), fp, indent=2, sort_keys=True)
+
+
+class _Timer(object):
+    # Add the time spent in a with block to stats
+    def __init__(self, stats, name, count):
+        self.stats = stats
+        self.name = name
+        self.count = count
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stats.add(
+            self.name,
+            time.time() - self.start,
+            self.count,
+        )
+
+
+class _NullTimer(object):
+    # Used when stats aren't being recorded, which is the usual case.
+    # Shared so that it costs next to nothing.
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def start():
+    """Start recording stats and return the Stats they are recorded
+    in.
+
+    """
+    global _current
+    _current = Stats()
+    return _current
+
+
+def stop():
+    global _current
+    _current = None
+
+
+def timer(name, count=1):
+    """Return a context manager which records count operations named
+    name and the time spent in it, if stats are being recorded.
+
+    """
+    stats = _current
+    if stats is None:
+        return _null_timer
+    return _Timer(stats, name, count)
+
+
+def add(name, elapsed, count=1):
+    stats = _current
+    if stats is not None:
+        stats.add(name, elapsed, count)
+
+
+@contextlib.contextmanager
+def recording():
+    # Record stats for the duration of a with block
+    stats = start()
+    try:
+        yield stats
+    finally:
+        stop()
@@ -0,0 +1,84 @@
+import os
+
+import mock
+import tempdirs
+
+from linkins import cache
+
+
+@tempdirs.makedirs()
+def test_digest(**kwargs):
+    (srcdir,) = kwargs['tempdirs_dirs']
+    scriptfile = os.path.join(srcdir, 'foo-script')
+    srcfile = os.path.join(srcdir, 'foo')
+    with open(scriptfile, 'w') as fp:
+        fp.write('script content')
+    with open(srcfile, 'w') as fp:
+        fp.write('source content')
+    os.makedirs(os.path.join(srcdir, 'bar'))
+    args = ['/src', '/link', '.']
+    digest = cache.digest(scriptfile, args)
+    assert cache.digest(scriptfile, args) == digest
+    assert cache.digest(scriptfile, ['/src', '/other', '.']) != digest
+    # Subdirectories only count by name
+    with open(os.path.join(srcdir, 'bar', 'fee'), 'w') as fp:
+        fp.write('nested content')
+    assert cache.digest(scriptfile, args) == digest
+    with open(srcfile, 'w') as fp:
+        fp.write('new content')
+    changed = cache.digest(scriptfile, args)
+    assert changed != digest
+    with open(scriptfile, 'w') as fp:
+        fp.write('new script content')
+    assert cache.digest(scriptfile, args) != changed
+    os.symlink('/fee', os.path.join(srcdir, 'fi'))
+    linked = cache.digest(scriptfile, args)
+    os.unlink(os.path.join(srcdir, 'fi'))
+    os.symlink('/fo', os.path.join(srcdir, 'fi'))
+    assert cache.digest(scriptfile, args) != linked
+
+
+@tempdirs.makedirs()
+def test_script_cache_save_load(**kwargs):
+    (statedir,) = kwargs['tempdirs_dirs']
+    scriptcache = cache.ScriptCache.load(statedir)
+    assert scriptcache.digests == {}
+    scriptcache.record('/src/foo-script', 'abc', 0)
+    scriptcache.record('/src/bar/foo-script', 'def', 1)
+    scriptcache.save(statedir)
+    loaded = cache.ScriptCache.load(statedir)
+    assert loaded.digests == dict([('/src/foo-script', 'abc')])
+    assert isinstance(loaded.digests.keys()[0], str)
+    assert loaded.fresh('/src/foo-script', 'abc')
+    assert not loaded.fresh('/src/foo-script', 'def')
+    assert not loaded.fresh('/src/bar/foo-script', 'def')
+    loaded.record('/src/foo-script', 'abc', 2)
+    assert not loaded.fresh('/src/foo-script', 'abc')
+
+
+@tempdirs.makedirs()
+def test_script_cache_rerun(**kwargs):
+    (statedir,) = kwargs['tempdirs_dirs']
+    scriptcache = cache.ScriptCache()
+    scriptcache.record('/src/foo-script', 'abc', 0)
+    scriptcache.save(statedir)
+    loaded = cache.ScriptCache.load(statedir, rerun=True)
+    assert not loaded.fresh('/src/foo-script', 'abc')
+    assert loaded.digests == dict([('/src/foo-script', 'abc')])
+
+
+@tempdirs.makedirs()
+@mock.patch('linkins.util.log')
+def test_script_cache_corrupt(fakelog, **kwargs):
+    (statedir,) = kwargs['tempdirs_dirs']
+    path = os.path.join(statedir, 'scripts.json')
+    with open(path, 'w') as fp:
+        fp.write('{')
+    loaded = cache.ScriptCache.load(statedir)
+    assert loaded.digests == {}
+    warn = mock.call.warn(
+        'Ignoring corrupt script cache {path}'.format(
+            path=path,
+        )
+    )
+    assert fakelog.mock_calls == [warn]
@@ -0,0 +1,52 @@
+import os
+import json
+
+import tempdirs
+
+from linkins.conflicts import Conflicts
+
+
+def _conflicts():
+    return Conflicts(dict([
+        ('foo/fee', ['/src/first', '/src/second']),
+        ('bar', ['/src/longer/first', '/src/second', '/src/third']),
+    ]))
+
+
+def test_conflicts_as_list():
+    assert _conflicts().as_list() == [
+        dict([
+            ('path', 'bar'),
+            ('linked', '/src/longer/first'),
+            ('shadowed', ['/src/second', '/src/third']),
+        ]),
+        dict([
+            ('path', 'foo/fee'),
+            ('linked', '/src/first'),
+            ('shadowed', ['/src/second']),
+        ]),
+    ]
+
+
+def test_conflicts_table():
+    assert _conflicts().table().split('\n') == [
+        'path      linked from         shadowed in',
+        'bar       /src/longer/first   /src/second, /src/third',
+        'foo/fee   /src/first          /src/second',
+    ]
+
+
+def test_conflicts_table_empty():
+    conflicts = Conflicts()
+    assert not conflicts
+    assert conflicts.table() == 'path   linked from   shadowed in'
+
+
+@tempdirs.makedirs()
+def test_conflicts_save(**kwargs):
+    (statedir,) = kwargs['tempdirs_dirs']
+    path = os.path.join(statedir, 'conflicts.json')
+    conflicts = _conflicts()
+    conflicts.save(path)
+    with open(path) as fp:
+        assert json.load(fp) == conflicts.as_list()
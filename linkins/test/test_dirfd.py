@@ -0,0 +1,51 @@
+import os
+import errno
+
+import pytest
+import tempdirs
+
+from linkins import dirfd
+
+
+@tempdirs.makedirs()
+def test_open_dir_split(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    foodir = os.path.join(linkdir, 'foo')
+    os.mkdir(foodir)
+    opendir = dirfd.OpenDir()
+    (fd, name) = opendir.split(os.path.join(foodir, 'fee'))
+    assert name == 'fee'
+    assert opendir.split(os.path.join(foodir, 'fi')) == (fd, 'fi')
+    (otherfd, name) = opendir.split(os.path.join(linkdir, 'fo'))
+    assert name == 'fo'
+    assert opendir.path == linkdir
+    opendir.close()
+    assert opendir.fd is None
+    pytest.raises(OSError, os.fstat, otherfd)
+
+
+@tempdirs.makedirs()
+def test_symlink_unlink(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    linkfile = os.path.join(linkdir, 'fee')
+    fd = os.open(linkdir, os.O_RDONLY)
+    try:
+        dirfd.symlink('/src/fee', fd, 'fee')
+        assert os.readlink(linkfile) == '/src/fee'
+        res = pytest.raises(
+            OSError,
+            dirfd.symlink,
+            '/src/fee',
+            fd,
+            'fee',
+            linkfile,
+        )
+        assert res.value.errno == errno.EEXIST
+        assert res.value.filename == linkfile
+        dirfd.unlink(fd, 'fee')
+        assert os.listdir(linkdir) == []
+        res = pytest.raises(OSError, dirfd.unlink, fd, 'fee')
+        assert res.value.errno == errno.ENOENT
+        assert res.value.filename == 'fee'
+    finally:
+        os.close(fd)
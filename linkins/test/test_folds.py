@@ -0,0 +1,38 @@
+import os
+
+import mock
+import tempdirs
+
+from linkins.folds import FoldList, NAME
+
+
+@tempdirs.makedirs(2)
+def test_fold_list_save_load(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    for name in ['foo', 'bar']:
+        os.makedirs(os.path.join(srcdir, name))
+    linkfoo = os.path.join(linkdir, 'foo')
+    os.symlink(os.path.join(srcdir, 'foo'), linkfoo)
+    assert FoldList.load(linkdir).links == {}
+    foldlist = FoldList()
+    foldlist.links[linkfoo] = os.path.join(srcdir, 'foo')
+    # Gone, so not kept
+    foldlist.links[os.path.join(linkdir, 'bar')] = os.path.join(srcdir, 'bar')
+    foldlist.save(linkdir)
+    assert sorted(os.listdir(linkdir)) == [NAME, 'foo']
+    assert FoldList.load(linkdir).links == dict([
+        (linkfoo, os.path.join(srcdir, 'foo')),
+    ])
+    os.unlink(linkfoo)
+    FoldList.load(linkdir).save(linkdir)
+    assert os.listdir(linkdir) == []
+
+
+@tempdirs.makedirs()
+@mock.patch('linkins.folds.save_state')
+def test_fold_list_unchanged(fakesave, **kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    with mock.patch('os.unlink') as fakeunlink:
+        FoldList.load(linkdir).save(linkdir)
+    assert fakeunlink.mock_calls == []
+    assert fakesave.mock_calls == []
@@ -1,11 +1,12 @@
 import os
 import errno
+import logging
 
 import mock
 import pytest
 import tempdirs
 
-from linkins import link
+from linkins import link, stats
 
 
 @tempdirs.makedirs(2)
@@ -263,9 +264,8 @@ def test_make_linkdir_has_file(fakelog, **kwargs):
         linkdir=linkdir,
     )
     error = mock.call.warn(
-        '{linkfile} already exists. Not linking.'.format(
-            linkfile=linkfile,
-        ),
+        '%s already exists. Not linking.',
+        linkfile,
     )
     assert fakelog.mock_calls == [error]
 
@@ -284,9 +284,8 @@ def test_make_linkdir_has_link(fakelog, **kwargs):
         linkdir=linkdir,
     )
     error = mock.call.warn(
-        '{linkfile} already exists. Not linking.'.format(
-            linkfile=linkfile,
-        ),
+        '%s already exists. Not linking.',
+        linkfile,
     )
     assert fakelog.mock_calls == [error]
 
@@ -307,9 +306,8 @@ def test_make_linkdir_force_file(fakelog, **kwargs):
         force=True,
     )
     debug = mock.call.debug(
-        '{linkfile} already exists. Replacing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s already exists. Replacing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['foo']
@@ -328,17 +326,20 @@ def test_make_linkdir_force_same_link(fakelog, **kwargs):
     with open(srcfile, 'w') as fp:
         fp.write('source content')
     os.symlink(srcfile, linkfile)
+    before = os.lstat(linkfile)
     link.make(
         srcdir=srcdir,
         linkdir=linkdir,
         force=True,
     )
     debug = mock.call.debug(
-        '{linkfile} already exists. Replacing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s already links to its file. Not replacing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
+    # The link is left alone
+    after = os.lstat(linkfile)
+    assert (after.st_ino, after.st_ctime) == (before.st_ino, before.st_ctime)
     assert os.listdir(linkdir) == ['foo']
     assert os.path.isfile(srcfile)
     assert os.path.islink(linkfile)
@@ -367,9 +368,8 @@ def test_make_linkdir_force_different_link(
         force=True,
     )
     debug = mock.call.debug(
-        '{linkfile} already exists. Replacing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s already exists. Replacing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['foo']
@@ -381,6 +381,7 @@ def test_make_linkdir_force_different_link(
 
 @tempdirs.makedirs(2)
 @mock.patch('linkins.link.log')
+@mock.patch('linkins.dirfd.supported', False)
 @mock.patch('os.unlink')
 def test_make_linkdir_unlink_oserror(
         fakeunlink,
@@ -392,7 +393,8 @@ def test_make_linkdir_unlink_oserror(
     linkfile = os.path.join(linkdir, 'foo')
     with open(srcfile, 'w') as fp:
         fp.write('source content')
-    os.symlink(srcfile, linkfile)
+    # Only links which point somewhere else are replaced
+    os.symlink(os.path.join(srcdir, 'fee'), linkfile)
     error = OSError()
     error.errno = errno.EXDEV
     fakeunlink.side_effect = error
@@ -404,9 +406,8 @@ def test_make_linkdir_unlink_oserror(
         force=True,
     )
     debug = mock.call.debug(
-        '{linkfile} already exists. Replacing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s already exists. Replacing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     unlink = mock.call(linkfile)
@@ -417,6 +418,7 @@ def test_make_linkdir_unlink_oserror(
 
 @tempdirs.makedirs(2)
 @mock.patch('linkins.link.log')
+@mock.patch('linkins.dirfd.supported', False)
 @mock.patch('os.unlink')
 def test_make_linkdir_unlink_oserror_enoent(
         fakeunlink,
@@ -443,9 +445,8 @@ def test_make_linkdir_unlink_oserror_enoent(
         force=True,
     )
     debug = mock.call.debug(
-        '{linkfile} already exists. Replacing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s already exists. Replacing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     unlink = mock.call(linkfile)
@@ -476,7 +477,7 @@ def test_make_script_simple(fakerun, **kwargs):
         linkdir,
         '.',
         name='./foo-script',
-        multiprocess=False,
+        pool=None,
     )
     assert fakerun.mock_calls == [run]
     assert os.listdir(linkdir) == []
@@ -505,7 +506,7 @@ def test_make_script_many_files(fakerun, **kwargs):
         linkdir,
         '.',
         name='./foo-script',
-        multiprocess=False,
+        pool=None,
     )
     assert fakerun.mock_calls == [run]
     assert os.listdir(linkdir) == ['foo']
@@ -536,7 +537,7 @@ def test_make_script_nested_dir(fakerun, **kwargs):
         linkdir,
         'foo',
         name='foo/bar-script',
-        multiprocess=False,
+        pool=None,
     )
     assert fakerun.mock_calls == [run]
     assert os.listdir(linkdir) == ['foo']
@@ -566,7 +567,7 @@ def test_make_script_many_scripts(fakerun, **kwargs):
         linkdir,
         '.',
         name='./bar-script',
-        multiprocess=False,
+        pool=None,
     )
     runnested = mock.call(
         scriptnested,
@@ -574,7 +575,7 @@ def test_make_script_many_scripts(fakerun, **kwargs):
         linkdir,
         'foo',
         name='foo/bar-script',
-        multiprocess=False,
+        pool=None,
     )
     calls = [
         run,
@@ -619,8 +620,9 @@ def test_make_script_no_run_nested(fakerun, **kwargs):
 
 
 @tempdirs.makedirs(2)
+@mock.patch('linkins.script.ScriptPool')
 @mock.patch('linkins.script.runscript')
-def test_make_script_multiprocess(fakerun, **kwargs):
+def test_make_script_multiprocess(fakerun, fakepool, **kwargs):
     (srcdir, linkdir) = kwargs['tempdirs_dirs']
     scriptfile = os.path.join(srcdir, 'foo-script')
     with open(scriptfile, 'w') as fp:
@@ -631,6 +633,7 @@ def test_make_script_multiprocess(fakerun, **kwargs):
         scriptname='foo-script',
         runscript=True,
         multiprocess=True,
+        scriptjobs=2,
     )
     run = mock.call(
         scriptfile,
@@ -638,12 +641,114 @@ def test_make_script_multiprocess(fakerun, **kwargs):
         linkdir,
         '.',
         name='./foo-script',
-        multiprocess=True,
-    )
+        pool=fakepool.return_value,
+        key=srcdir,
+        after=[],
+        locks=[],
+        done=None,
+    )
+    pool = mock.call(2)
+    wait = mock.call().wait()
     assert fakerun.mock_calls == [run]
+    assert fakepool.mock_calls == [pool, wait]
     assert os.listdir(linkdir) == []
 
 
+@tempdirs.makedirs(2)
+def test_make_script_multiprocess_waits(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    for name in ['foo', 'bar', 'fee']:
+        nesteddir = os.path.join(srcdir, name)
+        os.makedirs(nesteddir)
+        scriptfile = os.path.join(nesteddir, 'foo-script')
+        with open(scriptfile, 'w') as fp:
+            fp.write('#!/bin/sh\nsleep 0.1\ntouch "$2/$3/done"\n')
+        os.chmod(scriptfile, 0755)
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        scriptname='foo-script',
+        runscript=True,
+        multiprocess=True,
+        scriptjobs=2,
+    )
+    for name in ['foo', 'bar', 'fee']:
+        assert os.listdir(os.path.join(linkdir, name)) == ['done']
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.script.ScriptPool')
+@mock.patch('linkins.script.runscript')
+def test_make_script_multiprocess_pipeline(fakerun, fakepool, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    for name in ['bar', 'foo']:
+        nesteddir = os.path.join(srcdir, name)
+        os.makedirs(nesteddir)
+        for file_ in ['fee', 'foo-script']:
+            with open(os.path.join(nesteddir, file_), 'w') as fp:
+                fp.write('source content')
+    events = []
+    plan_link = link._link
+
+    def fake_link(plan, files, path, pathtail, linkdir, force, **kwargs):
+        events.append(('plan', pathtail))
+        plan_link(plan, files, path, pathtail, linkdir, force, **kwargs)
+
+    def run(scriptsrc, srcdir, linkdir, pathtail, **kwargs):
+        events.append(('run', pathtail))
+        assert os.path.islink(os.path.join(linkdir, pathtail, 'fee'))
+    fakerun.side_effect = run
+    with mock.patch('linkins.link._link') as fakelink:
+        fakelink.side_effect = fake_link
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            scriptname='foo-script',
+            runscript=True,
+            multiprocess=True,
+        )
+    # bar's script is started before foo is planned
+    assert events == [
+        ('plan', 'bar'),
+        ('run', 'bar'),
+        ('plan', 'foo'),
+        ('run', 'foo'),
+    ]
+
+
+@tempdirs.makedirs(2)
+def test_make_script_multiprocess_after(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    script = (
+        '#!/bin/sh\n'
+        '# linkins-after: {after}\n'
+        'sleep {sleep}\n'
+        'echo "$3" >> "$2/order"\n'
+    )
+    for (name, after, sleep) in [
+            ('foo', 'bar fee/fi', 0),
+            ('bar', '', 0.2),
+            ('fee/fi', '', 0.1),
+    ]:
+        nesteddir = os.path.join(srcdir, name)
+        os.makedirs(nesteddir)
+        scriptfile = os.path.join(nesteddir, 'foo-script')
+        with open(scriptfile, 'w') as fp:
+            fp.write(script.format(after=after, sleep=sleep))
+        os.chmod(scriptfile, 0755)
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        scriptname='foo-script',
+        runscript=True,
+        multiprocess=True,
+        scriptjobs=3,
+    )
+    # foo's script doesn't sleep but waits for the other two
+    with open(os.path.join(linkdir, 'order')) as fp:
+        assert fp.read().split() == ['fee/fi', 'bar', 'foo']
+
+
 @tempdirs.makedirs(2)
 @mock.patch('linkins.link.log')
 def test_make_linkdir_clean_file(fakelog, **kwargs):
@@ -660,9 +765,8 @@ def test_make_linkdir_clean_file(fakelog, **kwargs):
         clean=True,
     )
     debug = mock.call.debug(
-        '{linkfile} exists. Removing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s exists. Removing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -685,9 +789,8 @@ def test_make_linkdir_clean_link(fakelog, **kwargs):
         clean=True,
     )
     debug = mock.call.debug(
-        '{linkfile} exists. Removing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s exists. Removing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -714,9 +817,8 @@ def test_make_linkdir_clean_nested_dirs(fakelog, **kwargs):
         clean=True,
     )
     debug = mock.call.debug(
-        '{linkfile} exists. Removing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s exists. Removing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -741,9 +843,8 @@ def test_make_linkdir_clean_dir_exists(fakelog, **kwargs):
         clean=True,
     )
     debug = mock.call.debug(
-        '{linkfile} exists. Removing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s exists. Removing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['fee']
@@ -770,9 +871,8 @@ def test_make_linkdir_clean_file_exists(fakelog, **kwargs):
         clean=True,
     )
     debug = mock.call.debug(
-        '{linkfile} exists. Removing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s exists. Removing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['fee']
@@ -802,9 +902,8 @@ def test_make_linkdir_clean_nested_dir_exists(fakelog, **kwargs):
         clean=True,
     )
     debug = mock.call.debug(
-        '{linkfile} exists. Removing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s exists. Removing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['foo']
@@ -837,9 +936,8 @@ def test_make_linkdir_clean_nested_file_exists(fakelog, **kwargs):
         clean=True,
     )
     debug = mock.call.debug(
-        '{linkfile} exists. Removing.'.format(
-            linkfile=linkfile,
-        ),
+        '%s exists. Removing.',
+        linkfile,
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['foo']
@@ -868,7 +966,8 @@ def test_make_linkdir_exclude_dir(fakelog, **kwargs):
         exclude=['foo'],
     )
     debug = mock.call.debug(
-        'Excluding directory foo'
+        'Excluding directory %s',
+        'foo',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -890,7 +989,8 @@ def test_make_linkdir_exclude_file(fakelog, **kwargs):
         exclude=['foo'],
     )
     debug = mock.call.debug(
-        'Excluding file foo'
+        'Excluding file %s',
+        'foo',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -914,7 +1014,8 @@ def test_make_linkdir_exclude_nested_dir(fakelog, **kwargs):
         exclude=['foo/bar'],
     )
     debug = mock.call.debug(
-        'Excluding directory foo/bar'
+        'Excluding directory %s',
+        'foo/bar',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -938,7 +1039,8 @@ def test_make_linkdir_exclude_nested_file(fakelog, **kwargs):
         exclude=['foo/bar/fee'],
     )
     debug = mock.call.debug(
-        'Excluding file foo/bar/fee'
+        'Excluding file %s',
+        'foo/bar/fee',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -968,7 +1070,8 @@ def test_make_linkdir_exclude_many_files(fakelog, **kwargs):
         exclude=['foo/bar'],
     )
     debug = mock.call.debug(
-        'Excluding directory foo/bar'
+        'Excluding directory %s',
+        'foo/bar',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['foo']
@@ -998,10 +1101,12 @@ def test_make_linkdir_exclude_multiple(fakelog, **kwargs):
         exclude=['foo', 'bar'],
     )
     debugfoo = mock.call.debug(
-        'Excluding file foo'
+        'Excluding file %s',
+        'foo',
     )
     debugbar = mock.call.debug(
-        'Excluding file bar'
+        'Excluding file %s',
+        'bar',
     )
     assert fakelog.mock_calls == [debugbar, debugfoo]
     assert os.listdir(linkdir) == []
@@ -1065,7 +1170,8 @@ def test_make_linkdir_exclude_clean(fakelog, **kwargs):
         clean=True,
     )
     debug = mock.call.debug(
-        'Excluding file foo',
+        'Excluding file %s',
+        'foo',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['foo']
@@ -1090,7 +1196,8 @@ def test_make_linkdir_exclude_script(fakerun, fakelog, **kwargs):
     )
     assert fakerun.mock_calls == []
     debug = mock.call.debug(
-        'Excluding file foo-script'
+        'Excluding file %s',
+        'foo-script',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -1112,7 +1219,8 @@ def test_make_linkdir_exclude_dir_regex(fakelog, **kwargs):
         exclude=['f.*'],
     )
     debug = mock.call.debug(
-        'Excluding directory foo'
+        'Excluding directory %s',
+        'foo',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -1134,7 +1242,8 @@ def test_make_linkdir_exclude_file_regex(fakelog, **kwargs):
         exclude=['f.*'],
     )
     debug = mock.call.debug(
-        'Excluding file foo'
+        'Excluding file %s',
+        'foo',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -1175,7 +1284,8 @@ def test_make_linkdir_exclude_file_regex_complex(fakelog, **kwargs):
         exclude=['^foo.*me$'],
     )
     debug = mock.call.debug(
-        'Excluding file foo_bar_me'
+        'Excluding file %s',
+        'foo_bar_me',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -1199,7 +1309,8 @@ def test_make_linkdir_exclude_file_regex_nested(fakelog, **kwargs):
         exclude=['foo.*b.*/fee'],
     )
     debug = mock.call.debug(
-        'Excluding file foo/bar/fee'
+        'Excluding file %s',
+        'foo/bar/fee',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == []
@@ -1225,7 +1336,8 @@ def test_make_linkdir_exclude_file_regex_many_files(fakelog, **kwargs):
         exclude=['^f.*$'],
     )
     debug = mock.call.debug(
-        'Excluding file foo'
+        'Excluding file %s',
+        'foo',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['bar']
@@ -1253,10 +1365,12 @@ def test_make_linkdir_exclude_file_regex_multiple(fakelog, **kwargs):
         exclude=['^f.*$', 'b.*'],
     )
     bardebug = mock.call.debug(
-        'Excluding file bar'
+        'Excluding file %s',
+        'bar',
     )
     foodebug = mock.call.debug(
-        'Excluding file foo'
+        'Excluding file %s',
+        'foo',
     )
     assert fakelog.mock_calls == [bardebug, foodebug]
     assert os.listdir(linkdir) == []
@@ -1477,7 +1591,8 @@ def test_make_linkdir_include_exclude_multiple(fakelog, **kwargs):
         include=['bar'],
     )
     debug = mock.call.debug(
-        'Excluding file foo'
+        'Excluding file %s',
+        'foo',
     )
     assert fakelog.mock_calls == [debug]
     assert os.listdir(linkdir) == ['bar']
@@ -1485,3 +1600,1239 @@ def test_make_linkdir_include_exclude_multiple(fakelog, **kwargs):
     assert os.path.isfile(srcfoo)
     assert os.path.islink(linkbar)
     assert not os.path.exists(linkfoo)
+
+
+@tempdirs.makedirs(2)
+def test_make_linkdir_symlink_dir(**kwargs):
+    (srcdir, otherdir) = kwargs['tempdirs_dirs']
+    linkdir = os.path.join(otherdir, 'links')
+    os.makedirs(linkdir)
+    otherfile = os.path.join(otherdir, 'fee')
+    with open(otherfile, 'w') as fp:
+        fp.write('other content')
+    srcfile = os.path.join(srcdir, 'foo')
+    with open(srcfile, 'w') as fp:
+        fp.write('source content')
+    # Like os.walk, symlinks to directories are not followed
+    os.symlink(otherdir, os.path.join(srcdir, 'bar'))
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+    )
+    assert os.listdir(linkdir) == ['foo']
+
+
+@tempdirs.makedirs()
+def test_walk_same_as_os_walk(**kwargs):
+    (srcdir,) = kwargs['tempdirs_dirs']
+    for dir_ in ['foo/bar/fee', 'foo/fi', 'fo/fum', 'fo/fum/bar']:
+        os.makedirs(os.path.join(srcdir, dir_))
+    for file_ in ['a', 'foo/b', 'foo/bar/fee/c', 'foo/fi/d', 'fo/e']:
+        with open(os.path.join(srcdir, file_), 'w') as fp:
+            fp.write('content')
+    expected = []
+    for (path, dirs, files) in os.walk(srcdir):
+        dirs.sort()
+        files.sort()
+        pathtail = os.path.normpath(os.path.relpath(path, srcdir))
+        expected.append((path, pathtail, list(dirs), files))
+    assert list(link._walk(srcdir)) == expected
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.link.log')
+def test_make_linkdir_exclude_dir_pruned(fakelog, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    srcnesteddir = os.path.join(srcdir, 'foo', 'bar')
+    os.makedirs(srcnesteddir)
+    srcfile = os.path.join(srcdir, 'foo', 'bar', 'fee')
+    with open(srcfile, 'w') as fp:
+        fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        exclude=['foo'],
+    )
+    # foo/bar is never walked
+    debug = mock.call.debug(
+        'Excluding directory %s',
+        'foo',
+    )
+    assert fakelog.mock_calls == [debug]
+    assert os.listdir(linkdir) == []
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.link.log')
+def test_make_linkdir_exclude_dir_not_pruned(fakelog, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    srcnesteddir = os.path.join(srcdir, 'foo', 'bar')
+    os.makedirs(srcnesteddir)
+    srcfile = os.path.join(srcdir, 'foo', 'bar', 'fee')
+    linkfile = os.path.join(linkdir, 'foo', 'bar', 'fee')
+    with open(srcfile, 'w') as fp:
+        fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        exclude=['foo$'],
+    )
+    debug = mock.call.debug(
+        'Excluding directory %s',
+        'foo',
+    )
+    assert fakelog.mock_calls == [debug]
+    assert os.path.islink(linkfile)
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.link.log')
+def test_make_linkdir_exclude_dir_include_nested(fakelog, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    srcnesteddir = os.path.join(srcdir, 'foo', 'bar')
+    os.makedirs(srcnesteddir)
+    srcfile = os.path.join(srcdir, 'foo', 'bar', 'fee')
+    linkfile = os.path.join(linkdir, 'foo', 'bar', 'fee')
+    with open(srcfile, 'w') as fp:
+        fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        exclude=['foo'],
+        include=['foo/bar'],
+    )
+    debug = mock.call.debug(
+        'Excluding directory %s',
+        'foo',
+    )
+    assert fakelog.mock_calls == [debug]
+    assert os.path.islink(linkfile)
+
+
+@tempdirs.makedirs(4)
+@mock.patch('linkins.link.log')
+def test_make_many_first_wins(fakelog, **kwargs):
+    (firstdir, seconddir, thirddir, linkdir) = kwargs['tempdirs_dirs']
+    for srcdir in [firstdir, seconddir, thirddir]:
+        with open(os.path.join(srcdir, 'foo'), 'w') as fp:
+            fp.write('source content')
+    with open(os.path.join(thirddir, 'bar'), 'w') as fp:
+        fp.write('bar source content')
+    link.make_many(
+        srcdirs=[firstdir, seconddir, thirddir],
+        linkdir=linkdir,
+        jobs=3,
+    )
+    linkfoo = os.path.join(linkdir, 'foo')
+    linkbar = os.path.join(linkdir, 'bar')
+    assert sorted(os.listdir(linkdir)) == ['bar', 'foo']
+    assert os.readlink(linkfoo) == os.path.join(firstdir, 'foo')
+    assert os.readlink(linkbar) == os.path.join(thirddir, 'bar')
+    warn = mock.call.warn(
+        '%s already exists. Not linking.',
+        linkfoo,
+    )
+    assert [call for call in fakelog.mock_calls if call[0] == 'warn'] == [
+        warn,
+        warn,
+    ]
+
+
+@tempdirs.makedirs(2)
+def test_make_many_bad_srcdir(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    with open(os.path.join(srcdir, 'foo'), 'w') as fp:
+        fp.write('source content')
+    res = pytest.raises(
+        ValueError,
+        link.make_many,
+        srcdirs=[srcdir, ''],
+        linkdir=linkdir,
+        jobs=2,
+    )
+    assert res.value.message == 'Target directory "" does not exist'
+    # Target directories before the bad one are still linked
+    assert os.listdir(linkdir) == ['foo']
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.script.runscript')
+def test_make_dry_run(fakerun, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    nesteddir = os.path.join(srcdir, 'foo')
+    os.makedirs(nesteddir)
+    with open(os.path.join(nesteddir, 'bar'), 'w') as fp:
+        fp.write('source content')
+    with open(os.path.join(nesteddir, 'foo-script'), 'w') as fp:
+        fp.write('script content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        scriptname='foo-script',
+        runscript=True,
+        dry_run=True,
+    )
+    assert os.listdir(linkdir) == []
+    assert fakerun.mock_calls == []
+
+
+@tempdirs.makedirs(2)
+def test_plan_operations(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    nesteddir = os.path.join(srcdir, 'foo')
+    os.makedirs(nesteddir)
+    for file_ in ['bar', 'fee', 'foo-script']:
+        with open(os.path.join(nesteddir, file_), 'w') as fp:
+            fp.write('source content')
+    scan = link._scan(
+        srcdir,
+        linkdir,
+        'foo-script',
+        link.match.Matcher(),
+    )
+    plan = link._plan(
+        scan,
+        srcdir,
+        linkdir,
+        runscript=True,
+        force=False,
+        clean=False,
+        multiprocess=False,
+        dircache=link.DirCache(),
+    )
+    linknested = os.path.join(linkdir, 'foo')
+    assert plan.operations == [
+        ('mkdir', linknested),
+        (
+            'symlink',
+            os.path.join(nesteddir, 'bar'),
+            os.path.join(linknested, 'bar'),
+        ),
+        (
+            'symlink',
+            os.path.join(nesteddir, 'fee'),
+            os.path.join(linknested, 'fee'),
+        ),
+        (
+            'script',
+            os.path.join(nesteddir, 'foo-script'),
+            srcdir,
+            linkdir,
+            'foo',
+            'foo/foo-script',
+            False,
+        ),
+    ]
+    assert os.listdir(linkdir) == []
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.script.runscript')
+def test_make_many_dirs_stat_once(fakerun, **kwargs):
+    (firstdir, seconddir) = kwargs['tempdirs_dirs']
+    linkdir = os.path.join(firstdir, 'links')
+    os.makedirs(linkdir)
+    for srcdir in [firstdir, seconddir]:
+        nesteddir = os.path.join(srcdir, 'foo')
+        os.makedirs(nesteddir)
+        for file_ in ['bar', 'fee', 'foo-script']:
+            with open(os.path.join(nesteddir, file_), 'w') as fp:
+                fp.write('source content')
+    exists = os.path.exists
+    with mock.patch('os.path.exists') as fakeexists:
+        fakeexists.side_effect = exists
+        link.make_many(
+            srcdirs=[firstdir, seconddir],
+            linkdir=linkdir,
+            scriptname='foo-script',
+            runscript=True,
+            exclude=['links'],
+        )
+    linknested = os.path.join(linkdir, 'foo')
+    paths = [call[1][0] for call in fakeexists.mock_calls]
+    # And once more after the first script, which could have changed
+    # LINK_DIR, ran
+    assert paths.count(linknested) == 2
+    assert len(fakerun.mock_calls) == 2
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.script.log')
+@mock.patch('linkins.link.log')
+def test_make_script_makes_links(fakelog, fakescriptlog, **kwargs):
+    # Files a script makes in LINK_DIR are seen by the rest of the run
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    _make_files(srcdir, ['fee', 'foo/fi', 'foo/bar/gen.conf', 'fo/fum'])
+    for (pathtail, made) in [('.', 'fo/fum'), ('foo', 'foo/bar/gen.conf')]:
+        scriptfile = os.path.join(srcdir, pathtail, 'foo-script')
+        with open(scriptfile, 'w') as fp:
+            fp.write(
+                '#!/bin/sh\n'
+                'mkdir -p "$2/$(dirname {made})"\n'
+                'echo generated > "$2/{made}"\n'.format(
+                    made=made,
+                )
+            )
+        os.chmod(scriptfile, 0755)
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        scriptname='foo-script',
+        runscript=True,
+    )
+    for made in ['fo/fum', 'foo/bar/gen.conf']:
+        linkpath = os.path.join(linkdir, made)
+        assert not os.path.islink(linkpath)
+        with open(linkpath) as fp:
+            assert fp.read() == 'generated\n'
+        warn = mock.call.warn(
+            '%s already exists. Not linking.',
+            linkpath,
+        )
+        assert warn in fakelog.mock_calls
+    assert os.readlink(os.path.join(linkdir, 'foo', 'fi')) == (
+        os.path.join(srcdir, 'foo', 'fi')
+    )
+
+
+@tempdirs.makedirs(3)
+def test_make_incremental(**kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    nesteddir = os.path.join(srcdir, 'foo')
+    os.makedirs(nesteddir)
+    for file_ in ['bar', 'fee']:
+        with open(os.path.join(nesteddir, file_), 'w') as fp:
+            fp.write('source content')
+    with open(os.path.join(srcdir, 'fo'), 'w') as fp:
+        fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+    )
+    os.remove(os.path.join(nesteddir, 'bar'))
+    with open(os.path.join(nesteddir, 'fi'), 'w') as fp:
+        fp.write('source content')
+    scandir = link.scandir
+    with mock.patch('linkins.link.scandir') as fakescandir:
+        fakescandir.side_effect = scandir
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            statedir=statedir,
+            incremental=True,
+        )
+    # Only the changed directory is listed
+    assert fakescandir.mock_calls == [mock.call(nesteddir)]
+    linknested = os.path.join(linkdir, 'foo')
+    assert sorted(os.listdir(linknested)) == ['fee', 'fi']
+    assert os.readlink(os.path.join(linknested, 'fi')) == os.path.join(
+        nesteddir,
+        'fi',
+    )
+    assert os.path.islink(os.path.join(linkdir, 'fo'))
+
+
+@tempdirs.makedirs(3)
+def test_make_incremental_unchanged(**kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    with open(os.path.join(srcdir, 'foo'), 'w') as fp:
+        fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+    )
+    with mock.patch('linkins.link.scandir') as fakescandir:
+        with mock.patch('os.path.lexists') as fakelexists:
+            link.make(
+                srcdir=srcdir,
+                linkdir=linkdir,
+                statedir=statedir,
+                incremental=True,
+            )
+    assert fakescandir.mock_calls == []
+    assert fakelexists.mock_calls == []
+    assert os.listdir(linkdir) == ['foo']
+
+
+@tempdirs.makedirs(3)
+def test_make_incremental_stale_dir(**kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    nesteddir = os.path.join(srcdir, 'foo', 'bar')
+    os.makedirs(nesteddir)
+    with open(os.path.join(nesteddir, 'fee'), 'w') as fp:
+        fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+    )
+    os.remove(os.path.join(nesteddir, 'fee'))
+    os.rmdir(nesteddir)
+    os.rmdir(os.path.join(srcdir, 'foo'))
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        incremental=True,
+    )
+    assert os.listdir(linkdir) == []
+
+
+@tempdirs.makedirs(4)
+def test_make_many_incremental_shadowed(**kwargs):
+    # A file shadowed by an earlier target directory is linked once
+    # the earlier one's file is gone
+    (firstdir, seconddir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    for merge in [False, True]:
+        name = str(merge)
+        srcdirs = [
+            os.path.join(firstdir, name),
+            os.path.join(seconddir, name),
+        ]
+        for srcdir in srcdirs:
+            _make_files(srcdir, ['fee', 'foo/fi'])
+        linkdir_ = os.path.join(linkdir, name)
+        os.makedirs(linkdir_)
+        linkfi = os.path.join(linkdir_, 'foo', 'fi')
+        for (srcdir, remove) in [(srcdirs[0], False), (srcdirs[1], True)]:
+            if remove:
+                os.remove(os.path.join(srcdirs[0], 'foo', 'fi'))
+            link.make_many(
+                srcdirs=srcdirs,
+                linkdir=linkdir_,
+                statedir=os.path.join(statedir, name),
+                incremental=True,
+                merge=merge,
+            )
+            assert os.readlink(linkfi) == os.path.join(srcdir, 'foo', 'fi')
+
+
+@tempdirs.makedirs(3)
+def test_make_incremental_options_changed(**kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    with open(os.path.join(srcdir, 'foo'), 'w') as fp:
+        fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        exclude=['foo'],
+    )
+    assert os.listdir(linkdir) == []
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        incremental=True,
+    )
+    assert os.listdir(linkdir) == ['foo']
+
+
+@tempdirs.makedirs(4)
+def test_make_clean_manifest(**kwargs):
+    (srcdir, linkdir, statedir, otherdir) = kwargs['tempdirs_dirs']
+    nesteddir = os.path.join(srcdir, 'foo', 'bar')
+    os.makedirs(nesteddir)
+    for file_ in ['fee', 'fi', 'fo']:
+        with open(os.path.join(nesteddir, file_), 'w') as fp:
+            fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+    )
+    # Sources which are gone are still cleaned
+    os.remove(os.path.join(nesteddir, 'fee'))
+    # Links which point elsewhere are not
+    linknested = os.path.join(linkdir, 'foo', 'bar')
+    otherfile = os.path.join(otherdir, 'fo')
+    with open(otherfile, 'w') as fp:
+        fp.write('other content')
+    os.remove(os.path.join(linknested, 'fo'))
+    os.symlink(otherfile, os.path.join(linknested, 'fo'))
+    with mock.patch('linkins.link.scandir') as fakescandir:
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            statedir=statedir,
+            clean=True,
+        )
+    assert fakescandir.mock_calls == []
+    assert os.listdir(linknested) == ['fo']
+    assert os.listdir(statedir) == []
+
+
+@tempdirs.makedirs(3)
+def test_make_clean_manifest_exclude_incremental(**kwargs):
+    # Directories cleaned but for their excluded links are walked
+    # again by the next incremental run
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    _make_files(srcdir, ['foo', 'bar', 'd/baz'])
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+    )
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        clean=True,
+        exclude=['foo'],
+    )
+    assert os.listdir(linkdir) == ['foo']
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        incremental=True,
+    )
+    assert sorted(os.listdir(linkdir)) == ['bar', 'd', 'foo']
+    assert os.readlink(os.path.join(linkdir, 'd', 'baz')) == (
+        os.path.join(srcdir, 'd', 'baz')
+    )
+
+
+@tempdirs.makedirs(3)
+def test_make_clean_manifest_empty_dirs(**kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    for dir_ in ['foo/bar', 'foo/fee', 'fi']:
+        nesteddir = os.path.join(srcdir, dir_)
+        os.makedirs(nesteddir)
+        with open(os.path.join(nesteddir, 'fo'), 'w') as fp:
+            fp.write('source content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+    )
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        clean=True,
+        exclude=['fi'],
+    )
+    assert os.listdir(linkdir) == ['fi']
+    assert os.path.islink(os.path.join(linkdir, 'fi', 'fo'))
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        clean=True,
+    )
+    assert os.listdir(linkdir) == []
+    assert os.listdir(statedir) == []
+
+
+def _counting_script(srcdir, name, status=0):
+    # A script which counts its runs in LINK_DIR/runs
+    nesteddir = os.path.join(srcdir, name)
+    if not os.path.exists(nesteddir):
+        os.makedirs(nesteddir)
+    scriptfile = os.path.join(nesteddir, 'foo-script')
+    with open(scriptfile, 'w') as fp:
+        fp.write(
+            '#!/bin/sh\n'
+            'echo "$3" >> "$2/runs"\n'
+            'exit {status}\n'.format(
+                status=status,
+            )
+        )
+    os.chmod(scriptfile, 0755)
+
+
+def _runs(linkdir):
+    path = os.path.join(linkdir, 'runs')
+    if not os.path.exists(path):
+        return []
+    with open(path) as fp:
+        runs = fp.read().split()
+    os.unlink(path)
+    return runs
+
+
+@tempdirs.makedirs(3)
+@mock.patch('linkins.script.log')
+def test_make_cache_scripts(fakelog, **kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    _counting_script(srcdir, 'foo')
+    _counting_script(srcdir, 'bar')
+    _counting_script(srcdir, 'fee', status=1)
+
+    def make(**kwargs):
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            scriptname='foo-script',
+            runscript=True,
+            statedir=statedir,
+            cachescripts=True,
+            **kwargs
+        )
+        return sorted(_runs(linkdir))
+    assert make() == ['bar', 'fee', 'foo']
+    # Failed scripts aren't cached
+    assert make() == ['fee']
+    with open(os.path.join(srcdir, 'foo', 'fi'), 'w') as fp:
+        fp.write('source content')
+    assert make() == ['fee', 'foo']
+    assert make(rerunscripts=True) == ['bar', 'fee', 'foo']
+    assert make() == ['fee']
+
+
+@tempdirs.makedirs(3)
+@mock.patch('linkins.script.log')
+def test_make_cache_scripts_multiprocess(fakelog, **kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    _counting_script(srcdir, 'foo')
+    _counting_script(srcdir, 'bar')
+    scriptfile = os.path.join(srcdir, 'foo', 'foo-script')
+    with open(scriptfile) as fp:
+        content = fp.read()
+    with open(scriptfile, 'w') as fp:
+        fp.write(content.replace('\n', '\n# linkins-after: bar\n', 1))
+
+    def make():
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            scriptname='foo-script',
+            runscript=True,
+            multiprocess=True,
+            statedir=statedir,
+            cachescripts=True,
+        )
+        return _runs(linkdir)
+    assert make() == ['bar', 'foo']
+    assert make() == []
+    with open(os.path.join(srcdir, 'foo', 'fi'), 'w') as fp:
+        fp.write('source content')
+    # bar is skipped and foo still runs after it
+    assert make() == ['foo']
+
+
+@tempdirs.makedirs(3)
+@mock.patch('linkins.link.log')
+def test_make_relink_readlink(fakelog, **kwargs):
+    # Existing links are only read to be kept in a manifest
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    _make_files(srcdir, ['fee', 'foo/fi'])
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+    )
+    for (statedir_, readlinks) in [(None, 0), (statedir, 2)]:
+        with stats.recording() as recorder:
+            link.make(
+                srcdir=srcdir,
+                linkdir=linkdir,
+                statedir=statedir_,
+            )
+        assert recorder.counts.get('readlink', 0) == readlinks
+    manifest = link.Manifest.load(statedir, srcdir, linkdir)
+    assert sorted(manifest.links) == [
+        os.path.join(linkdir, 'fee'),
+        os.path.join(linkdir, 'foo', 'fi'),
+    ]
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.script.log')
+def test_make_stats(fakelog, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    _counting_script(srcdir, 'foo')
+    for file_ in ['bar', 'fee']:
+        with open(os.path.join(srcdir, 'foo', file_), 'w') as fp:
+            fp.write('source content')
+    with open(os.path.join(linkdir, 'bar'), 'w') as fp:
+        fp.write('existing content')
+    with open(os.path.join(srcdir, 'bar'), 'w') as fp:
+        fp.write('source content')
+    with stats.recording() as recorder:
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            scriptname='foo-script',
+            runscript=True,
+            force=True,
+        )
+    with stats.recording() as cleaned:
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            scriptname='foo-script',
+            clean=True,
+        )
+    assert recorder.counts == dict([
+        ('walk', 2),
+        # Two directories, three files and the script
+        ('exclude', 6),
+        # LINK_DIR, LINK_DIR/foo and LINK_DIR/bar
+        ('stat', 3),
+        # Whether LINK_DIR/bar is a link, since it is replaced
+        ('readlink', 1),
+        ('makedirs', 1),
+        ('symlink', 3),
+        ('unlink', 1),
+        ('script', 1),
+    ])
+    assert cleaned.counts == dict([
+        ('walk', 2),
+        ('exclude', 6),
+        # Two directories, three links and whether foo is empty
+        ('stat', 6),
+        ('unlink', 3),
+        ('rmdir', 1),
+    ])
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.link.log')
+def test_make_summary(fakelog, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    nesteddir = os.path.join(srcdir, 'nested')
+    os.makedirs(nesteddir)
+    os.makedirs(os.path.join(srcdir, 'bar'))
+    for path in [
+            os.path.join(srcdir, 'fee'),
+            os.path.join(srcdir, 'fi'),
+            os.path.join(srcdir, 'fo'),
+            os.path.join(srcdir, 'bar', 'fum'),
+            os.path.join(nesteddir, 'fee'),
+            os.path.join(nesteddir, 'fi'),
+    ]:
+        with open(path, 'w') as fp:
+            fp.write('source content')
+    for file_ in ['fee', 'fi']:
+        with open(os.path.join(linkdir, file_), 'w') as fp:
+            fp.write('existing content')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        exclude=['fo', 'bar'],
+        summary=True,
+    )
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        exclude=['fo', 'bar', 'fi'],
+        force=True,
+        summary=True,
+    )
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        clean=True,
+        summary=True,
+    )
+    calls = [
+        mock.call.log(logging.INFO, 'Linked %d files', 2),
+        mock.call.log(
+            logging.WARN,
+            '%d files already exist. Not linking.',
+            2,
+        ),
+        mock.call.log(logging.INFO, 'Excluded %d directories', 1),
+        mock.call.log(logging.INFO, 'Excluded %d files', 1),
+        mock.call.log(logging.INFO, 'Linked %d files', 1),
+        mock.call.log(logging.INFO, 'Replaced %d existing files', 1),
+        mock.call.log(logging.INFO, 'Left %d correct links unchanged', 2),
+        mock.call.log(logging.INFO, 'Excluded %d directories', 1),
+        mock.call.log(logging.INFO, 'Excluded %d files', 2),
+        mock.call.log(logging.INFO, 'Removed %d links', 4),
+    ]
+    assert fakelog.mock_calls == calls
+
+
+def _make_files(srcdir, files):
+    for file_ in files:
+        path = os.path.join(srcdir, file_)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            fp.write('source content')
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.link.log')
+def test_make_fold(fakelog, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    _make_files(srcdir, ['fee', 'foo/fi', 'foo/bar/fo'])
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        fold=True,
+    )
+    linkfoo = os.path.join(linkdir, 'foo')
+    assert sorted(os.listdir(linkdir)) == ['.linkins-folds', 'fee', 'foo']
+    assert os.readlink(linkfoo) == os.path.join(srcdir, 'foo')
+    assert link.FoldList.load(linkdir).links == dict([
+        (linkfoo, os.path.join(srcdir, 'foo')),
+    ])
+    assert fakelog.mock_calls == [mock.call.debug('Folding %s', linkfoo)]
+    before = os.lstat(linkfoo)
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        fold=True,
+        force=True,
+    )
+    after = os.lstat(linkfoo)
+    assert (after.st_ino, after.st_ctime) == (before.st_ino, before.st_ctime)
+    assert sorted(os.listdir(srcdir)) == ['fee', 'foo']
+    assert sorted(os.listdir(os.path.join(srcdir, 'foo'))) == ['bar', 'fi']
+
+
+@tempdirs.makedirs(2)
+def test_make_fold_not_whole(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    _make_files(
+        srcdir,
+        [
+            'foo/fi',
+            'foo/foo-script',
+            'bar/fee',
+            'bar/fo.pyc',
+            'bar/nested/fum',
+            'fum/fi',
+        ],
+    )
+    os.symlink(
+        os.path.join(srcdir, 'bar'),
+        os.path.join(srcdir, 'fum', 'bar'),
+    )
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        scriptname='foo-script',
+        exclude=['.*\.pyc$'],
+        fold=True,
+    )
+    # A script, an excluded file and a symlink to a directory
+    for dir_ in ['foo', 'bar', 'fum']:
+        assert not os.path.islink(os.path.join(linkdir, dir_))
+    assert os.listdir(os.path.join(linkdir, 'foo')) == ['fi']
+    assert sorted(os.listdir(os.path.join(linkdir, 'bar'))) == [
+        'fee',
+        'nested',
+    ]
+    assert os.readlink(os.path.join(linkdir, 'bar', 'nested')) == (
+        os.path.join(srcdir, 'bar', 'nested')
+    )
+    assert os.listdir(os.path.join(linkdir, 'fum')) == ['fi']
+
+
+@tempdirs.makedirs(3)
+@mock.patch('linkins.link.log')
+def test_make_many_fold_unfold(fakelog, **kwargs):
+    (firstdir, seconddir, linkdir) = kwargs['tempdirs_dirs']
+    _make_files(firstdir, ['foo/fi', 'foo/bar/fo', 'foo/baz/fee'])
+    _make_files(seconddir, ['foo/fum', 'foo/bar/fum'])
+    for i in range(2):
+        link.make_many(
+            srcdirs=[firstdir, seconddir],
+            linkdir=linkdir,
+            fold=True,
+        )
+        linkfoo = os.path.join(linkdir, 'foo')
+        assert not os.path.islink(linkfoo)
+        assert sorted(os.listdir(linkfoo)) == ['bar', 'baz', 'fi', 'fum']
+        for (name, srcdir) in [
+                ('fi', firstdir),
+                ('baz', firstdir),
+                ('fum', seconddir),
+        ]:
+            assert os.readlink(os.path.join(linkfoo, name)) == (
+                os.path.join(srcdir, 'foo', name)
+            )
+        linkbar = os.path.join(linkfoo, 'bar')
+        assert not os.path.islink(linkbar)
+        assert sorted(os.listdir(linkbar)) == ['fo', 'fum']
+        assert os.readlink(os.path.join(linkbar, 'fo')) == (
+            os.path.join(firstdir, 'foo', 'bar', 'fo')
+        )
+    folds = [
+        call
+        for call in fakelog.mock_calls
+        if call[1][0] in ['Folding %s', 'Unfolding %s']
+    ]
+    # Only on the first run
+    assert folds == [
+        mock.call.debug('Folding %s', linkfoo),
+        mock.call.debug('Unfolding %s', linkfoo),
+        mock.call.debug('Unfolding %s', linkbar),
+    ]
+    # Nothing was removed from the target directories
+    assert sorted(os.listdir(os.path.join(firstdir, 'foo'))) == [
+        'bar',
+        'baz',
+        'fi',
+    ]
+    assert os.listdir(os.path.join(firstdir, 'foo', 'bar')) == ['fo']
+
+
+@tempdirs.makedirs(3)
+def test_make_unfold_without_fold(**kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    _make_files(srcdir, ['foo/fi', 'foo/bar/fo'])
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        fold=True,
+    )
+    # The manifest says the last run folded
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+    )
+    linkfoo = os.path.join(linkdir, 'foo')
+    assert not os.path.islink(linkfoo)
+    assert sorted(os.listdir(linkfoo)) == ['bar', 'fi']
+    assert not os.path.islink(os.path.join(linkfoo, 'bar'))
+    assert os.readlink(os.path.join(linkfoo, 'bar', 'fo')) == (
+        os.path.join(srcdir, 'foo', 'bar', 'fo')
+    )
+    assert os.listdir(os.path.join(srcdir, 'foo', 'bar')) == ['fo']
+
+
+@tempdirs.makedirs(3)
+def test_make_many_unfold_other_run(**kwargs):
+    # Folds are found whichever target directories made them
+    (firstdir, seconddir, linkdir) = kwargs['tempdirs_dirs']
+    _make_files(firstdir, ['d/y', 'd/e/x'])
+    _make_files(seconddir, ['d/z', 'd/e/w'])
+    for fold in [False, True]:
+        link.make_many(
+            srcdirs=[firstdir],
+            linkdir=linkdir,
+            fold=True,
+        )
+        link.make_many(
+            srcdirs=[seconddir],
+            linkdir=linkdir,
+            fold=fold,
+        )
+        assert sorted(os.listdir(os.path.join(firstdir, 'd'))) == ['e', 'y']
+        assert os.listdir(os.path.join(firstdir, 'd', 'e')) == ['x']
+        for (srcdir, filetail) in [
+                (firstdir, 'd/y'),
+                (firstdir, 'd/e/x'),
+                (seconddir, 'd/z'),
+                (seconddir, 'd/e/w'),
+        ]:
+            assert os.readlink(os.path.join(linkdir, filetail)) == (
+                os.path.join(srcdir, filetail)
+            )
+        link.make_many(
+            srcdirs=[firstdir, seconddir],
+            linkdir=linkdir,
+            clean=True,
+        )
+        assert os.listdir(linkdir) == []
+
+
+@tempdirs.makedirs(4)
+def test_make_own_dir_link(**kwargs):
+    # A link to a directory which linkins didn't fold is linked into,
+    # even if its path ends like the directory's
+    (srcdir, linkdir, otherdir, statedir) = kwargs['tempdirs_dirs']
+    _make_files(srcdir, ['foo/fi'])
+    os.makedirs(os.path.join(otherdir, 'foo'))
+    linkfoo = os.path.join(linkdir, 'foo')
+    os.symlink(os.path.join(otherdir, 'foo'), linkfoo)
+    linkfi = os.path.join(otherdir, 'foo', 'fi')
+    for fold in [False, True]:
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            statedir=statedir,
+            fold=fold,
+        )
+        assert os.readlink(linkfoo) == os.path.join(otherdir, 'foo')
+        assert os.readlink(linkfi) == os.path.join(srcdir, 'foo', 'fi')
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            clean=True,
+        )
+        assert os.readlink(linkfoo) == os.path.join(otherdir, 'foo')
+        assert not os.path.lexists(linkfi)
+
+
+@tempdirs.makedirs(3)
+def test_make_clean_fold(**kwargs):
+    (firstdir, seconddir, linkdir) = kwargs['tempdirs_dirs']
+    _make_files(firstdir, ['fee', 'foo/fi'])
+    _make_files(seconddir, ['bar/fi'])
+    link.make_many(
+        srcdirs=[firstdir, seconddir],
+        linkdir=linkdir,
+        fold=True,
+    )
+    # The same files, under the other target directory's folded
+    # directory, are left alone
+    _make_files(seconddir, ['foo/fi'])
+    fakeclean = mock.Mock(wraps=link._clean)
+    with mock.patch('linkins.link._clean', fakeclean):
+        link.make_many(
+            srcdirs=[seconddir, firstdir],
+            linkdir=linkdir,
+            clean=True,
+        )
+    assert os.listdir(linkdir) == []
+    assert os.listdir(os.path.join(firstdir, 'foo')) == ['fi']
+    # Only firstdir's fee isn't in a folded directory
+    assert [call[1][2] for call in fakeclean.mock_calls] == ['.']
+
+
+@tempdirs.makedirs(3)
+def test_make_clean_fold_manifest(**kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    _make_files(srcdir, ['foo/fi'])
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        fold=True,
+    )
+    assert os.path.islink(os.path.join(linkdir, 'foo'))
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        statedir=statedir,
+        clean=True,
+    )
+    assert os.listdir(linkdir) == []
+    assert os.listdir(os.path.join(srcdir, 'foo')) == ['fi']
+
+
+@tempdirs.makedirs(4)
+@mock.patch('linkins.link.log')
+def test_make_many_merge(fakelog, **kwargs):
+    (firstdir, seconddir, thirddir, linkdir) = kwargs['tempdirs_dirs']
+    for srcdir in [firstdir, seconddir, thirddir]:
+        _make_files(srcdir, ['foo'])
+    _make_files(thirddir, ['bar'])
+    with stats.recording() as recorder:
+        link.make_many(
+            srcdirs=[firstdir, seconddir, thirddir],
+            linkdir=linkdir,
+            jobs=3,
+            merge=True,
+        )
+    linkfoo = os.path.join(linkdir, 'foo')
+    assert sorted(os.listdir(linkdir)) == ['bar', 'foo']
+    assert os.readlink(linkfoo) == os.path.join(firstdir, 'foo')
+    assert os.readlink(os.path.join(linkdir, 'bar')) == (
+        os.path.join(thirddir, 'bar')
+    )
+    assert [call for call in fakelog.mock_calls if call[0] == 'warn'] == []
+    overridden = [
+        mock.call.debug(
+            '%s is linked from another target directory. Not linking.',
+            os.path.join(srcdir, 'foo'),
+        )
+        for srcdir in [seconddir, thirddir]
+    ]
+    assert [
+        call for call in fakelog.mock_calls if call in overridden
+    ] == overridden
+    # LINK_DIR once and each link once
+    assert recorder.counts['stat'] == 3
+
+
+@tempdirs.makedirs(3)
+def test_make_many_merge_force(**kwargs):
+    (firstdir, seconddir, linkdir) = kwargs['tempdirs_dirs']
+    for srcdir in [firstdir, seconddir]:
+        _make_files(srcdir, ['foo'])
+    linkfoo = os.path.join(linkdir, 'foo')
+    os.symlink(os.path.join(firstdir, 'foo'), linkfoo)
+    with stats.recording() as recorder:
+        link.make_many(
+            srcdirs=[firstdir, seconddir],
+            linkdir=linkdir,
+            force=True,
+            merge=True,
+        )
+    # The last one wins, like without merge
+    assert os.readlink(linkfoo) == os.path.join(seconddir, 'foo')
+    assert recorder.counts['readlink'] == 1
+    assert recorder.counts['symlink'] == 1
+
+
+@tempdirs.makedirs(3)
+@mock.patch('linkins.link.log')
+def test_make_many_merge_fold(fakelog, **kwargs):
+    (firstdir, seconddir, linkdir) = kwargs['tempdirs_dirs']
+    _make_files(firstdir, ['foo/fi', 'foo/bar/fo', 'fee/fi'])
+    _make_files(seconddir, ['foo/fum'])
+    link.make_many(
+        srcdirs=[firstdir, seconddir],
+        linkdir=linkdir,
+        fold=True,
+        merge=True,
+    )
+    linkfoo = os.path.join(linkdir, 'foo')
+    linkbar = os.path.join(linkfoo, 'bar')
+    linkfee = os.path.join(linkdir, 'fee')
+    assert not os.path.islink(linkfoo)
+    assert sorted(os.listdir(linkfoo)) == ['bar', 'fi', 'fum']
+    assert os.readlink(linkbar) == os.path.join(firstdir, 'foo', 'bar')
+    assert os.readlink(linkfee) == os.path.join(firstdir, 'fee')
+    folds = [
+        call
+        for call in fakelog.mock_calls
+        if call[1][0] in ['Folding %s', 'Unfolding %s']
+    ]
+    assert folds == [
+        mock.call.debug('Folding %s', linkfee),
+        mock.call.debug('Folding %s', linkbar),
+    ]
+
+
+@tempdirs.makedirs(4)
+def test_make_many_merge_incremental(**kwargs):
+    (firstdir, seconddir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    _make_files(seconddir, ['foo'])
+    linkfoo = os.path.join(linkdir, 'foo')
+    for i in range(2):
+        link.make_many(
+            srcdirs=[firstdir, seconddir],
+            linkdir=linkdir,
+            statedir=statedir,
+            incremental=True,
+            merge=True,
+        )
+        assert os.readlink(linkfoo) == os.path.join(seconddir, 'foo')
+        # The link already there is left alone, like without merge
+        _make_files(firstdir, ['foo'])
+
+
+@tempdirs.makedirs(3)
+def test_conflicts(**kwargs):
+    (firstdir, seconddir, thirddir) = kwargs['tempdirs_dirs']
+    _make_files(
+        firstdir,
+        ['fee', 'foo/fi', 'foo/fo.pyc', 'foo/foo-script', 'fum'],
+    )
+    _make_files(
+        seconddir,
+        ['fee', 'foo/fi', 'foo/fo.pyc', 'foo/foo-script'],
+    )
+    _make_files(thirddir, ['fee', 'bar'])
+    srcdirs = [firstdir, seconddir, thirddir]
+    with stats.recording() as recorder:
+        conflicts = link.conflicts(
+            srcdirs=srcdirs,
+            jobs=2,
+            scriptname='foo-script',
+            exclude=['.*\.pyc$'],
+        )
+    assert conflicts.srcdirs == dict([
+        ('fee', [firstdir, seconddir, thirddir]),
+        (os.path.join('foo', 'fi'), [firstdir, seconddir]),
+    ])
+    # Only the target directories are walked
+    assert sorted(recorder.counts) == ['exclude', 'walk']
+    conflicts = link.conflicts(
+        srcdirs=srcdirs,
+        force=True,
+    )
+    assert conflicts.srcdirs['fee'] == [thirddir, seconddir, firstdir]
+    assert len(conflicts) == 4
+
+
+def _write(path, content):
+    with open(path, 'w') as fp:
+        fp.write(content)
+
+
+@tempdirs.makedirs(2)
+def test_make_ignore(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    _make_files(
+        srcdir,
+        [
+            'fee',
+            'fo',
+            'foo/fee',
+            'foo/fi',
+            'foo/fi2',
+            'foo/fo',
+            'foo/nested/fum',
+            'bar/fi',
+            'baz/fee',
+            'baz/nested/fi',
+        ],
+    )
+    _write(
+        os.path.join(srcdir, link.IGNORE_NAME),
+        '# Only at the top\nfee$\n\n',
+    )
+    _write(
+        os.path.join(srcdir, 'foo', link.IGNORE_NAME),
+        'fi\n!fi2\nnested\n',
+    )
+    _write(os.path.join(srcdir, 'baz', link.IGNORE_NAME), '.*\n')
+    link.make(
+        srcdir=srcdir,
+        linkdir=linkdir,
+        exclude=['fo$'],
+    )
+    assert sorted(os.listdir(linkdir)) == ['bar', 'foo']
+    assert sorted(os.listdir(os.path.join(linkdir, 'foo'))) == [
+        'fee',
+        'fi2',
+        'fo',
+    ]
+    assert os.listdir(os.path.join(linkdir, 'bar')) == ['fi']
+
+
+@tempdirs.makedirs(2)
+def test_make_ignore_bad_pattern(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    ignore = os.path.join(srcdir, link.IGNORE_NAME)
+    _write(ignore, 'fo(\n')
+    res = pytest.raises(
+        ValueError,
+        link.make,
+        srcdir=srcdir,
+        linkdir=linkdir,
+    )
+    assert str(res.value).startswith(
+        'Bad pattern in "{ignore}": '.format(
+            ignore=ignore,
+        )
+    )
+
+
+@tempdirs.makedirs(3)
+def test_make_ignore_incremental(**kwargs):
+    (srcdir, linkdir, statedir) = kwargs['tempdirs_dirs']
+    _make_files(srcdir, ['foo/bar/fee', 'foo/bar/fi'])
+    ignore = os.path.join(srcdir, 'foo', link.IGNORE_NAME)
+    _write(ignore, '')
+    linkbar = os.path.join(linkdir, 'foo', 'bar')
+    for (content, files) in [
+            ('', ['fee', 'fi']),
+            ('bar/fee\n', ['fi']),
+            ('', ['fee', 'fi']),
+    ]:
+        stat = os.stat(os.path.dirname(ignore))
+        _write(ignore, content)
+        # Only the ignore file's modification time changes
+        os.utime(ignore, (stat.st_atime, os.stat(ignore).st_mtime + 1))
+        os.utime(os.path.dirname(ignore), (stat.st_atime, stat.st_mtime))
+        link.make(
+            srcdir=srcdir,
+            linkdir=linkdir,
+            statedir=statedir,
+            incremental=True,
+        )
+        assert sorted(os.listdir(linkbar)) == files
@@ -0,0 +1,50 @@
+import os
+
+import tempdirs
+
+from linkins.manifest import Manifest
+
+
+@tempdirs.makedirs()
+def test_manifest_save_load(**kwargs):
+    (statedir,) = kwargs['tempdirs_dirs']
+    options = dict([
+        ('scriptname', None),
+        ('force', False),
+        ('exclude', ['foo']),
+        ('include', []),
+    ])
+    dirs = dict([
+        ('.', dict([
+            ('mtime', 1234.5678),
+            ('inode', 42),
+            ('dirs', ['bar']),
+            ('files', ['fee']),
+            ('symlinks', []),
+        ])),
+    ])
+    links = dict([
+        ('/link/fee', '/src/fee'),
+    ])
+    manifest = Manifest('/src', '/link', options, dirs, links)
+    manifest.save(statedir)
+    loaded = Manifest.load(statedir, '/src', '/link')
+    assert loaded.options == options
+    assert loaded.dirs == dirs
+    assert loaded.links == links
+    assert isinstance(loaded.links.keys()[0], str)
+    assert Manifest.load(statedir, '/other', '/link') is None
+    assert Manifest.load(statedir, '/src', '/other') is None
+    Manifest.remove(statedir, '/src')
+    assert os.listdir(statedir) == []
+    assert Manifest.load(statedir, '/src', '/link') is None
+
+
+@tempdirs.makedirs()
+def test_manifest_corrupt(**kwargs):
+    (statedir,) = kwargs['tempdirs_dirs']
+    Manifest('/src', '/link', {}).save(statedir)
+    (name,) = os.listdir(statedir)
+    with open(os.path.join(statedir, name), 'w') as fp:
+        fp.write('{')
+    assert Manifest.load(statedir, '/src', '/link') is None
@@ -0,0 +1,201 @@
+import re
+
+from linkins import match
+
+paths = [
+    '.',
+    'foo',
+    'FOO',
+    'foo/bar',
+    'foo/bar/fee',
+    'fee',
+    'fo',
+    'foo_bar_me',
+    'foofoo',
+    '.git',
+    '.git/config',
+    'bar/.git',
+    'bar',
+    'barbar/fi',
+    'README.md',
+    'foo/README.md',
+    'foo/',
+    # $ matches before a trailing newline and . doesn't match newlines
+    'foo\n',
+    'fee\n',
+    'foo/fee\n',
+    'foo\nbar/fee',
+    '.git\n/config',
+]
+
+patterns = [
+    'foo',
+    'foo$',
+    '^foo.*me$',
+    'f.*',
+    'fe.*',
+    'b.*',
+    'foo/bar',
+    'foo.*b.*/fee',
+    r'\.git',
+    '.*/\.git$',
+    'foo|fee',
+    '(?i)foo',
+    '(foo)\\1',
+    '(?P<name>bar)(?P=name)',
+    '(?P<name>fo)o',
+    '',
+    'README\.md$',
+    r'foo\Z',
+    r'^\.git',
+    '.*/fee$',
+    '.*?/fee$',
+    r'.*/README\.md\Z',
+    '.*/fee',
+    'foo/$',
+    '.*/$',
+    '$',
+]
+
+
+def _excluded(path, exclude, include):
+    # Matching semantics before the patterns were combined
+    for exclude_regex in exclude:
+        if not exclude_regex.match(path):
+            continue
+        for include_regex in include:
+            if include_regex.match(path):
+                return False
+        return True
+    return False
+
+
+def _assert_same(exclude, include):
+    matcher = match.Matcher(exclude, include)
+    exclude_regex = [re.compile(pattern) for pattern in exclude]
+    include_regex = [re.compile(pattern) for pattern in include]
+    for path in paths:
+        expected = _excluded(path, exclude_regex, include_regex)
+        assert matcher.excluded(path) == expected, (path, exclude, include)
+
+
+def test_matcher_empty():
+    matcher = match.Matcher()
+    assert not matcher.excluded('foo')
+
+
+def test_matcher_single_patterns():
+    for pattern in patterns:
+        _assert_same([pattern], [])
+        _assert_same([pattern], [pattern])
+        _assert_same(['.*'], [pattern])
+
+
+def test_matcher_pairs_of_patterns():
+    for first in patterns:
+        for second in patterns:
+            _assert_same([first, second], [])
+            _assert_same([first], [second])
+            _assert_same(['.*'], [first, second])
+
+
+def test_matcher_all_patterns():
+    _assert_same(patterns, [])
+    _assert_same(patterns, patterns[::2])
+    _assert_same(patterns[1::2], patterns[::2])
+
+
+def test_matcher_combined():
+    matcher = match.Matcher(['fo+', 'b.*', r'\.g.t'], ['foo/ba.'])
+    assert len(matcher._exclude._regexes) == 1
+    assert len(matcher._include._regexes) == 1
+
+
+def test_matcher_separate():
+    matcher = match.Matcher(['fo+', '(?i)bar', '(fee)\\1', 'f.'])
+    assert len(matcher._exclude._regexes) == 3
+    assert matcher.excluded('BAR')
+    assert matcher.excluded('feefee')
+    assert not matcher.excluded('FOO')
+
+
+def test_matcher_prunable():
+    matcher = match.Matcher(['foo', r'\.git', 'bar$', r'fee\b', 'fi(?=x)'])
+    assert matcher.prunable('foo')
+    assert matcher.prunable('foo/bar')
+    assert matcher.prunable('.git')
+    assert not matcher.prunable('bar')
+    assert not matcher.prunable('fee')
+    assert not matcher.prunable('fix')
+    assert not matcher.prunable('fum')
+
+
+def test_matcher_prunable_include():
+    matcher = match.Matcher(['foo', 'bar'], ['foo/fee', '^bar', 'fi.*'])
+    assert not matcher.prunable('foo')
+    assert matcher.prunable('foo/fi')
+    assert not matcher.prunable('bar')
+
+
+def test_matcher_prunable_include_no_prefix():
+    matcher = match.Matcher(['foo'], ['.*/fee'])
+    assert not matcher.prunable('foo')
+
+
+def test_matcher_prunable_include_ignorecase():
+    matcher = match.Matcher(['foo'], ['(?i)FOO/fee'])
+    assert not matcher.prunable('foo')
+
+
+def test_classify():
+    assert match._classify('foo') == ('prefix', 'foo')
+    assert match._classify(r'^\.git') == ('prefix', '.git')
+    assert match._classify('foo/bar$') == ('exact', 'foo/bar')
+    assert match._classify(r'foo\Z') == ('exact', 'foo')
+    assert match._classify(r'.*/\.DS_Store$') == ('basename', '.DS_Store')
+    assert match._classify('.*?/fee$') == ('basename', 'fee')
+    for pattern in [
+            '.*/fee',
+            '.*/foo/fee$',
+            '.+/fee$',
+            'fo.',
+            '(?i)foo',
+            'foo|fee',
+            'foo$bar',
+    ]:
+        assert match._classify(pattern) == (None, None), pattern
+
+
+def test_matcher_literals():
+    matcher = match.Matcher(
+        [r'\.git', r'README\.md$', r'.*/\.DS_Store$', 'b.r'],
+        [r'\.git/config$'],
+    )
+    assert matcher._exclude._prefixes == ('.git',)
+    assert matcher._exclude._exact == set(['README.md'])
+    assert matcher._exclude._basenames == set(['.DS_Store'])
+    assert len(matcher._exclude._regexes) == 1
+    assert matcher.excluded('.gitignore')
+    assert not matcher.excluded('.git/config')
+    assert matcher.excluded('foo/.DS_Store')
+    assert not matcher.excluded('.DS_Store')
+    assert not matcher.excluded('foo/README.md')
+    assert matcher.excluded('bar')
+
+
+def test_matcher_child():
+    matcher = match.Matcher(['fee'])
+    scope = matcher.child('foo', match.Matcher(['fi', 'bar'], ['fi2']))
+    assert scope.excluded('foo/fi')
+    assert not scope.excluded('foo/fi2')
+    assert not scope.excluded('foo/fo')
+    assert not scope.excluded('foo/fee')
+    assert scope.prunable('foo/bar')
+    assert not scope.prunable('foo/baz')
+    scope = scope.child('foo/baz', match.Matcher(['fo']))
+    assert scope.excluded('foo/baz/fo')
+    assert not scope.excluded('foo/baz/fum')
+    assert not scope.excluded('foo/baz/fi')
+    top = match.Matcher().child('.', match.Matcher(['fo']))
+    assert top.excluded('fo')
+    assert not top.excluded('bar/fo')
@@ -0,0 +1,247 @@
+import os
+import errno
+
+import mock
+import pytest
+import tempdirs
+
+from linkins import plan
+
+
+def test_plan_mkdir_once():
+    linkplan = plan.LinkPlan()
+    linkplan.mkdir('/foo/bar')
+    linkplan.symlink('/src/fee', '/foo/bar/fee')
+    linkplan.mkdir('/foo/bar')
+    assert linkplan.operations == [
+        ('mkdir', '/foo/bar'),
+        ('symlink', '/src/fee', '/foo/bar/fee'),
+    ]
+    assert len(linkplan) == 2
+
+
+@tempdirs.makedirs(2)
+def test_executor_execute(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    srcfile = os.path.join(srcdir, 'fee')
+    with open(srcfile, 'w') as fp:
+        fp.write('source content')
+    oldfile = os.path.join(linkdir, 'fo')
+    with open(oldfile, 'w') as fp:
+        fp.write('old content')
+    nesteddir = os.path.join(linkdir, 'foo', 'bar')
+    linkfile = os.path.join(nesteddir, 'fee')
+    linkplan = plan.LinkPlan()
+    linkplan.unlink(oldfile)
+    linkplan.mkdir(nesteddir)
+    linkplan.symlink(srcfile, linkfile)
+    plan.Executor().execute(linkplan)
+    assert sorted(os.listdir(linkdir)) == ['foo']
+    assert os.readlink(linkfile) == srcfile
+
+
+@mock.patch('linkins.plan.log')
+def test_executor_execute_pending(fakelog):
+    linkplan = plan.LinkPlan()
+    executor = plan.DryRunExecutor()
+    linkplan.mkdir('/foo/bar')
+    executor.execute(linkplan)
+    linkplan.unlink('/foo/bar/fee')
+    executor.execute(linkplan)
+    executor.execute(linkplan)
+    mkdir = mock.call.info('Would create directory /foo/bar')
+    unlink = mock.call.info('Would remove /foo/bar/fee')
+    assert fakelog.mock_calls == [mkdir, unlink]
+    assert len(linkplan) == 2
+
+
+@tempdirs.makedirs()
+def test_executor_mkdir_exists(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    plan.Executor().mkdir(linkdir)
+    assert os.path.isdir(linkdir)
+
+
+@tempdirs.makedirs(2)
+@mock.patch('linkins.plan.log')
+def test_dry_run_executor(fakelog, **kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    linkplan = plan.LinkPlan()
+    linkplan.mkdir(os.path.join(linkdir, 'foo'))
+    linkplan.unlink(os.path.join(linkdir, 'foo', 'fee'))
+    linkplan.symlink(
+        os.path.join(srcdir, 'foo', 'fee'),
+        os.path.join(linkdir, 'foo', 'fee'),
+    )
+    plan.DryRunExecutor().execute(linkplan)
+    assert os.listdir(linkdir) == []
+    mkdir = mock.call.info(
+        'Would create directory {linkdir}/foo'.format(
+            linkdir=linkdir,
+        )
+    )
+    unlink = mock.call.info(
+        'Would remove {linkdir}/foo/fee'.format(
+            linkdir=linkdir,
+        )
+    )
+    symlink = mock.call.info(
+        'Would link {linkdir}/foo/fee to {srcdir}/foo/fee'.format(
+            linkdir=linkdir,
+            srcdir=srcdir,
+        )
+    )
+    assert fakelog.mock_calls == [mkdir, unlink, symlink]
+
+
+@mock.patch('os.path.exists')
+def test_dir_cache(fakeexists):
+    fakeexists.return_value = False
+    dircache = plan.DirCache()
+    assert not dircache.exists('/foo/bar')
+    assert not dircache.exists('/foo/bar')
+    dircache.add('/foo/bar/fee')
+    assert dircache.exists('/foo/bar/fee')
+    assert dircache.exists('/foo/bar')
+    assert dircache.exists('/foo')
+    dircache.discard('/foo/bar/fee')
+    assert not dircache.exists('/foo/bar/fee')
+    assert fakeexists.mock_calls == [mock.call('/foo/bar')]
+
+
+@tempdirs.makedirs()
+def test_executor_prune_dirs(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    for dir_ in ['foo/bar/fee', 'foo/bar/fi', 'foo/fo', 'fum']:
+        os.makedirs(os.path.join(linkdir, dir_))
+    with open(os.path.join(linkdir, 'foo', 'fo', 'file'), 'w') as fp:
+        fp.write('content')
+    paths = [
+        os.path.join(linkdir, 'foo', 'bar', 'fee'),
+        os.path.join(linkdir, 'foo', 'bar', 'fi'),
+        os.path.join(linkdir, 'foo', 'fo'),
+    ]
+    empty = plan._empty
+    with mock.patch('linkins.plan._empty') as fakeempty:
+        fakeempty.side_effect = empty
+        plan.Executor().prune_dirs(paths, linkdir)
+    checked = [call[1][0] for call in fakeempty.mock_calls]
+    assert checked == [
+        os.path.join(linkdir, 'foo', 'bar', 'fee'),
+        os.path.join(linkdir, 'foo', 'bar', 'fi'),
+        os.path.join(linkdir, 'foo', 'bar'),
+        os.path.join(linkdir, 'foo', 'fo'),
+        os.path.join(linkdir, 'foo'),
+    ]
+    assert sorted(os.listdir(linkdir)) == ['foo', 'fum']
+    assert os.listdir(os.path.join(linkdir, 'foo')) == ['fo']
+
+
+@tempdirs.makedirs()
+def test_executor_prune_dirs_not_linkdir(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    nesteddir = os.path.join(linkdir, 'foo', 'bar')
+    os.makedirs(nesteddir)
+    plan.Executor().prune_dirs([nesteddir, linkdir], linkdir)
+    assert os.path.isdir(linkdir)
+    assert os.listdir(linkdir) == []
+
+
+@tempdirs.makedirs(2)
+def test_executor_execute_opens_dirs_once(**kwargs):
+    (srcdir, linkdir) = kwargs['tempdirs_dirs']
+    foodir = os.path.join(linkdir, 'foo')
+    os.mkdir(foodir)
+    oldfile = os.path.join(foodir, 'fo')
+    with open(oldfile, 'w') as fp:
+        fp.write('old content')
+    linkplan = plan.LinkPlan()
+    linkplan.unlink(oldfile)
+    linkplan.symlink('/src/fee', os.path.join(foodir, 'fee'))
+    linkplan.symlink('/src/fi', os.path.join(foodir, 'fi'))
+    linkplan.symlink('/src/fum', os.path.join(linkdir, 'fum'))
+    osopen = os.open
+    osclose = os.close
+    with mock.patch('os.open') as fakeopen:
+        fakeopen.side_effect = osopen
+        with mock.patch('os.close') as fakeclose:
+            fakeclose.side_effect = osclose
+            plan.Executor().execute(linkplan)
+    opened = [call[1][0] for call in fakeopen.mock_calls]
+    assert opened == [foodir, linkdir]
+    assert len(fakeclose.mock_calls) == 2
+    assert sorted(os.listdir(foodir)) == ['fee', 'fi']
+    assert os.readlink(os.path.join(foodir, 'fi')) == '/src/fi'
+    assert os.readlink(os.path.join(linkdir, 'fum')) == '/src/fum'
+
+
+@tempdirs.makedirs()
+@mock.patch('linkins.dirfd.supported', False)
+def test_executor_execute_dirfd_unsupported(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    linkfile = os.path.join(linkdir, 'fee')
+    linkplan = plan.LinkPlan()
+    linkplan.symlink('/src/fee', linkfile)
+    linkplan.unlink(os.path.join(linkdir, 'fi'))
+    with mock.patch('os.open') as fakeopen:
+        plan.Executor().execute(linkplan)
+    assert fakeopen.mock_calls == []
+    assert os.readlink(linkfile) == '/src/fee'
+
+
+@tempdirs.makedirs()
+def test_executor_execute_symlink_exists(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    linkfile = os.path.join(linkdir, 'fee')
+    with open(linkfile, 'w') as fp:
+        fp.write('existing content')
+    linkplan = plan.LinkPlan()
+    linkplan.symlink('/src/fee', linkfile)
+    res = pytest.raises(
+        OSError,
+        plan.Executor().execute,
+        linkplan,
+    )
+    assert res.value.errno == errno.EEXIST
+    assert res.value.filename == linkfile
+
+
+@tempdirs.makedirs()
+def test_executor_execute_unlink_missing(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    linkplan = plan.LinkPlan()
+    linkplan.unlink(os.path.join(linkdir, 'fee'))
+    linkplan.unlink(os.path.join(linkdir, 'foo', 'fee'))
+    plan.Executor().execute(linkplan)
+    assert os.listdir(linkdir) == []
+
+
+@tempdirs.makedirs()
+def test_executor_prune_dirs_reopens(**kwargs):
+    (linkdir,) = kwargs['tempdirs_dirs']
+    foodir = os.path.join(linkdir, 'foo')
+    os.mkdir(foodir)
+    linkfile = os.path.join(foodir, 'fee')
+    linkplan = plan.LinkPlan()
+    linkplan.symlink('/src/fee', linkfile)
+    linkplan.unlink(linkfile)
+    linkplan.prune(foodir)
+    linkplan.prune_dirs(linkdir)
+    # The directory is made again after it is pruned
+    linkplan.operations.append(('mkdir', foodir))
+    linkplan.symlink('/src/fi', os.path.join(foodir, 'fi'))
+    plan.Executor().execute(linkplan)
+    assert os.listdir(foodir) == ['fi']
+
+
+@mock.patch('os.path.exists')
+def test_dir_cache_discard_beneath(fakeexists):
+    fakeexists.return_value = True
+    dircache = plan.DirCache()
+    assert dircache.exists('/foo')
+    dircache.discard('/foo')
+    assert not dircache.exists('/foo/bar')
+    assert not dircache.exists('/foo/bar/fee')
+    dircache.add('/foo/bar')
+    assert dircache.exists('/foo/bar')
+    assert fakeexists.mock_calls == [mock.call('/foo')]
@@ -1,19 +1,28 @@
+import os
 import mock
+import pytest
+import tempfile
+import threading
 import subprocess
 
 from linkins import script
 from linkins.test import util
 
 
-@mock.patch('multiprocessing.Process')
+@mock.patch('select.select')
+@mock.patch('os.read')
 @mock.patch('linkins.script.log')
 @mock.patch('subprocess.Popen')
-def test_runscript_simple(fakepopen, fakelog, fakeprocess):
+def test_runscript_simple(
+        fakepopen,
+        fakelog,
+        fakeread,
+        fakeselect,
+):
     proc = fakepopen.return_value
-    poll = proc.poll
-    poll.return_value = 0
-    read = proc.stdout.read
-    read.side_effect = iter('foo\n')
+    proc.stdout.fileno.return_value = 3
+    proc.wait.return_value = 0
+    fakeread.side_effect = ['foo\n', '']
     script.runscript('/foo/bar')
 
     popen = util.mock_call_with_name(
@@ -21,11 +30,10 @@ def test_runscript_simple(fakepopen, fakelog, fakeprocess):
         ['/foo/bar'],
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        universal_newlines=True,
     )
-    read = mock.call().stdout.read(1)
-    reads = [read]*5
+    fileno = mock.call().stdout.fileno()
     close = mock.call().stdout.close()
+    wait = mock.call().wait()
     out_log = util.mock_call_with_name(
         'info',
         'foo',
@@ -33,26 +41,39 @@ def test_runscript_simple(fakepopen, fakelog, fakeprocess):
     )
     popen_calls = [
         popen,
+        fileno,
+        close,
+        wait,
     ]
-    popen_calls += reads
-    popen_calls.append(close)
+    exit_log = util.mock_call_with_name(
+        'debug',
+        'Exited with status 0',
+        extra={'source': 'LINKINS', 'script': 'bar'},
+    )
     log_calls = [
         out_log,
+        exit_log,
     ]
+    read = mock.call(3, 65536)
+    select = mock.call([3], [], [])
     assert fakepopen.mock_calls == popen_calls
     assert fakelog.mock_calls == log_calls
-    assert fakeprocess.mock_calls == []
+    assert fakeread.mock_calls == [read, read]
+    assert fakeselect.mock_calls == [select, select]
 
 
-@mock.patch('multiprocessing.Process')
+@mock.patch('select.select')
+@mock.patch('os.read')
 @mock.patch('linkins.script.log')
 @mock.patch('subprocess.Popen')
-def test_runscript_args(fakepopen, fakelog, fakeprocess):
-    proc = fakepopen.return_value
-    poll = proc.poll
-    poll.return_value = 0
-    read = proc.stdout.read
-    read.side_effect = iter('')
+def test_runscript_args(
+        fakepopen,
+        fakelog,
+        fakeread,
+        fakeselect,
+):
+    fakepopen.return_value.wait.return_value = 0
+    fakeread.side_effect = ['']
     script.runscript('/foo/bar', 'fee', 'fi', 'fo')
 
     popen = util.mock_call_with_name(
@@ -60,132 +81,329 @@ def test_runscript_args(fakepopen, fakelog, fakeprocess):
         ['/foo/bar', 'fee', 'fi', 'fo'],
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        universal_newlines=True,
     )
-    read = mock.call().stdout.read(1)
+    fileno = mock.call().stdout.fileno()
     close = mock.call().stdout.close()
+    wait = mock.call().wait()
     popen_calls = [
         popen,
-        read,
+        fileno,
         close,
+        wait,
     ]
+    exit_log = util.mock_call_with_name(
+        'debug',
+        'Exited with status 0',
+        extra={'source': 'LINKINS', 'script': 'bar'},
+    )
     assert fakepopen.mock_calls == popen_calls
-    assert fakelog.mock_calls == []
-    assert fakeprocess.mock_calls == []
+    assert fakelog.mock_calls == [exit_log]
 
 
-@mock.patch('multiprocessing.Process')
+@mock.patch('select.select')
+@mock.patch('os.read')
 @mock.patch('linkins.script.log')
 @mock.patch('subprocess.Popen')
-def test_runscript_name(fakepopen, fakelog, fakeprocess):
-    proc = fakepopen.return_value
-    poll = proc.poll
-    poll.return_value = 0
-    read = proc.stdout.read
-    read.side_effect = iter('foo\n')
+def test_runscript_name(
+        fakepopen,
+        fakelog,
+        fakeread,
+        fakeselect,
+):
+    fakepopen.return_value.wait.return_value = 0
+    fakeread.side_effect = ['foo\n', '']
     script.runscript('/foo/bar', name='foo-name')
 
-    popen = util.mock_call_with_name(
-        '',
-        ['/foo/bar'],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
-    )
-    read = mock.call().stdout.read(1)
-    reads = [read]*5
-    close = mock.call().stdout.close()
     out_log = util.mock_call_with_name(
         'info',
         'foo',
         extra={'source': 'SCRIPT', 'script': 'foo-name'},
     )
-    popen_calls = [
-        popen,
-    ]
-    popen_calls += reads
-    popen_calls.append(close)
+    exit_log = util.mock_call_with_name(
+        'debug',
+        'Exited with status 0',
+        extra={'source': 'LINKINS', 'script': 'foo-name'},
+    )
     log_calls = [
         out_log,
+        exit_log,
     ]
-    assert fakepopen.mock_calls == popen_calls
     assert fakelog.mock_calls == log_calls
-    assert fakeprocess.mock_calls == []
 
 
-@mock.patch('multiprocessing.Process')
 @mock.patch('linkins.script.log')
 @mock.patch('subprocess.Popen')
-def test_runscript_multiprocess(fakepopen, fakelog, fakeprocess):
-    script.runscript('/foo/bar', multiprocess=True)
+def test_runscript_pool(fakepopen, fakelog):
+    pool = mock.Mock()
+    returncode = script.runscript('/foo/bar', 'fee', pool=pool)
+    assert returncode is None
     assert fakepopen.mock_calls == []
     assert fakelog.mock_calls == []
-    process = mock.call(
-        target=script._run,
-        args=(['/foo/bar'], 'bar'),
+    submit = mock.call.submit(
+        ['/foo/bar', 'fee'],
+        'bar',
+        key=None,
+        after=None,
+        locks=None,
+        done=None,
     )
-    start = mock.call().start()
-    calls = [
-        process,
-        start,
-    ]
-    assert fakeprocess.mock_calls == calls
+    assert pool.mock_calls == [submit]
+
+
+@mock.patch('linkins.script.log')
+def test_runscript_exit_status(fakelog):
+    returncode = script.runscript('sh', '-c', 'exit 3', name='foo')
+    assert returncode == 3
+    exit_log = util.mock_call_with_name(
+        'error',
+        'Exited with status 3',
+        extra={'source': 'LINKINS', 'script': 'foo'},
+    )
+    assert fakelog.mock_calls == [exit_log]
 
 
-@mock.patch('multiprocessing.Process')
+@mock.patch('linkins.script.log')
+def test_script_pool(fakelog):
+    pool = script.ScriptPool(2)
+    for status in [0, 1, 2, 0]:
+        cmd = ['sh', '-c', 'sleep 0.05; exit {status}'.format(
+            status=status,
+        )]
+        pool.submit(cmd, str(status))
+    results = pool.wait()
+    assert results == [('0', 0), ('1', 1), ('2', 2), ('0', 0)]
+
+
+@mock.patch('select.select')
+@mock.patch('os.read')
 @mock.patch('linkins.script.log')
 @mock.patch('subprocess.Popen')
-def test_runscript_while_loop(fakepopen, fakelog, fakeprocess):
-    proc = fakepopen.return_value
-    poll = proc.poll
-    poll.side_effect = [None, 0, 0]
-    read = proc.stdout.read
-    def forever():
-        yield 'f'
-        yield '\n'
-        yield ''
-        yield ''
-        raise AssertionError('Looping forever')
-    read.side_effect = forever()
+def test_runscript_chunks(
+        fakepopen,
+        fakelog,
+        fakeread,
+        fakeselect,
+):
+    fakepopen.return_value.wait.return_value = 0
+    fakeread.side_effect = [
+        'f',
+        'oo\r',
+        '\nbar\rfee\r\n\nfi',
+        '',
+    ]
     script.runscript('/foo/bar')
 
-    popen = util.mock_call_with_name(
-        '',
-        ['/foo/bar'],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        universal_newlines=True,
+    extra = {'source': 'SCRIPT', 'script': 'bar'}
+    log_calls = [
+        util.mock_call_with_name('info', 'foo', extra=extra),
+        util.mock_call_with_name('info', 'bar', extra=extra),
+        util.mock_call_with_name('info', 'fee', extra=extra),
+        util.mock_call_with_name('info', '', extra=extra),
+        util.mock_call_with_name('info', 'fi', extra=extra),
+        util.mock_call_with_name(
+            'debug',
+            'Exited with status 0',
+            extra={'source': 'LINKINS', 'script': 'bar'},
+        ),
+    ]
+    assert fakelog.mock_calls == log_calls
+
+
+@mock.patch('linkins.script.log')
+def test_runscript_real_process(fakelog):
+    script.runscript(
+        'printf',
+        'foo\\nbar\\r\\nfee\\rfi',
     )
-    popen_calls = [
-        popen,
+    lines = [call[1][0] for call in fakelog.mock_calls]
+    assert lines == ['foo', 'bar', 'fee', 'fi', 'Exited with status 0']
+
+
+def test_header():
+    (fd, path) = tempfile.mkstemp()
+    with os.fdopen(fd, 'w') as fp:
+        fp.write(
+            '#!/bin/sh\n'
+            '# linkins-after: foo bar/fee\n'
+            '#linkins-lock:  dpkg\n'
+            '# some comment\n'
+            '# linkins-after: fi\n'
+            'echo foo\n'
+            '# linkins-lock: ignored\n'
+        )
+    try:
+        assert script.header(path) == (['foo', 'bar/fee', 'fi'], ['dpkg'])
+    finally:
+        os.unlink(path)
+
+
+def _cmd(returncode=0):
+    return [
+        'sh',
+        '-c',
+        'echo start; sleep 0.05; exit {returncode}'.format(
+            returncode=returncode,
+        ),
     ]
-    read = mock.call().stdout.read(1)
-    reads = [read]*3
-    popen_calls += reads
-    poll = mock.call().poll()
-    polls = [poll]*2
-    popen_calls += polls
-    popen_calls += [
-        mock.call().stdout.read(1),
-        mock.call().poll(),
+
+
+def _events(fakelog):
+    # The start and end of each script, in the order they were logged
+    events = []
+    for (method, args, kwargs) in fakelog.mock_calls:
+        if args[0].startswith('Exited'):
+            events.append(('end', kwargs['extra']['script']))
+        elif args[0] == 'start':
+            events.append(('start', kwargs['extra']['script']))
+    return events
+
+
+@mock.patch('linkins.script.log')
+def test_script_pool_after(fakelog):
+    pool = script.ScriptPool(4)
+    pool.submit(_cmd(), 'foo', key='foo', after=['bar', 'fee'])
+    pool.submit(_cmd(), 'bar', key='bar')
+    pool.submit(_cmd(), 'fee', key='fee', after=['bar'])
+    pool.submit(_cmd(), 'fi', key='fi')
+    results = pool.wait()
+    assert results == [('foo', 0), ('bar', 0), ('fee', 0), ('fi', 0)]
+    events = _events(fakelog)
+    assert events.index(('end', 'bar')) < events.index(('start', 'fee'))
+    assert events.index(('end', 'fee')) < events.index(('start', 'foo'))
+    # fi doesn't wait
+    assert events.index(('start', 'fi')) < events.index(('end', 'bar'))
+
+
+@mock.patch('linkins.script.log')
+def test_script_pool_locks(fakelog):
+    pool = script.ScriptPool(4)
+    pool.submit(_cmd(), 'foo', locks=['dpkg'])
+    pool.submit(_cmd(), 'bar', locks=['pip'])
+    pool.submit(_cmd(), 'fee', locks=['pip', 'dpkg'])
+    pool.wait()
+    events = _events(fakelog)
+    assert events.index(('start', 'bar')) < events.index(('end', 'foo'))
+    assert events.index(('end', 'foo')) < events.index(('start', 'fee'))
+    assert events.index(('end', 'bar')) < events.index(('start', 'fee'))
+
+
+@mock.patch('linkins.script.log')
+def test_script_pool_reused_fd(fakelog):
+    # Scripts submitted while others finish can get the file
+    # descriptors they had
+    pool = script.ScriptPool(8)
+    for index in range(200):
+        pool.submit(['true'], str(index), key=str(index))
+    pool.submit(['true'], 'last', after=['199'])
+    results = pool.wait()
+    assert results == [
+        (str(index), 0) for index in range(200)
+    ] + [('last', 0)]
+
+
+@mock.patch('linkins.script.log')
+def test_script_pool_closed_output(fakelog):
+    # A script which closes its output and goes on running doesn't hold
+    # up the output of the others
+    pool = script.ScriptPool(4)
+    pool.submit(['sh', '-c', 'exec >/dev/null 2>&1; sleep 1'], 'quiet')
+    pool.submit(['sh', '-c', 'echo start; sleep 0.1; echo two'], 'loud')
+    results = pool.wait()
+    assert results == [('quiet', 0), ('loud', 0)]
+    lines = [
+        args[0]
+        for (method, args, kwargs) in fakelog.mock_calls
     ]
-    close = mock.call().stdout.close()
-    popen_calls.append(close)
+    assert lines.index('two') < lines.index('Exited with status 0')
+    events = _events(fakelog)
+    assert events.index(('end', 'loud')) < events.index(('end', 'quiet'))
 
-    f_log = util.mock_call_with_name(
-        'info',
-        'f',
-        extra={'source': 'SCRIPT', 'script': 'bar'},
+
+@mock.patch('linkins.script.log')
+def test_script_pool_failed(fakelog):
+    pool = script.ScriptPool(2)
+    pool.submit(_cmd(), 'foo', key='foo', after=['bar'])
+    pool.submit(_cmd(1), 'bar', key='bar')
+    pool.submit(_cmd(), 'fee', key='fee', after=['foo'])
+    results = pool.wait()
+    assert results == [('foo', None), ('bar', 1), ('fee', None)]
+    not_run = util.mock_call_with_name(
+        'error',
+        'Not run because bar failed',
+        extra={'source': 'LINKINS', 'script': 'foo'},
     )
-    empty_log = util.mock_call_with_name(
-        'info',
-        '',
-        extra={'source': 'SCRIPT', 'script': 'bar'},
+    not_run_fee = util.mock_call_with_name(
+        'error',
+        'Not run because foo failed',
+        extra={'source': 'LINKINS', 'script': 'fee'},
     )
-    log_calls = [
-        f_log,
-        empty_log,
+    assert fakelog.mock_calls[-2:] == [not_run, not_run_fee]
+
+
+@mock.patch('linkins.script.log')
+def test_script_pool_cycle(fakelog):
+    pool = script.ScriptPool(2)
+    pool.submit(_cmd(), 'foo', key='foo', after=['bar'])
+    pool.submit(_cmd(), 'bar', key='bar', after=['foo'])
+    pool.submit(_cmd(), 'fee', key='fee', after=['fi'])
+    results = pool.wait()
+    assert results == [('foo', None), ('bar', None), ('fee', 0)]
+    errors = [call for call in fakelog.mock_calls if call[0] == 'error']
+    assert len(errors) == 2
+
+
+@mock.patch('linkins.script.log')
+def test_script_pool_jobs(fakelog):
+    pool = script.ScriptPool(1)
+    for name in ['foo', 'bar', 'fee']:
+        pool.submit(_cmd(), name)
+    pool.wait()
+    assert _events(fakelog) == [
+        ('start', 'foo'),
+        ('end', 'foo'),
+        ('start', 'bar'),
+        ('end', 'bar'),
+        ('start', 'fee'),
+        ('end', 'fee'),
     ]
-    assert fakepopen.mock_calls == popen_calls
-    assert fakelog.mock_calls == log_calls
-    assert fakeprocess.mock_calls == []
+
+
+@mock.patch('linkins.script.log')
+def test_script_pool_output(fakelog):
+    pool = script.ScriptPool(3)
+    for name in ['foo', 'bar', 'fee']:
+        cmd = ['printf', '{name}\\r\\n{name}'.format(name=name)]
+        pool.submit(cmd, name)
+    pool.wait()
+    for name in ['foo', 'bar', 'fee']:
+        lines = [
+            args[0]
+            for (method, args, kwargs) in fakelog.mock_calls
+            if kwargs['extra']['script'] == name
+        ]
+        assert lines == [name, name, 'Exited with status 0']
+
+
+@mock.patch('linkins.script.log')
+def test_script_pool_skip(fakelog):
+    pool = script.ScriptPool(2)
+    finished = threading.Event()
+    pool.submit(
+        _cmd(),
+        'foo',
+        key='foo',
+        after=['bar'],
+        done=lambda returncode: finished.set(),
+    )
+    assert not finished.wait(0.2)
+    pool.skip('bar')
+    # foo runs before wait is called
+    assert finished.wait(5)
+    assert pool.wait() == [('foo', 0)]
+
+
+def test_script_pool_bad_script():
+    pool = script.ScriptPool(2)
+    pool.submit(['/nonexistent/foo'], 'foo')
+    with pytest.raises(OSError):
+        pool.wait()
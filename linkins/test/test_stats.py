@@ -0,0 +1,60 @@
+import os
+import json
+
+import tempdirs
+
+from linkins import stats
+
+
+def test_stats_add():
+    recorder = stats.Stats()
+    recorder.add('symlink', 0.5)
+    recorder.add('symlink', 0.25)
+    recorder.add('exclude', 0.125, 3)
+    assert recorder.as_dict() == dict([
+        ('symlink', dict([('count', 2), ('seconds', 0.75)])),
+        ('exclude', dict([('count', 3), ('seconds', 0.125)])),
+    ])
+
+
+def test_stats_table():
+    recorder = stats.Stats()
+    recorder.add('symlink', 0.5, 2)
+    recorder.add('exclude', 0.125, 1)
+    assert recorder.table().split('\n') == [
+        'operation      count    total (s)    mean (ms)',
+        'exclude            1        0.125      125.000',
+        'symlink            2        0.500      250.000',
+    ]
+
+
+@tempdirs.makedirs()
+def test_stats_save(**kwargs):
+    (statsdir,) = kwargs['tempdirs_dirs']
+    path = os.path.join(statsdir, 'stats.json')
+    recorder = stats.Stats()
+    recorder.add('rmdir', 0.5)
+    recorder.save(path)
+    with open(path) as fp:
+        assert json.load(fp) == dict([
+            ('rmdir', dict([('count', 1), ('seconds', 0.5)])),
+        ])
+
+
+def test_stats_timer():
+    with stats.timer('walk'):
+        pass
+    with stats.recording() as recorder:
+        with stats.timer('walk'):
+            pass
+        with stats.timer('exclude', 3):
+            pass
+        stats.add('script', 0.5)
+    with stats.timer('walk'):
+        pass
+    assert recorder.counts == dict([
+        ('walk', 1),
+        ('exclude', 3),
+        ('script', 1),
+    ])
+    assert recorder.times['script'] == 0.5
@@ -0,0 +1,70 @@
+import os
+import tempdirs
+
+from linkins import util
+
+
+def _split(chunks):
+    splitter = util.LineSplitter()
+    lines = []
+    for chunk in chunks:
+        lines += splitter.feed(chunk)
+    last = splitter.close()
+    if last is not None:
+        lines.append(last)
+    return lines
+
+
+def test_line_splitter_newlines():
+    lines = _split(['foo\nbar\r\nfee\rfi\n'])
+    assert lines == ['foo', 'bar', 'fee', 'fi']
+
+
+def test_line_splitter_empty_lines():
+    lines = _split(['\n\r\n\r\r\n'])
+    assert lines == ['', '', '', '']
+
+
+def test_line_splitter_partial_line():
+    lines = _split(['foo\nba', 'r'])
+    assert lines == ['foo', 'bar']
+
+
+def test_line_splitter_crlf_split():
+    lines = _split(['foo\r', '\nbar\r', '\r\n'])
+    assert lines == ['foo', 'bar', '']
+
+
+def test_line_splitter_cr_first():
+    splitter = util.LineSplitter()
+    # The line is returned before knowing if '\n' follows
+    assert splitter.feed('foo\r') == ['foo']
+    assert splitter.feed('\n') == []
+    assert splitter.feed('\n') == ['']
+    assert splitter.close() is None
+
+
+def test_line_splitter_every_split():
+    text = 'foo\r\nbar\rfee\n\r\nfi'
+    expected = ['foo', 'bar', 'fee', '', 'fi']
+    for i in range(len(text) + 1):
+        for j in range(i, len(text) + 1):
+            chunks = [text[:i], text[i:j], text[j:]]
+            assert _split(chunks) == expected, chunks
+
+
+@tempdirs.makedirs()
+def test_state(**kwargs):
+    (tempdir,) = kwargs['tempdirs_dirs']
+    path = os.path.join(tempdir, 'state', 'foo.json')
+    assert util.load_state(path, 1, 'foo') is None
+    state = dict([
+        ('version', 1),
+        ('foo', dict([('bar', ['fee'])])),
+    ])
+    util.save_state(path, state)
+    assert os.listdir(os.path.dirname(path)) == ['foo.json']
+    loaded = util.load_state(path, 1, 'foo')
+    assert loaded == state
+    assert type(loaded['foo'].keys()[0]) is str
+    assert util.load_state(path, 2, 'foo') is None
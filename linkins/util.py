@@ -1,8 +1,28 @@
 import os
+import re
+import json
+import errno
+import select
+import logging
 import contextlib
 
+try:
+    from os import scandir
+except ImportError:
+    # Python < 3.5
+    from scandir import scandir
+
+log = logging.getLogger(__name__)
+
 # Unix, Windows and old Macintosh end-of-line
 newlines = ['\n', '\r\n', '\r']
+# Longest first so '\r\n' is a single end-of-line
+_newline_regex = re.compile(
+    '|'.join(sorted(newlines, key=len, reverse=True))
+)
+
+# Bytes read at a time from a stream
+CHUNK_SIZE = 65536
 
 
 # Avoid name clash with os.path.abspath
@@ -12,20 +32,114 @@ def abs_path(path):
     return path
 
 
+def utf8(value):
+    # Paths are byte strings but json loads them as unicode
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [utf8(item) for item in value]
+    if isinstance(value, dict):
+        return dict([
+            (utf8(key), utf8(item))
+            for (key, item) in value.iteritems()
+        ])
+    return value
+
+
+def load_state(path, version, name):
+    """Return the state saved by save_state in path, or None if there
+    is no file, it is corrupt or its version isn't version. name
+    describes the file in the warning logged if it is corrupt.
+
+    """
+    try:
+        with open(path) as fp:
+            state = utf8(json.load(fp))
+    except IOError, e:
+        if e.errno != errno.ENOENT:
+            raise
+        return None
+    except ValueError:
+        log.warn(
+            'Ignoring corrupt {name} {path}'.format(
+                name=name,
+                path=path,
+            )
+        )
+        return None
+    if state.get('version') != version:
+        return None
+    return state
+
+
+def save_state(path, state):
+    # Never leave a partially written file behind
+    dirpath = os.path.dirname(path)
+    if not os.path.exists(dirpath):
+        os.makedirs(dirpath)
+    tmppath = '{path}.tmp'.format(
+        path=path,
+    )
+    with open(tmppath, 'w') as fp:
+        json.dump(state, fp)
+    os.rename(tmppath, path)
+
+
+class LineSplitter(object):
+    """Split chunks of output into lines on any of the newlines. A
+    line is returned as soon as its end-of-line is fed, even if it is
+    a '\r' which might be the first half of a '\r\n' split across
+    two chunks, in which case the '\n' is dropped from the next
+    chunk.
+
+    """
+    def __init__(self):
+        self._partial = ''
+        self._cr = False
+
+    def feed(self, chunk):
+        """Return the lines completed by chunk."""
+        if not chunk:
+            return []
+        if self._cr and chunk.startswith('\n'):
+            chunk = chunk[1:]
+        self._cr = False
+        lines = _newline_regex.split(chunk)
+        lines[0] = self._partial + lines[0]
+        self._partial = lines.pop()
+        self._cr = chunk.endswith('\r')
+        return lines
+
+    def close(self):
+        """Return the last line if it has no end-of-line, else
+        None.
+
+        """
+        partial = self._partial
+        self._partial = ''
+        if partial:
+            return partial
+        return None
+
+
 def unbuffered_stream(proc, stream='stdout'):
+    """Yield each line of proc's stream as soon as it is complete. The
+    stream's file descriptor is read directly, as much as is available
+    up to CHUNK_SIZE bytes each time it is ready, until end-of-file.
+
+    """
     stream = getattr(proc, stream)
+    fd = stream.fileno()
+    splitter = LineSplitter()
     with contextlib.closing(stream):
         while True:
-            out = []
-            last = stream.read(1)
-            # Don't loop forever
-            if last == '' and proc.poll() is not None:
+            # Ready to read means os.read won't block
+            select.select([fd], [], [])
+            chunk = os.read(fd, CHUNK_SIZE)
+            if not chunk:
                 break
-            while last not in newlines:
-                # Don't loop forever
-                if last == '' and proc.poll() is not None:
-                    break
-                out.append(last)
-                last = stream.read(1)
-            out = ''.join(out)
-            yield out
+            for line in splitter.feed(chunk):
+                yield line
+        line = splitter.close()
+        if line is not None:
+            yield line
@@ -44,6 +44,7 @@ setup(
     test_suite='nose.collector',
     install_requires=[
         'setuptools',
+        'scandir; python_version < "3.5"',
         ],
     extras_require=EXTRAS_REQUIRES,
     entry_points={